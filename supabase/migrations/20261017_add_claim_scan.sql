@@ -0,0 +1,27 @@
+-- Migration: 20261017_add_claim_scan
+-- Description: Lease one specific pending scan (the /scan path) with the same attempt accounting as claim_pending_scans.
+
+CREATE OR REPLACE FUNCTION public.claim_scan(
+    p_scan_id public.adsense_scans.id%TYPE,
+    p_worker_id TEXT,
+    p_lease_seconds INTEGER DEFAULT 300
+)
+RETURNS SETOF public.adsense_scans AS $$
+BEGIN
+    -- Counts towards the poison-scan cap exactly like a claim through the queue
+    RETURN QUERY
+    UPDATE public.adsense_scans AS s
+       SET status = 'running',
+           claimed_by = p_worker_id,
+           heartbeat_at = now(),
+           lease_expires_at = now() + make_interval(secs => p_lease_seconds),
+           claim_attempts = s.claim_attempts + 1
+     WHERE s.id = p_scan_id
+       AND s.status = 'pending'
+    RETURNING s.*;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+-- Only the worker (service role) may claim scans
+REVOKE ALL ON FUNCTION public.claim_scan FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.claim_scan TO service_role;
@@ -0,0 +1,41 @@
+-- Migration: 20261017_add_merge_scan_drafts
+-- Description: Per-page-type merge of generated trust-page drafts into adsense_scans.trust_pages_data, so the background draft fill and /regenerate-draft never overwrite each other's keys.
+
+CREATE OR REPLACE FUNCTION public.merge_scan_drafts(
+    p_scan_id public.adsense_scans.id%TYPE,
+    p_drafts JSONB,                         -- {page_type: html}
+    p_settled TEXT[] DEFAULT '{}',          -- page types to drop from drafts_pending
+    p_overwrite BOOLEAN DEFAULT true        -- false: drafts already stored win
+)
+RETURNS BOOLEAN AS $$
+BEGIN
+    UPDATE public.adsense_scans
+       SET trust_pages_data = (
+            SELECT CASE
+                       WHEN merged ? 'drafts_pending' THEN jsonb_set(merged, '{drafts_pending}', COALESCE(
+                           (SELECT jsonb_agg(pending)
+                              FROM jsonb_array_elements_text(merged->'drafts_pending') AS pending
+                             WHERE pending <> ALL (p_settled)
+                               AND NOT p_drafts ? pending),
+                           '[]'::jsonb))
+                       ELSE merged
+                   END
+              FROM (
+                    SELECT jsonb_set(
+                               COALESCE(trust_pages_data, '{}'::jsonb),
+                               '{drafts}',
+                               CASE WHEN p_overwrite
+                                    THEN COALESCE(trust_pages_data->'drafts', '{}'::jsonb) || p_drafts
+                                    ELSE p_drafts || COALESCE(trust_pages_data->'drafts', '{}'::jsonb)
+                               END
+                           ) AS merged
+                   ) AS m
+           )
+     WHERE id = p_scan_id;
+    RETURN FOUND;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+-- Only the worker (service role) writes drafts
+REVOKE ALL ON FUNCTION public.merge_scan_drafts FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.merge_scan_drafts TO service_role;
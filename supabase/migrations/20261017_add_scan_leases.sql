@@ -0,0 +1,60 @@
+-- Migration: 20261017_add_scan_leases
+-- Description: Lets several analyzer workers share the adsense_scans queue by leasing rows to one worker at a time.
+
+-- 1. Lease columns on adsense_scans
+ALTER TABLE public.adsense_scans
+    ADD COLUMN IF NOT EXISTS claimed_by TEXT,
+    ADD COLUMN IF NOT EXISTS heartbeat_at TIMESTAMP WITH TIME ZONE,
+    ADD COLUMN IF NOT EXISTS lease_expires_at TIMESTAMP WITH TIME ZONE,
+    ADD COLUMN IF NOT EXISTS claim_attempts INTEGER NOT NULL DEFAULT 0;
+
+CREATE INDEX IF NOT EXISTS adsense_scans_pending_idx
+    ON public.adsense_scans (created_at)
+    WHERE status = 'pending';
+
+CREATE INDEX IF NOT EXISTS adsense_scans_lease_idx
+    ON public.adsense_scans (lease_expires_at)
+    WHERE status = 'running';
+
+-- 2. Atomic claim: pending rows plus running rows whose worker stopped heartbeating
+CREATE OR REPLACE FUNCTION public.claim_pending_scans(
+    p_worker_id TEXT,
+    p_limit INTEGER DEFAULT 5,
+    p_lease_seconds INTEGER DEFAULT 300,
+    p_max_attempts INTEGER DEFAULT 3
+)
+RETURNS SETOF public.adsense_scans AS $$
+BEGIN
+    -- Scans that keep losing their worker (e.g. a site that crashes it) are given up on
+    UPDATE public.adsense_scans
+       SET status = 'failed',
+           claimed_by = NULL,
+           lease_expires_at = NULL
+     WHERE status = 'running'
+       AND lease_expires_at < now()
+       AND claim_attempts >= p_max_attempts;
+
+    RETURN QUERY
+    UPDATE public.adsense_scans AS s
+       SET status = 'running',
+           claimed_by = p_worker_id,
+           heartbeat_at = now(),
+           lease_expires_at = now() + make_interval(secs => p_lease_seconds),
+           claim_attempts = s.claim_attempts + 1
+      FROM (
+            SELECT id
+              FROM public.adsense_scans
+             WHERE status = 'pending'
+                OR (status = 'running' AND lease_expires_at < now())
+             ORDER BY created_at
+             LIMIT p_limit
+             FOR UPDATE SKIP LOCKED
+           ) AS claimable
+     WHERE s.id = claimable.id
+    RETURNING s.*;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+-- Only the worker (service role) may claim scans
+REVOKE ALL ON FUNCTION public.claim_pending_scans(TEXT, INTEGER, INTEGER, INTEGER) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.claim_pending_scans(TEXT, INTEGER, INTEGER, INTEGER) TO service_role;
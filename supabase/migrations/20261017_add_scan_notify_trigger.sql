@@ -0,0 +1,18 @@
+-- Migration: 20261017_add_scan_notify_trigger
+-- Description: Notifies listening analyzer workers the moment a pending scan is inserted, so they don't wait for the next poll.
+
+CREATE OR REPLACE FUNCTION public.notify_pending_scan()
+RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('adsense_scans_pending', NEW.id::text);
+    RETURN NEW;
+END;
+$$ language 'plpgsql';
+
+DROP TRIGGER IF EXISTS notify_adsense_scans_pending ON public.adsense_scans;
+
+CREATE TRIGGER notify_adsense_scans_pending
+    AFTER INSERT OR UPDATE OF status ON public.adsense_scans
+    FOR EACH ROW
+    WHEN (NEW.status = 'pending')
+    EXECUTE PROCEDURE public.notify_pending_scan();
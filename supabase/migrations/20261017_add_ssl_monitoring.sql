@@ -0,0 +1,60 @@
+-- Migration: 20261017_add_ssl_monitoring
+-- Description: Certificate-expiry monitoring for registered sites. The worker sweeps public.sites with a TLS-only probe, stores the result on the row and alerts as expiry approaches.
+
+-- 1. Last SSL result per site
+ALTER TABLE public.sites
+    ADD COLUMN IF NOT EXISTS ssl_data JSONB,                            -- latest verify_ssl()-shaped result
+    ADD COLUMN IF NOT EXISTS ssl_checked_at TIMESTAMP WITH TIME ZONE,   -- set when a worker claims the site
+    ADD COLUMN IF NOT EXISTS ssl_expires_at TIMESTAMP WITH TIME ZONE,   -- notAfter of the last certificate seen
+    ADD COLUMN IF NOT EXISTS ssl_alerted_days INTEGER;                  -- smallest alert threshold already sent for it
+
+CREATE INDEX IF NOT EXISTS sites_ssl_checked_at_idx
+    ON public.sites (ssl_checked_at NULLS FIRST);
+
+-- 2. Atomic claim: sites never checked or not checked within p_recheck_seconds.
+-- Claiming stamps ssl_checked_at, so concurrent sweeps on several workers split the table.
+CREATE OR REPLACE FUNCTION public.claim_ssl_checks(
+    p_limit INTEGER DEFAULT 500,
+    p_recheck_seconds INTEGER DEFAULT 43200
+)
+RETURNS SETOF public.sites AS $$
+BEGIN
+    RETURN QUERY
+    UPDATE public.sites AS s
+       SET ssl_checked_at = now()
+      FROM (
+            SELECT id
+              FROM public.sites
+             WHERE ssl_checked_at IS NULL
+                OR ssl_checked_at < now() - make_interval(secs => p_recheck_seconds)
+             ORDER BY ssl_checked_at NULLS FIRST
+             LIMIT p_limit
+             FOR UPDATE SKIP LOCKED
+           ) AS due
+     WHERE s.id = due.id
+    RETURNING s.*;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+-- 3. Bulk write-back of one claimed batch: [{id, ssl_data, ssl_expires_at, ssl_alerted_days}, ...]
+CREATE OR REPLACE FUNCTION public.record_ssl_checks(p_checks JSONB)
+RETURNS INTEGER AS $$
+DECLARE
+    updated INTEGER;
+BEGIN
+    UPDATE public.sites AS s
+       SET ssl_data = c.ssl_data,
+           ssl_expires_at = COALESCE(c.ssl_expires_at, s.ssl_expires_at),
+           ssl_alerted_days = c.ssl_alerted_days
+      FROM jsonb_to_recordset(p_checks) AS c(id TEXT, ssl_data JSONB, ssl_expires_at TIMESTAMP WITH TIME ZONE, ssl_alerted_days INTEGER)
+     WHERE s.id::text = c.id;
+    GET DIAGNOSTICS updated = ROW_COUNT;
+    RETURN updated;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+-- Only the worker (service role) runs the sweep
+REVOKE ALL ON FUNCTION public.claim_ssl_checks(INTEGER, INTEGER) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.claim_ssl_checks(INTEGER, INTEGER) TO service_role;
+REVOKE ALL ON FUNCTION public.record_ssl_checks(JSONB) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.record_ssl_checks(JSONB) TO service_role;
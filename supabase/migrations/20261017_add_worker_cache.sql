@@ -0,0 +1,31 @@
+-- Migration: 20261017_add_worker_cache
+-- Description: Shared result cache for the analyzer workers (PageSpeed results and other expensive lookups), keyed by namespace + hashed key.
+
+CREATE TABLE IF NOT EXISTS public.worker_cache (
+    namespace TEXT NOT NULL,             -- e.g. 'pagespeed'
+    cache_key TEXT NOT NULL,             -- sha256 of the logical key
+    value JSONB NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT timezone('utc'::text, now()) NOT NULL,
+    expires_at TIMESTAMP WITH TIME ZONE NOT NULL,
+    PRIMARY KEY (namespace, cache_key)
+);
+
+CREATE INDEX IF NOT EXISTS worker_cache_expires_at_idx ON public.worker_cache (expires_at);
+
+-- Only the worker (service role, which bypasses RLS) reads or writes this table
+ALTER TABLE public.worker_cache ENABLE ROW LEVEL SECURITY;
+
+-- Housekeeping: expired rows are never served, this just reclaims space
+CREATE OR REPLACE FUNCTION public.purge_expired_worker_cache(p_grace INTERVAL DEFAULT '7 days')
+RETURNS INTEGER AS $$
+DECLARE
+    deleted INTEGER;
+BEGIN
+    DELETE FROM public.worker_cache WHERE expires_at < now() - p_grace;
+    GET DIAGNOSTICS deleted = ROW_COUNT;
+    RETURN deleted;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+REVOKE ALL ON FUNCTION public.purge_expired_worker_cache(INTERVAL) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.purge_expired_worker_cache(INTERVAL) TO service_role;
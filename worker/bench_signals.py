@@ -0,0 +1,108 @@
+"""
+Micro-benchmark: single-pass collect_page_signals() vs the per-signal find_all()/get_text()
+traversals process_scan used to run over the homepage tree.
+
+    python bench_signals.py [paragraphs]
+"""
+import os
+import sys
+import time
+
+# Mock env vars before importing main
+os.environ.setdefault("SUPABASE_URL", "http://mock.url")
+os.environ.setdefault("SUPABASE_SERVICE_ROLE_KEY", "mock_key")
+
+from bs4 import BeautifulSoup
+import main
+
+def build_page(paragraphs: int) -> bytes:
+    blocks = []
+    for i in range(paragraphs):
+        blocks.append(
+            f"<section class='post {'modal' if i % 97 == 0 else 'card'}' id='s{i}'>"
+            f"<h{2 + i % 4}>Heading {i}</h{2 + i % 4}>"
+            f"<p>Paragraph {i} with some <b>bold</b> text and a <a href='/post-{i}'>link to post {i}</a>. "
+            f"More words follow here to make the page realistic in size.</p>"
+            f"<img src='/img/{i}.png' loading='{'lazy' if i % 2 else 'eager'}' alt='{'' if i % 5 == 0 else 'pic'}'>"
+            f"</section>"
+        )
+    return (
+        "<html><head><title>Benchmark page</title>"
+        "<meta name='description' content='A synthetic page'><meta name='viewport' content='width=device-width'>"
+        "<link rel='canonical' href='https://example.com/'><link rel='stylesheet' href='http://cdn.example.com/a.css'>"
+        "<script type='application/ld+json'>{\"@type\": \"Organization\"}</script></head><body>"
+        "<header class='sticky-top'><nav><a href='/about'>About</a> <a href='/privacy'>Privacy</a></nav></header>"
+        "<h1>Benchmark</h1>" + "".join(blocks) +
+        "<div id='cookie-banner'>We use cookies. Accept?</div></body></html>"
+    ).encode()
+
+def legacy_signals(soup) -> dict:
+    """The traversals process_scan made before the single-pass extractor, one per signal."""
+    title = soup.title.string if soup.title else None
+    meta_desc = soup.find("meta", attrs={"name": "description"})
+    canonical = soup.find("link", rel="canonical")
+    headings = {f"h{n}": len(soup.find_all(f"h{n}")) for n in range(1, 7)}
+    meta_robots = soup.find("meta", attrs={"name": "robots"})
+    all_imgs = soup.find_all("img")
+    lazy = sum(1 for img in all_imgs if img.get("loading", "").lower() == "lazy")
+    no_alt = sum(1 for img in all_imgs if not img.get("alt", "").strip())
+    json_lds = [s.string for s in soup.find_all("script", type="application/ld+json")]
+    cookie = any("cookie" in t.lower() and ("accept" in t.lower() or "consent" in t.lower() or "agree" in t.lower())
+                 for t in soup.find_all(string=True))
+    cookie = cookie or any(any(k in e.get("id", "").lower() for k in main.COOKIE_ID_MARKERS) for e in soup.find_all(attrs={"id": True}))
+    cookie = cookie or any(any(k in " ".join(e.get("class", [])).lower() for k in main.COOKIE_CLASS_MARKERS)
+                           for e in soup.find_all(attrs={"class": True}))
+    links = [(a["href"], a.get_text(strip=True).lower()) for a in soup.find_all("a", href=True)]
+    insecure = any((t.get("src") or "").startswith("http://") for t in soup.find_all(["img", "script", "iframe", "audio", "video"]))
+    insecure = insecure or any((t.get("href") or "").startswith("http://") for t in soup.find_all("link", rel="stylesheet", href=True))
+    words = len(soup.get_text(separator=' ', strip=True).split())
+    viewport = soup.find("meta", attrs={"name": "viewport"})
+    sticky = any("fixed" in n.get("style", "").lower() or "sticky" in n.get("style", "").lower()
+                 or "fixed" in " ".join(n.get("class", [])).lower() or "sticky" in " ".join(n.get("class", [])).lower()
+                 for n in soup.find_all(["nav", "header"]))
+    popups = sum(1 for e in soup.find_all(attrs={"class": True})
+                 if any(k in " ".join(e.get("class", [])).lower() for k in main.POPUP_CLASS_MARKERS))
+    text_for_keywords = soup.get_text(separator=' ', strip=True)
+    text_for_readability = soup.get_text(separator=' ', strip=True)
+    text_for_ai = soup.get_text(separator=' ', strip=True)
+    return {
+        "title": title, "description": meta_desc.get("content") if meta_desc else None,
+        "canonical": canonical.get("href") if canonical else None, "headings": headings,
+        "robots": meta_robots.get("content") if meta_robots else None, "images": (len(all_imgs), lazy, no_alt),
+        "json_ld": json_lds, "cookie": cookie, "links": links, "insecure": insecure, "words": words,
+        "viewport": viewport.get("content") if viewport else None, "sticky": sticky, "popups": popups,
+        "text": text_for_ai,
+    }
+
+def as_legacy(signals) -> dict:
+    return {
+        "title": signals.title, "description": signals.meta.get("description"), "canonical": signals.canonical,
+        "headings": signals.headings, "robots": signals.meta.get("robots"),
+        "images": (signals.image_count, signals.lazy_images, signals.images_missing_alt),
+        "json_ld": signals.json_ld, "cookie": signals.cookie_consent, "links": signals.links,
+        "insecure": signals.insecure_resources, "words": signals.word_count, "viewport": signals.meta.get("viewport"),
+        "sticky": signals.sticky_nav, "popups": signals.popup_count, "text": signals.text,
+    }
+
+def best_of(fn, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+if __name__ == "__main__":
+    paragraphs = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    html = build_page(paragraphs)
+    soup = BeautifulSoup(html.decode(), "html.parser")
+
+    assert as_legacy(main.collect_page_signals(soup)) == legacy_signals(soup), "extractor disagrees with legacy traversals"
+
+    legacy = best_of(lambda: legacy_signals(soup))
+    single = best_of(lambda: main.collect_page_signals(soup))
+    parse = best_of(lambda: BeautifulSoup(html.decode(), "html.parser"))
+    print(f"Page: {len(html) / 1024:.0f} KB, {paragraphs} sections")
+    print(f"  parse (html.parser)          {parse * 1000:8.1f} ms")
+    print(f"  legacy find_all traversals   {legacy * 1000:8.1f} ms")
+    print(f"  single-pass extractor        {single * 1000:8.1f} ms  ({legacy / single:.1f}x faster)")
@@ -2,9 +2,9 @@ import asyncio
 import os
 import datetime
 import json
-from urllib.parse import urlparse, urljoin
+from urllib.parse import urlparse, urljoin, parse_qsl, urlencode, unquote
 import httpx
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, NavigableString, CData, Tag
 from dotenv import load_dotenv
 import google.generativeai as genai
 
@@ -17,8 +17,34 @@ import re
 import ssl
 import socket
 import urllib.robotparser
+import time
+import hashlib
+import math
+import heapq
+import multiprocessing
+import zlib
+import base64
+import bisect
+import sys
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from collections import Counter, OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Optional
 from xml.etree import ElementTree as ET
 
+try:
+    import asyncpg  # Optional: only needed for LISTEN/NOTIFY scan wakeups
+except ImportError:
+    asyncpg = None
+
+try:
+    import h2  # noqa: F401 — enables HTTP/2 in httpx (installed via httpx[http2])
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
 # Load from .env.local in parent dir
 env_path = os.path.join(os.path.dirname(__file__), "..", ".env.local")
 load_dotenv(dotenv_path=env_path)
@@ -30,11 +56,1135 @@ GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 SAFE_BROWSING_API_KEY = os.getenv("NEXT_PUBLIC_GOOGLE_SAFE_BROWSING_API_KEY")
 RAPIDAPI_KEY = os.getenv("RAPIDAPI_KEY")  # RapidAPI key for supplementary data services
 OPEN_PAGERANK_API_KEY = os.getenv("OPEN_PAGERANK_API_KEY")  # Free key from openpr.info (no cost, just register)
+GOOGLE_CLIENT_ID = os.getenv("GOOGLE_CLIENT_ID")          # OAuth client the dashboard connects integrations with;
+GOOGLE_CLIENT_SECRET = os.getenv("GOOGLE_CLIENT_SECRET")  # needed here to refresh stored access tokens
+
+# Scan scheduler tuning (per worker process)
+SCAN_CONCURRENCY = int(os.getenv("SCAN_CONCURRENCY", "8"))        # process_scan slots running at once
+SCAN_QUEUE_SIZE = int(os.getenv("SCAN_QUEUE_SIZE", "16"))         # bounded backlog of fetched-but-not-started scans
+SCAN_POLL_INTERVAL = float(os.getenv("SCAN_POLL_INTERVAL", "5"))  # seconds between polls when the queue is idle
+SCAN_LEASE_SECONDS = int(os.getenv("SCAN_LEASE_SECONDS", "300"))  # claimed scans are reclaimable once the lease lapses
+SCAN_MAX_ATTEMPTS = int(os.getenv("SCAN_MAX_ATTEMPTS", "3"))       # expired leases before a scan is marked failed
+WORKER_ID = os.getenv("WORKER_ID") or f"{socket.gethostname()}-{os.getpid()}"
+# Direct Postgres connection for LISTEN/NOTIFY wakeups. Must be a session-mode connection
+# (direct db host or pooler port 5432) — transaction-mode pooling drops LISTEN registrations.
+SCAN_NOTIFY_DSN = os.getenv("SUPABASE_DB_URL") or os.getenv("DATABASE_URL")
+SCAN_NOTIFY_CHANNEL = "adsense_scans_pending"
+SCAN_SAFETY_POLL_INTERVAL = float(os.getenv("SCAN_SAFETY_POLL_INTERVAL", "60"))  # poll interval while notifications are live
+
+# Supabase REST connection pool (shared by every scan on this worker)
+SUPABASE_MAX_CONNECTIONS = int(os.getenv("SUPABASE_MAX_CONNECTIONS", "20"))
+SUPABASE_MAX_KEEPALIVE = int(os.getenv("SUPABASE_MAX_KEEPALIVE", "10"))
+SUPABASE_KEEPALIVE_EXPIRY = float(os.getenv("SUPABASE_KEEPALIVE_EXPIRY", "60"))
+
+# PageSpeed Insights budget. The daily quota is per API key, so split it across replicas.
+PSI_CONCURRENCY = int(os.getenv("PSI_CONCURRENCY", "4"))  # max PSI requests in flight on this worker
+PSI_DAILY_QUOTA = int(os.getenv("PSI_DAILY_QUOTA", "400" if PAGESPEED_API_KEY else "25"))
+PSI_MAX_DEFER = float(os.getenv("PSI_MAX_DEFER", "120"))  # longest a scan waits for quota before skipping PSI
+PSI_CACHE_TTL = int(os.getenv("PSI_CACHE_TTL", str(6 * 3600)))  # seconds a (url, strategy) result is reused
+
+# Broken-link checker
+LINK_CHECK_MAX_LINKS = int(os.getenv("LINK_CHECK_MAX_LINKS", "1000"))  # links considered per scan (cache hits are free)
+LINK_CHECK_MAX_FETCHES = int(os.getenv("LINK_CHECK_MAX_FETCHES", "100"))  # of which at most this many go over the network
+LINK_CHECK_CONCURRENCY = int(os.getenv("LINK_CHECK_CONCURRENCY", "20"))
+LINK_CHECK_PER_HOST = int(os.getenv("LINK_CHECK_PER_HOST", "4"))
+LINK_CACHE_OK_TTL = int(os.getenv("LINK_CACHE_OK_TTL", str(24 * 3600)))     # working links are re-checked daily
+LINK_CACHE_BROKEN_TTL = int(os.getenv("LINK_CACHE_BROKEN_TTL", str(3600)))  # broken ones sooner (may be transient)
+
+# WHOIS cache
+WHOIS_CREATION_TTL = int(os.getenv("WHOIS_CREATION_TTL", str(3650 * 86400)))  # creation date never changes
+WHOIS_DETAILS_TTL = int(os.getenv("WHOIS_DETAILS_TTL", str(3 * 86400)))       # registrar/expiry/status refreshed after this
+
+# Gemini policy analysis
+AI_POLICY_CACHE_TTL = int(os.getenv("AI_POLICY_CACHE_TTL", str(14 * 86400)))  # seconds an analysis of identical text is reused
+AI_DRAFT_CONCURRENCY = int(os.getenv("AI_DRAFT_CONCURRENCY", "3"))  # trust-page drafts generated at once per worker
+DRAFT_CACHE_TTL = int(os.getenv("DRAFT_CACHE_TTL", str(30 * 86400)))  # seconds a (domain, page type) draft is reused
+
+# Safe Browsing
+SAFE_BROWSING_BATCH = int(os.getenv("SAFE_BROWSING_BATCH", "500"))         # threatEntries per threatMatches:find call (API max)
+SAFE_BROWSING_MAX_URLS = int(os.getenv("SAFE_BROWSING_MAX_URLS", "2000"))  # homepage, crawled pages and links checked per scan
+SAFE_BROWSING_SAFE_TTL = int(os.getenv("SAFE_BROWSING_SAFE_TTL", "1800"))  # seconds a clean verdict is reused
+SAFE_BROWSING_LOCAL = os.getenv("SAFE_BROWSING_LOCAL", "0") == "1"     # check URLs against a locally synced hash-prefix DB
+SAFE_BROWSING_DB_DIR = os.getenv("SAFE_BROWSING_DB_DIR", "/tmp/safe_browsing")
+SAFE_BROWSING_UPDATE_INTERVAL = int(os.getenv("SAFE_BROWSING_UPDATE_INTERVAL", "1800"))  # seconds between list syncs
+
+# TLS probe
+TLS_PROBE_TIMEOUT = float(os.getenv("TLS_PROBE_TIMEOUT", "6"))
+TLS_CERT_CACHE_TTL = int(os.getenv("TLS_CERT_CACHE_TTL", "3600"))  # seconds a host's last-seen certificate is trusted without a handshake
+
+# Google integrations (Search Console / AdSense)
+GOOGLE_DATA_CACHE_TTL = int(os.getenv("GOOGLE_DATA_CACHE_TTL", "900"))              # seconds a (user, property) result is reused
+GOOGLE_TOKEN_REFRESH_MARGIN = int(os.getenv("GOOGLE_TOKEN_REFRESH_MARGIN", "300"))  # refresh access tokens this long before expiry
+
+# Certificate expiry monitor
+SSL_MONITOR_INTERVAL = int(os.getenv("SSL_MONITOR_INTERVAL", "0"))         # seconds between sweeps on this worker; 0 = only via POST /monitor/ssl
+SSL_MONITOR_RECHECK = int(os.getenv("SSL_MONITOR_RECHECK", "43200"))       # a site is probed at most once per this many seconds
+SSL_MONITOR_CONCURRENCY = int(os.getenv("SSL_MONITOR_CONCURRENCY", "200"))  # TLS handshakes in flight during a sweep
+SSL_MONITOR_BATCH = int(os.getenv("SSL_MONITOR_BATCH", "500"))             # sites claimed per round trip
+SSL_ALERT_DAYS = sorted((int(d) for d in os.getenv("SSL_ALERT_DAYS", "30,14,7,1").split(",") if d.strip()), reverse=True)
+
+# Deep crawl
+CRAWL_MAX_PAGES = int(os.getenv("CRAWL_MAX_PAGES", "50"))
+CRAWL_BLOOM_CAPACITY = int(os.getenv("CRAWL_BLOOM_CAPACITY", "0"))  # >0 swaps the exact seen-set for a Bloom filter
+CRAWL_CONCURRENCY = int(os.getenv("CRAWL_CONCURRENCY", "10"))     # page fetches in flight per scan
+CRAWL_PER_HOST = int(os.getenv("CRAWL_PER_HOST", "4"))             # of which at most this many against one host (multi-host frontiers)
+CRAWL_TIME_BUDGET = float(os.getenv("CRAWL_TIME_BUDGET", "45"))    # seconds before in-flight fetches are cancelled
+FETCH_MAX_BYTES = int(os.getenv("FETCH_MAX_BYTES", str(2 * 1024 * 1024)))  # page bodies are truncated past this
+
+# Sitemaps
+SITEMAP_MAX_DEPTH = int(os.getenv("SITEMAP_MAX_DEPTH", "2"))        # sitemap-index levels followed below a root sitemap
+SITEMAP_MAX_FILES = int(os.getenv("SITEMAP_MAX_FILES", "25"))       # sitemap files read per scan
+SITEMAP_URL_BUDGET = int(os.getenv("SITEMAP_URL_BUDGET", "200000")) # <url> entries counted before reading stops
+SITEMAP_MAX_BYTES = int(os.getenv("SITEMAP_MAX_BYTES", str(50 * 1024 * 1024)))  # uncompressed cap per file (protocol limit)
+SITEMAP_KEEP_ENTRIES = int(os.getenv("SITEMAP_KEEP_ENTRIES", "1000"))  # (loc, lastmod, priority) entries kept for the crawl
+SITEMAP_TIME_BUDGET = float(os.getenv("SITEMAP_TIME_BUDGET", "15"))  # seconds of sitemap reading the crawl waits for
+
+# HTML parsing off the event loop
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", str(min(4, os.cpu_count() or 1))))  # 0 parses everything inline
+PARSE_INLINE_MAX_BYTES = int(os.getenv("PARSE_INLINE_MAX_BYTES", "65536"))          # smaller pages skip the pool round trip
 
 
 if not SUPABASE_URL or not SUPABASE_KEY:
     raise ValueError("CRITICAL: Missing SUPABASE_SERVICE_ROLE_KEY or SUPABASE_URL in your environment variables. Please add the service_role secret appropriately.")
 
+# ============================================================
+# Scan Document Store
+# ============================================================
+
+def normalize_url(url: str) -> str:
+    """Canonical form used as a cache key: lowercase scheme/host, no default port, no fragment, '/' for empty path."""
+    parsed = urlparse(url.strip())
+    scheme = (parsed.scheme or "https").lower()
+    host = (parsed.hostname or "").lower()
+    port = parsed.port
+    netloc = host if not port or (scheme, port) in (("http", 80), ("https", 443)) else f"{host}:{port}"
+    path = parsed.path or "/"
+    return f"{scheme}://{netloc}{path}" + (f"?{parsed.query}" if parsed.query else "")
+
+class FetchedDocument:
+    """One downloaded response: bytes, headers and lazily decoded text shared by every reader."""
+
+    __slots__ = ("url", "final_url", "status_code", "headers", "content", "encoding", "history_length",
+                 "truncated", "skipped", "_text")
+
+    def __init__(self, url, response, content: bytes = None, truncated: bool = False, skipped: bool = False):
+        self.url = url
+        self.final_url = str(response.url)
+        self.status_code = response.status_code
+        self.headers = response.headers
+        self.content = response.content if content is None else content
+        self.encoding = response.encoding
+        self.history_length = len(response.history)
+        self.truncated = truncated  # body cut at FETCH_MAX_BYTES
+        self.skipped = skipped      # non-HTML body never downloaded (html_only fetch)
+        self._text = None
+
+    @property
+    def text(self) -> str:
+        if self._text is None:
+            self._text = self.content.decode(self.encoding or "utf-8", errors="replace")
+        return self._text
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise httpx.HTTPStatusError(f"HTTP {self.status_code} for {self.final_url}", request=None, response=None)
+
+HTML_CONTENT_TYPES = ("text/html", "application/xhtml+xml")
+# Linked files the crawler never needs to download to judge a site
+SKIP_EXTENSIONS = {
+    ".pdf", ".zip", ".gz", ".tgz", ".rar", ".7z", ".tar", ".exe", ".dmg", ".apk", ".msi", ".iso", ".bin",
+    ".jpg", ".jpeg", ".png", ".gif", ".webp", ".svg", ".ico", ".bmp", ".tif", ".tiff", ".avif",
+    ".mp3", ".mp4", ".m4a", ".wav", ".ogg", ".webm", ".mov", ".avi", ".mkv",
+    ".doc", ".docx", ".xls", ".xlsx", ".ppt", ".pptx", ".odt", ".csv",
+    ".css", ".js", ".json", ".woff", ".woff2", ".ttf", ".eot",
+}
+
+def is_binary_asset_url(url: str) -> bool:
+    path = urlparse(url).path.lower()
+    return os.path.splitext(path)[1] in SKIP_EXTENSIONS
+
+async def fetch_document(client, url: str, timeout: float, max_bytes: int = FETCH_MAX_BYTES,
+                         html_only: bool = False, stats: Counter = None) -> FetchedDocument:
+    """
+    Streaming GET that never holds more than max_bytes of body. With html_only, a response
+    whose Content-Type is not HTML is abandoned right after the headers. Bytes read off the
+    wire and bytes not downloaded (from Content-Length) are added to `stats`.
+    """
+    stats = stats if stats is not None else Counter()
+    async with client.stream("GET", url, timeout=timeout) as response:
+        try:
+            declared = int(response.headers.get("content-length") or 0)
+        except ValueError:
+            declared = 0
+        content_type = response.headers.get("content-type", "").lower()
+        if html_only and content_type and not any(t in content_type for t in HTML_CONTENT_TYPES):
+            stats["aborted_non_html"] += 1
+            stats["bytes_avoided"] += declared
+            return FetchedDocument(url, response, content=b"", skipped=True)
+
+        chunks = []
+        size = 0
+        truncated = False
+        async for chunk in response.aiter_bytes():
+            chunks.append(chunk)
+            size += len(chunk)
+            if size >= max_bytes:
+                truncated = size > max_bytes or declared > max_bytes
+                break
+        # Wire bytes (compressed); responses that arrive pre-read report 0, so fall back to the body size
+        downloaded = response.num_bytes_downloaded or size
+        stats["bytes_downloaded"] += downloaded
+        if truncated:
+            stats["truncated"] += 1
+            stats["bytes_avoided"] += max(0, declared - downloaded)
+        return FetchedDocument(url, response, content=b"".join(chunks)[:max_bytes], truncated=truncated)
+
+class ScanDocumentStore:
+    """
+    Per-scan fetch-once cache keyed by normalized URL. The homepage, robots.txt and anything
+    else several stages need is downloaded once, then read from here by the
+    enrichment helpers instead of each opening its own client and re-fetching.
+    Concurrent requests for the same URL share a single in-flight fetch.
+    """
+
+    def __init__(self, client=None):
+        self.client = client
+        self._docs = {}
+        self.transfer = Counter()  # per-scan bytes downloaded/avoided, shared with the crawl fetches
+
+    def _key(self, url):
+        return normalize_url(url)
+
+    def peek(self, url):
+        """Return an already-downloaded document without fetching."""
+        fut = self._docs.get(self._key(url))
+        if fut is not None and fut.done() and not fut.cancelled() and fut.exception() is None:
+            return fut.result()
+        return None
+
+    async def _fetch(self, url, timeout):
+        if self.client is not None and not self.client.is_closed:
+            doc = await fetch_document(self.client, url, timeout, stats=self.transfer)
+        else:
+            async with httpx.AsyncClient(verify=False, follow_redirects=True) as client:
+                doc = await fetch_document(client, url, timeout, stats=self.transfer)
+        # Redirect targets resolve to the same document (e.g. target_url -> final_url)
+        self._docs.setdefault(self._key(doc.final_url), self._docs[self._key(url)])
+        return doc
+
+    async def get(self, url, timeout=15.0) -> FetchedDocument:
+        """Fetch (or reuse) a document. Network errors propagate; HTTP error statuses do not."""
+        key = self._key(url)
+        fut = self._docs.get(key)
+        if fut is None:
+            fut = asyncio.ensure_future(self._fetch(url, timeout))
+            self._docs[key] = fut
+        return await asyncio.shield(fut)
+
+# ============================================================
+# Crawl Frontier
+# ============================================================
+
+TRACKING_PARAMS = {"gclid", "fbclid", "msclkid", "dclid", "yclid", "mc_cid", "mc_eid", "_ga", "_gl"}
+
+def crawl_url_key(url: str) -> str:
+    """
+    Dedup key for the crawler: normalize_url() plus dropping utm_*/click-id parameters, sorting
+    the remaining query and ignoring a trailing slash, so /about, /about/, /about#team and
+    /about?utm_source=x all count as one page. Path case is kept — most servers treat it as significant.
+    """
+    try:
+        parsed = urlparse(normalize_url(url))
+    except ValueError:
+        # Invalid port or IPv6 literal: there is no canonical form, so key the URL as written
+        return url.strip().split("#", 1)[0]
+    query = [(k, v) for k, v in parse_qsl(parsed.query, keep_blank_values=True)
+             if not k.lower().startswith("utm_") and k.lower() not in TRACKING_PARAMS]
+    path = parsed.path.rstrip("/") or "/"
+    return f"{parsed.scheme}://{parsed.netloc}{path}" + (f"?{urlencode(sorted(query))}" if query else "")
+
+# Archive/listing pages: exempt from the thin-content check and crawled after real content
+LOW_VALUE_PATH_MARKERS = ("/tag/", "/category/", "/author/", "/search")
+UTILITY_PATH_MARKERS = ("/contact", "/about") + LOW_VALUE_PATH_MARKERS
+PAGINATION_RE = re.compile(r"/page/\d+|[?&](page|paged|p)=\d+", re.IGNORECASE)
+
+def crawl_priority(url: str, depth: int = 1, lastmod: str = None, priority: float = None, now: datetime.datetime = None) -> float:
+    """
+    Frontier priority (lower is crawled first) for a homepage link or sitemap entry. Starts from
+    the link depth, adds a little per path segment, subtracts for a high sitemap <priority> and a
+    recent <lastmod>, and pushes listing/pagination pages behind everything else (the penalties
+    outweigh any sitemap hint).
+    """
+    try:
+        parsed = urlparse(url)
+    except ValueError:
+        return float(depth)  # unparsable; the frontier will refuse it anyway
+    path = parsed.path.lower()
+    score = depth + 0.25 * len([segment for segment in path.split("/") if segment])
+    if priority is not None:
+        score -= 2 * (min(max(priority, 0.0), 1.0) - 0.5)
+    if lastmod:
+        try:
+            age_days = ((now or datetime.datetime.now(datetime.timezone.utc)) - parse_iso_timestamp(lastmod)).days
+            score -= max(0.0, 1 - max(age_days, 0) / 365)
+        except (ValueError, TypeError):
+            pass
+    if any(marker in path for marker in LOW_VALUE_PATH_MARKERS):
+        score += 10
+    elif PAGINATION_RE.search(parsed.path + ("?" + parsed.query if parsed.query else "")):
+        score += 5
+    return score
+
+class BloomFilter:
+    """Fixed-size probabilistic set: no false negatives, ~error_rate false positives, no removal."""
+
+    def __init__(self, capacity: int, error_rate: float = 0.001):
+        capacity = max(1, capacity)
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item: str):
+        # Double hashing (Kirsch–Mitzenmacher) from one 128-bit digest
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "big")
+        h2 = int.from_bytes(digest[8:], "big") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hash_count))
+
+    def add(self, item: str):
+        for pos in self._positions(item):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item))
+
+class CrawlFrontier:
+    """
+    URLs waiting to be crawled for one scan. Every URL is canonicalized once on the way in and
+    checked against a single seen-set (exact, or a Bloom filter for very large sites), so
+    deduplication is O(1) per discovered link. Pending URLs sit in a heap ordered by priority
+    (lower first; defaults to link depth) with insertion order as the tie-break.
+    """
+
+    def __init__(self, allowed_host: str = None, bloom_capacity: int = CRAWL_BLOOM_CAPACITY):
+        self.allowed_host = allowed_host.lower() if allowed_host else None
+        self.seen = BloomFilter(bloom_capacity) if bloom_capacity > 0 else set()
+        self._heap = []
+        self._seq = 0
+        self.stats = Counter(enqueued=0, visited=0, skipped=0)
+
+    def mark_seen(self, url: str):
+        """Record a URL that was fetched outside the frontier (e.g. the homepage)."""
+        self.seen.add(crawl_url_key(url))
+
+    def add(self, url: str, depth: int = 0, priority: float = None) -> bool:
+        try:
+            parsed = urlparse(url)
+            parsed.port  # raises for a port that is not a number in range
+        except ValueError:
+            self.stats["skipped"] += 1
+            return False
+        if parsed.scheme not in ("http", "https") or (self.allowed_host and (parsed.hostname or "") != self.allowed_host):
+            self.stats["skipped"] += 1
+            return False
+        if is_binary_asset_url(url):
+            self.stats["skipped_assets"] += 1
+            return False
+        key = crawl_url_key(url)
+        if key in self.seen:
+            self.stats["skipped"] += 1
+            return False
+        self.seen.add(key)
+        # Fetch the URL as linked (minus the fragment) — stripping the slash could cost a redirect
+        heapq.heappush(self._heap, (depth if priority is None else priority, self._seq, url.split("#", 1)[0], depth))
+        self._seq += 1
+        self.stats["enqueued"] += 1
+        return True
+
+    def pop(self):
+        """Next (url, depth) to crawl, or None when the frontier is empty."""
+        if not self._heap:
+            return None
+        _, _, url, depth = heapq.heappop(self._heap)
+        self.stats["visited"] += 1
+        return url, depth
+
+    def __len__(self):
+        return len(self._heap)
+
+async def crawl_pages(frontier: CrawlFrontier, fetch_page, max_pages: int, concurrency: int = CRAWL_CONCURRENCY,
+                      per_host: int = None, time_budget: float = CRAWL_TIME_BUDGET, counts=None):
+    """
+    Sliding-window crawl: yields (result, depth) as each fetch completes and immediately starts
+    the next URL from the frontier, so one slow page never holds finished slots idle. Links the
+    caller adds to the frontier while handling a result are picked up on the next refill.
+    At most `concurrency` fetches run at once, `per_host` of them against the same host (all of
+    them when the frontier only admits one host, else CRAWL_PER_HOST). A URL whose host is at
+    its limit waits outside the window, so it never holds a slot another host could use. When
+    `time_budget` runs out, in-flight fetches are cancelled and the crawl ends with what it has.
+    Only results for which `counts(result)` is true (default: all) use up `max_pages`.
+    """
+    if per_host is None:
+        per_host = concurrency if frontier.allowed_host else CRAWL_PER_HOST
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + time_budget
+    host_active = Counter()
+    waiting = []      # popped URLs whose host was at its limit, in frontier order
+    in_flight = {}    # task -> host
+    counted = 0
+
+    def next_url():
+        for i, (url, depth, host) in enumerate(waiting):
+            if host_active[host] < per_host:
+                return waiting.pop(i)
+        while frontier:
+            url, depth = frontier.pop()
+            host = urlparse(url).hostname or ""
+            if host_active[host] < per_host:
+                return url, depth, host
+            waiting.append((url, depth, host))
+        return None
+
+    async def fetch_one(url, depth):
+        return await fetch_page(url), depth
+
+    try:
+        while True:
+            # In-flight fetches are assumed to count until their result says otherwise
+            while counted + len(in_flight) < max_pages and len(in_flight) < concurrency:
+                item = next_url()
+                if item is None:
+                    break
+                url, depth, host = item
+                host_active[host] += 1
+                in_flight[asyncio.ensure_future(fetch_one(url, depth))] = host
+            if not in_flight:
+                return
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                frontier.stats["budget_exhausted"] += 1
+                return
+            done, _ = await asyncio.wait(in_flight, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                host_active[in_flight.pop(task)] -= 1
+                result = task.result()
+                if counts is None or counts(result[0]):
+                    counted += 1
+                yield result
+    finally:
+        # Popped but never started: not visited after all
+        frontier.stats["visited"] -= len(waiting)
+        frontier.stats["cancelled"] += len(in_flight)
+        for task in in_flight:
+            task.cancel()
+        if in_flight:
+            await asyncio.gather(*in_flight, return_exceptions=True)
+
+# ============================================================
+# Sitemaps
+# ============================================================
+
+# Sitemaps are read incrementally: the body is fed chunk by chunk (gunzipped on the fly when
+# it is a .xml.gz) into an XMLPullParser, and every <url>/<sitemap> element is dropped from
+# the tree as soon as it has been counted, so memory stays flat whatever the sitemap size.
+
+def xml_local_name(tag) -> str:
+    # "{http://www.sitemaps.org/schemas/sitemap/0.9}loc" -> "loc"
+    return tag.rsplit("}", 1)[-1].lower() if isinstance(tag, str) else ""
+
+@dataclass
+class SitemapFile:
+    url: str
+    depth: int = 0
+    status_code: Optional[int] = None
+    root: str = ""            # local name of the document element: urlset / sitemapindex
+    url_count: int = 0
+    child_count: int = 0      # <sitemap> entries of an index
+    size: int = 0             # uncompressed bytes parsed
+    gzipped: bool = False
+    truncated: bool = False   # stopped at SITEMAP_MAX_BYTES or the URL budget
+    error: Optional[str] = None
+
+    @property
+    def exists(self) -> bool:
+        return self.status_code == 200 and self.size > 0
+
+    @property
+    def is_valid(self) -> bool:
+        return self.root in ("urlset", "sitemapindex") and self.error is None
+
+@dataclass
+class SitemapResult:
+    files: list = field(default_factory=list)
+    url_count: int = 0
+    entries: list = field(default_factory=list)  # (loc, lastmod, priority), first SITEMAP_KEEP_ENTRIES only
+    truncated: bool = False   # budget, file cap or depth left sitemaps/URLs unread
+
+    @property
+    def is_index(self) -> bool:
+        return any(f.root == "sitemapindex" for f in self.files)
+
+async def read_sitemap_file(client, sitemap: SitemapFile, result: SitemapResult, url_budget: int,
+                            keep: int, timeout: float = 8.0, max_bytes: int = SITEMAP_MAX_BYTES,
+                            stats: Counter = None) -> list:
+    """Stream one sitemap into `result`; returns the child sitemap URLs of an index."""
+    children = []
+    parser = ET.XMLPullParser(events=("start", "end"))
+    root = None
+    decompressor = None
+    async with client.stream("GET", sitemap.url, timeout=timeout) as response:
+        sitemap.status_code = response.status_code
+        if response.status_code != 200:
+            return children
+        async for chunk in response.aiter_bytes():
+            if not chunk:
+                continue
+            if sitemap.size == 0 and decompressor is None and chunk[:2] == b"\x1f\x8b":
+                # Raw .xml.gz (Content-Encoding: gzip is already undone by httpx)
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                sitemap.gzipped = True
+            if decompressor is not None:
+                try:
+                    chunk = decompressor.decompress(chunk, max_bytes - sitemap.size + 1)
+                except zlib.error as e:
+                    sitemap.error = f"gzip: {e}"
+                    break
+            sitemap.size += len(chunk)
+            if sitemap.size > max_bytes:
+                sitemap.truncated = True
+                break
+            try:
+                parser.feed(chunk)
+                for event, elem in parser.read_events():
+                    if event == "start":
+                        if root is None:
+                            root = elem
+                            sitemap.root = xml_local_name(elem.tag)
+                        continue
+                    tag = xml_local_name(elem.tag)
+                    if tag == "url":
+                        sitemap.url_count += 1
+                        result.url_count += 1
+                        if len(result.entries) < keep:
+                            loc = lastmod = priority = None
+                            for child in elem:
+                                name = xml_local_name(child.tag)
+                                if name == "loc":
+                                    loc = (child.text or "").strip()
+                                elif name == "lastmod":
+                                    lastmod = (child.text or "").strip() or None
+                                elif name == "priority":
+                                    try:
+                                        priority = float(child.text)
+                                    except (TypeError, ValueError):
+                                        pass
+                            if loc:
+                                result.entries.append((loc, lastmod, priority))
+                    elif tag == "sitemap":
+                        sitemap.child_count += 1
+                        for child in elem:
+                            if xml_local_name(child.tag) == "loc" and child.text and child.text.strip():
+                                children.append(child.text.strip())
+                    else:
+                        continue
+                    # Counted: drop it (and anything already attached to the root) from the tree
+                    root.clear()
+                    if result.url_count >= url_budget:
+                        sitemap.truncated = True
+                        break
+            except ET.ParseError as e:
+                sitemap.error = str(e)
+                break
+            if sitemap.truncated:
+                break
+        if stats is not None:
+            stats["bytes_downloaded"] += response.num_bytes_downloaded
+    if sitemap.error is None and not sitemap.truncated:
+        try:
+            parser.close()
+        except ET.ParseError as e:
+            sitemap.error = str(e)
+    return children
+
+async def read_sitemaps(client, roots: list, max_depth: int = SITEMAP_MAX_DEPTH, url_budget: int = SITEMAP_URL_BUDGET,
+                        max_files: int = SITEMAP_MAX_FILES, keep: int = SITEMAP_KEEP_ENTRIES,
+                        timeout: float = 8.0, time_budget: float = SITEMAP_TIME_BUDGET,
+                        stats: Counter = None) -> SitemapResult:
+    """
+    Read the root sitemaps (e.g. /sitemap.xml plus robots.txt `Sitemap:` lines) breadth-first,
+    following sitemap indexes up to max_depth levels, reading at most max_files files and
+    stopping once url_budget <url> entries have been counted or time_budget seconds have
+    passed. Counts are exact for what was read; result.truncated says whether anything was
+    left unread.
+    """
+    deadline = time.monotonic() + time_budget
+    result = SitemapResult()
+    seen = set()
+    queue = deque((url, 0) for url in roots)
+    while queue:
+        url, depth = queue.popleft()
+        key = normalize_url(url)
+        if key in seen:
+            continue
+        seen.add(key)
+        remaining = deadline - time.monotonic()
+        if len(result.files) >= max_files or result.url_count >= url_budget or remaining <= 0:
+            result.truncated = True
+            break
+        sitemap = SitemapFile(url, depth)
+        result.files.append(sitemap)
+        try:
+            children = await asyncio.wait_for(
+                read_sitemap_file(client, sitemap, result, url_budget, keep, timeout, stats=stats), remaining)
+        except asyncio.TimeoutError:
+            sitemap.error = "time budget exhausted"
+            result.truncated = True
+            break
+        except Exception as e:
+            sitemap.error = str(e) or type(e).__name__
+            continue
+        result.truncated = result.truncated or sitemap.truncated
+        if children and depth >= max_depth:
+            result.truncated = True
+            continue
+        queue.extend((child, depth + 1) for child in children)
+    return result
+
+# ============================================================
+# Limiters, Budgets, Caches & Metrics
+# ============================================================
+
+# Process-wide counters, exposed on /metrics
+METRICS = Counter()
+
+# Process-wide concurrency limiters, created lazily so they bind to the running event loop
+_limiters = {}
+
+def get_limiter(name: str, limit: int) -> asyncio.Semaphore:
+    limiter = _limiters.get(name)
+    if limiter is None:
+        limiter = _limiters[name] = asyncio.Semaphore(max(1, limit))
+    return limiter
+
+def parse_iso_timestamp(value: str) -> datetime.datetime:
+    """Parse Postgres/ISO timestamps (any fractional-second precision, 'Z' suffix) on Python 3.10."""
+    value = value.strip().replace("Z", "+00:00")
+    value = re.sub(r"\.(\d+)", lambda m: "." + m.group(1)[:6].ljust(6, "0"), value, count=1)
+    parsed = datetime.datetime.fromisoformat(value)
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=datetime.timezone.utc)
+
+class TokenBucket:
+    """
+    Request budget refilled continuously at `per_day` tokens per day, holding at most `capacity`.
+    Callers wait for a token (up to a limit) instead of firing requests that would only come
+    back as 429s; `pause()` stops all spending after the upstream API reports rate limiting.
+    """
+
+    def __init__(self, per_day: int, capacity: int = None):
+        self.rate = max(1, per_day) / 86400.0
+        self.capacity = float(capacity if capacity is not None else max(1, per_day))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    @property
+    def remaining(self) -> int:
+        self._refill()
+        return int(self.tokens)
+
+    def wait_time(self) -> float:
+        """Seconds until a token can be spent."""
+        self._refill()
+        pause = max(0.0, self.paused_until - time.monotonic())
+        deficit = max(0.0, 1.0 - self.tokens) / self.rate
+        return max(pause, deficit)
+
+    async def acquire(self, max_wait: float) -> bool:
+        """Spend one token, waiting up to max_wait seconds for one. Returns False if it would take longer."""
+        while True:
+            wait = self.wait_time()
+            if wait <= 0:
+                self.tokens -= 1
+                return True
+            if wait > max_wait:
+                return False
+            await asyncio.sleep(wait)
+            max_wait -= wait
+
+    def pause(self, seconds: float):
+        # Only the pause gates spending: draining the tokens as well would leave a deficit of
+        # 1/rate seconds (minutes to an hour at daily quotas) on top of it
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+class ResultCache:
+    """
+    Two-level TTL cache: a bounded in-process LRU in front of the shared `worker_cache` table,
+    so results survive restarts and are shared between worker replicas. Keys are hashed, values
+    must be JSON-serialisable. Hits and misses are counted in METRICS under the namespace.
+    """
+
+    def __init__(self, namespace: str, ttl: int, max_entries: int = 1024, persistent: bool = True):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.persistent = persistent
+        self._memory = OrderedDict()   # cache_key -> (value, expires_at epoch seconds)
+
+    def _cache_key(self, key) -> str:
+        raw = key if isinstance(key, str) else json.dumps(key, sort_keys=True)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _remember(self, cache_key, value, expires_at):
+        self._memory[cache_key] = (value, expires_at)
+        self._memory.move_to_end(cache_key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    async def get_entry(self, key):
+        """Return (value, expires_at) even if expired, or None if nothing is stored."""
+        cache_key = self._cache_key(key)
+        entry = self._memory.get(cache_key)
+        if entry is not None:
+            self._memory.move_to_end(cache_key)
+            return entry
+        if not self.persistent:
+            return None
+        try:
+            client = get_supabase_client()
+            r = await client.get(
+                "/worker_cache",
+                params={"namespace": f"eq.{self.namespace}", "cache_key": f"eq.{cache_key}", "select": "value,expires_at"},
+            )
+            r.raise_for_status()
+            rows = r.json()
+        except Exception as e:
+            print(f"[Cache:{self.namespace}] Read failed: {e}", flush=True)
+            return None
+        if not rows:
+            return None
+        expires_at = parse_iso_timestamp(rows[0]["expires_at"]).timestamp()
+        entry = (rows[0]["value"], expires_at)
+        self._remember(cache_key, *entry)
+        return entry
+
+    async def get(self, key):
+        entry = await self.get_entry(key)
+        if entry is not None and entry[1] > time.time():
+            METRICS[f"cache.{self.namespace}.hits"] += 1
+            return entry[0]
+        METRICS[f"cache.{self.namespace}.misses"] += 1
+        return None
+
+    async def get_many(self, keys: list, chunk_size: int = 100) -> dict:
+        """Fresh values for many keys: memory first, then one table query per chunk of misses."""
+        found = {}
+        pending = {}
+        now = time.time()
+        for key in keys:
+            cache_key = self._cache_key(key)
+            entry = self._memory.get(cache_key)
+            if entry is not None:
+                self._memory.move_to_end(cache_key)
+                if entry[1] > now:
+                    found[key] = entry[0]
+            elif self.persistent:
+                pending[cache_key] = key
+        cache_keys = list(pending)
+        for start in range(0, len(cache_keys), chunk_size):
+            chunk = cache_keys[start:start + chunk_size]
+            try:
+                client = get_supabase_client()
+                r = await client.get(
+                    "/worker_cache",
+                    params={"namespace": f"eq.{self.namespace}", "cache_key": f"in.({','.join(chunk)})",
+                            "select": "cache_key,value,expires_at"},
+                )
+                r.raise_for_status()
+                rows = r.json()
+            except Exception as e:
+                print(f"[Cache:{self.namespace}] Read failed: {e}", flush=True)
+                continue
+            for row in rows:
+                expires_at = parse_iso_timestamp(row["expires_at"]).timestamp()
+                self._remember(row["cache_key"], row["value"], expires_at)
+                if expires_at > now and row["cache_key"] in pending:
+                    found[pending[row["cache_key"]]] = row["value"]
+        METRICS[f"cache.{self.namespace}.hits"] += len(found)
+        METRICS[f"cache.{self.namespace}.misses"] += len(keys) - len(found)
+        return found
+
+    async def set_many(self, items: list, chunk_size: int = 500):
+        """Store (key, value, ttl) triples with one upsert per chunk; ttl None means the default."""
+        rows = []
+        for key, value, ttl in items:
+            cache_key = self._cache_key(key)
+            expires_at = time.time() + (ttl if ttl is not None else self.ttl)
+            self._remember(cache_key, value, expires_at)
+            rows.append({
+                "namespace": self.namespace,
+                "cache_key": cache_key,
+                "value": value,
+                "expires_at": datetime.datetime.fromtimestamp(expires_at, datetime.timezone.utc).isoformat(),
+            })
+        if not self.persistent:
+            return
+        for start in range(0, len(rows), chunk_size):
+            try:
+                client = get_supabase_client()
+                r = await client.post(
+                    "/worker_cache?on_conflict=namespace,cache_key",
+                    json=rows[start:start + chunk_size],
+                    headers={"Prefer": "resolution=merge-duplicates,return=minimal"},
+                )
+                r.raise_for_status()
+            except Exception as e:
+                print(f"[Cache:{self.namespace}] Write failed: {e}", flush=True)
+
+    async def set(self, key, value, ttl: int = None):
+        cache_key = self._cache_key(key)
+        expires_at = time.time() + (ttl if ttl is not None else self.ttl)
+        self._remember(cache_key, value, expires_at)
+        if not self.persistent:
+            return
+        row = {
+            "namespace": self.namespace,
+            "cache_key": cache_key,
+            "value": value,
+            "expires_at": datetime.datetime.fromtimestamp(expires_at, datetime.timezone.utc).isoformat(),
+        }
+        try:
+            client = get_supabase_client()
+            r = await client.post(
+                "/worker_cache?on_conflict=namespace,cache_key",
+                json=row,
+                headers={"Prefer": "resolution=merge-duplicates,return=minimal"},
+            )
+            r.raise_for_status()
+        except Exception as e:
+            print(f"[Cache:{self.namespace}] Write failed: {e}", flush=True)
+
+def metrics_snapshot() -> dict:
+    """Counters plus derived gauges (cache hit ratios, remaining API budgets)."""
+    snapshot = dict(METRICS)
+    namespaces = {k.split(".")[1] for k in METRICS if k.startswith("cache.")}
+    for ns in namespaces:
+        hits = METRICS[f"cache.{ns}.hits"]
+        total = hits + METRICS[f"cache.{ns}.misses"]
+        snapshot[f"cache.{ns}.hit_ratio"] = round(hits / total, 3) if total else None
+    snapshot["psi.quota_remaining"] = psi_budget.remaining
+    snapshot["psi.daily_quota"] = PSI_DAILY_QUOTA
+    return snapshot
+
+psi_budget = TokenBucket(PSI_DAILY_QUOTA)
+psi_cache = ResultCache("pagespeed", PSI_CACHE_TTL)
+link_cache = ResultCache("link_status", LINK_CACHE_OK_TTL, max_entries=50000)
+
+# ============================================================
+# Link Checking
+# ============================================================
+
+async def probe_link(client, url: str, timeout: float = 5.0) -> dict:
+    """HEAD the URL, retrying with GET when HEAD reports an error other than 405."""
+    try:
+        res = await client.head(url, timeout=timeout)
+        if res.status_code >= 400 and res.status_code != 405:
+            res = await client.get(url, timeout=timeout)
+        return {"status": res.status_code, "broken": res.status_code >= 400}
+    except Exception:
+        return {"status": 0, "broken": True}
+
+async def check_links(client, urls, max_links: int = LINK_CHECK_MAX_LINKS, max_fetches: int = LINK_CHECK_MAX_FETCHES,
+                      concurrency: int = LINK_CHECK_CONCURRENCY, per_host: int = LINK_CHECK_PER_HOST) -> dict:
+    """
+    Link status for up to max_links distinct URLs (keyed by crawl_url_key). Statuses come from
+    the cross-scan link_cache where possible; at most max_fetches of the rest are probed,
+    `concurrency` at a time and `per_host` per host, and the outcomes are cached with a
+    longer TTL for working links than for broken ones. Network failures (status 0) are
+    reported but not cached, as are links that can't even be parsed (bad port, broken IPv6
+    literal). Returns {url: {"status", "broken", "cached"}} for every URL that got a status.
+    """
+    by_key = {}
+    invalid = {}
+    for url in urls:
+        try:
+            urlparse(url).port  # raises for a port that is not a number in range
+        except ValueError:
+            invalid[url] = {"status": 0, "broken": True, "cached": False}
+        else:
+            by_key.setdefault(crawl_url_key(url), url)
+        if len(by_key) + len(invalid) >= max_links:
+            break
+    cached = await link_cache.get_many(list(by_key))
+    statuses = {by_key[key]: dict(value, cached=True) for key, value in cached.items()}
+    statuses.update(invalid)
+
+    to_probe = [(key, url) for key, url in by_key.items() if key not in cached][:max_fetches]
+    overall = asyncio.Semaphore(concurrency)
+    host_limits = {}
+
+    async def probe(url):
+        host = urlparse(url).hostname or ""
+        if host not in host_limits:
+            host_limits[host] = asyncio.Semaphore(per_host)
+        # Host slot first: waiting on a busy host must not hold one of the global slots
+        async with host_limits[host], overall:
+            return await probe_link(client, url)
+
+    results = await asyncio.gather(*(probe(url) for _, url in to_probe))
+    fresh = []
+    for (key, url), result in zip(to_probe, results):
+        statuses[url] = dict(result, cached=False)
+        # A timeout or refused connection may be this worker's problem, not the link's;
+        # only an HTTP answer is shared with other scans
+        if result["status"]:
+            fresh.append((key, result, LINK_CACHE_BROKEN_TTL if result["broken"] else LINK_CACHE_OK_TTL))
+    if fresh:
+        await link_cache.set_many(fresh)
+    METRICS["links.checked"] += len(statuses)
+    METRICS["links.probed"] += len(fresh)
+    return statuses
+
+# ============================================================
+# HTML Parsing (process pool)
+# ============================================================
+
+# Building and walking a BeautifulSoup tree is pure CPU: a 2 MB page parsed on the event loop
+# stalls every other scan on this worker (and /health). Pages above PARSE_INLINE_MAX_BYTES are
+# parsed in a process pool instead. The parsers below are module-level pure functions taking
+# raw bytes and returning small picklable dicts, so no tree ever crosses the process boundary.
+
+parse_pool = None
+
+def get_parse_pool():
+    global parse_pool
+    if parse_pool is None and PARSE_WORKERS > 0:
+        # spawn, not fork: the parent has an event loop and client threads that must not be cloned
+        parse_pool = ProcessPoolExecutor(max_workers=PARSE_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return parse_pool
+
+def shutdown_parse_pool():
+    global parse_pool
+    if parse_pool is not None:
+        parse_pool.shutdown(wait=False, cancel_futures=True)
+        parse_pool = None
+
+async def run_parser(fn, *args, size: int = 0):
+    """Run a pure parser inline for small pages, otherwise in the process pool."""
+    pool = get_parse_pool()
+    if pool is None or size < PARSE_INLINE_MAX_BYTES:
+        METRICS["parse.inline"] += 1
+        return fn(*args)
+    METRICS["parse.offloaded"] += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(pool, fn, *args)
+    except BrokenProcessPool:
+        # A worker died (OOM on a pathological page); start a fresh pool next time
+        print("[Parser] Process pool broken, parsing inline and recreating the pool", flush=True)
+        shutdown_parse_pool()
+        return fn(*args)
+
+def decode_html(content: bytes, encoding: str = None) -> str:
+    return content.decode(encoding or "utf-8", errors="replace")
+
+MIXED_CONTENT_TAGS = {"img", "script", "iframe", "audio", "video"}
+TEXT_STRING_TYPES = (NavigableString, CData)  # what Tag.get_text() collects: no comments, scripts or styles
+COOKIE_ID_MARKERS = ["cookie", "gdpr", "consent", "ccpa"]
+COOKIE_CLASS_MARKERS = ["cookie-banner", "cookie-consent", "gdpr", "ccpa", "consent-banner"]
+POPUP_CLASS_MARKERS = ["popup", "modal", "overlay", "interstitial"]
+_ANCHOR_END = object()
+
+@dataclass
+class PageSignals:
+    """Everything the scan reads from one HTML page, gathered in a single walk of the tree."""
+    title: Optional[str] = None                      # <title>.string of the first <title>
+    meta: dict = field(default_factory=dict)         # first <meta name=...> per name -> content (None if absent)
+    canonical: Optional[str] = None                  # href of the first <link rel="canonical">
+    headings: dict = field(default_factory=lambda: dict.fromkeys(["h1", "h2", "h3", "h4", "h5", "h6"], 0))
+    image_count: int = 0
+    lazy_images: int = 0
+    images_missing_alt: int = 0
+    json_ld: list = field(default_factory=list)      # raw bodies of <script type="application/ld+json">
+    links: list = field(default_factory=list)        # (href, lowercased anchor text) for every <a href>, in order
+    has_form: bool = False
+    cookie_consent: bool = False                     # banner text, or cookie/consent ids and classes
+    popup_count: int = 0                             # elements with popup/modal/overlay/interstitial classes
+    sticky_nav: bool = False                         # fixed/sticky <nav> or <header>
+    insecure_resources: bool = False                 # http:// subresources (mixed content on an https page)
+    text: str = ""                                   # get_text(separator=' ', strip=True)
+
+    @property
+    def word_count(self) -> int:
+        return len(self.text.split())
+
+def collect_page_signals(soup) -> PageSignals:
+    """
+    Single depth-first walk filling a PageSignals record. Replaces the dozens of find_all()
+    and get_text() passes the scan used to make, each of which re-walked the whole tree.
+    """
+    signals = PageSignals()
+    text_parts = []
+    open_anchors = []
+    title_seen = canonical_seen = False
+    stack = list(reversed(soup.contents))
+    while stack:
+        node = stack.pop()
+        if node is _ANCHOR_END:
+            open_anchors.pop()
+            continue
+        if isinstance(node, NavigableString):
+            if not signals.cookie_consent:
+                lower_text = node.lower()
+                if "cookie" in lower_text and ("accept" in lower_text or "consent" in lower_text or "agree" in lower_text):
+                    signals.cookie_consent = True
+            if type(node) in TEXT_STRING_TYPES:
+                stripped = node.strip()
+                if stripped:
+                    text_parts.append(stripped)
+                    for anchor in open_anchors:
+                        anchor[1].append(stripped)
+            continue
+        if not isinstance(node, Tag):
+            continue
+
+        name = node.name
+        attrs = node.attrs
+        if name in signals.headings:
+            signals.headings[name] += 1
+        elif name == "title" and not title_seen:
+            title_seen = True
+            signals.title = str(node.string) if node.string is not None else None
+        elif name == "meta":
+            meta_name = attrs.get("name")
+            if isinstance(meta_name, str) and meta_name not in signals.meta:
+                signals.meta[meta_name] = attrs.get("content")
+        elif name == "link":
+            rel = attrs.get("rel") or []
+            if "canonical" in rel and not canonical_seen:
+                canonical_seen = True
+                signals.canonical = attrs.get("href")
+            if "stylesheet" in rel and (attrs.get("href") or "").startswith("http://"):
+                signals.insecure_resources = True
+        elif name == "form":
+            signals.has_form = True
+        elif name == "img":
+            signals.image_count += 1
+            if attrs.get("loading", "").lower() == "lazy":
+                signals.lazy_images += 1
+            if not attrs.get("alt", "").strip():
+                signals.images_missing_alt += 1
+        elif name == "script" and attrs.get("type") == "application/ld+json":
+            signals.json_ld.append(str(node.string) if node.string else "")
+
+        if name in MIXED_CONTENT_TAGS and (attrs.get("src") or "").startswith("http://"):
+            signals.insecure_resources = True
+        if "id" in attrs and not signals.cookie_consent:
+            element_id = attrs["id"].lower() if isinstance(attrs["id"], str) else ""
+            if any(k in element_id for k in COOKIE_ID_MARKERS):
+                signals.cookie_consent = True
+        classes = " ".join(attrs["class"]).lower() if "class" in attrs else ""
+        if classes:
+            if not signals.cookie_consent and any(k in classes for k in COOKIE_CLASS_MARKERS):
+                signals.cookie_consent = True
+            if any(k in classes for k in POPUP_CLASS_MARKERS):
+                signals.popup_count += 1
+        if name in ("nav", "header") and not signals.sticky_nav:
+            style = attrs.get("style", "").lower()
+            if "fixed" in style or "sticky" in style or "fixed" in classes or "sticky" in classes:
+                signals.sticky_nav = True
+
+        if name == "a" and "href" in attrs:
+            anchor = [attrs["href"], []]
+            signals.links.append(anchor)
+            open_anchors.append(anchor)
+            stack.append(_ANCHOR_END)
+        stack.extend(reversed(node.contents))
+
+    signals.links = [(href, "".join(parts).lower()) for href, parts in signals.links]
+    signals.text = " ".join(text_parts)
+    return signals
+
+def extract_page_signals(content: bytes, encoding: str = None, parser: str = "html.parser") -> PageSignals:
+    """Parse + single-pass extraction; the tree never leaves this function (or the pool worker)."""
+    return collect_page_signals(BeautifulSoup(decode_html(content, encoding), parser))
+
+EMAIL_RE = re.compile(r"[\w\.-]+@[\w\.-]+\.\w+")
+PHONE_RE = re.compile(r"\+?[0-9][\d\s\-\(\)]{7,15}\d")
+
+@dataclass(frozen=True, slots=True)
+class PageRecord:
+    """
+    What the crawl aggregates keep of one deep-crawl page. The tree and full text are dropped
+    as soon as these fields are extracted, so a 50-page crawl holds a few KB, not 50 soups.
+    """
+    url_id: int
+    status: int
+    word_count: int = 0
+    has_title: bool = False
+    has_description: bool = False
+    has_mixed: bool = False
+    has_email: bool = False
+    has_phone: bool = False
+    content_hash: Optional[str] = None
+    outlinks: tuple = ()  # UrlTable ids
+    skipped: bool = False  # non-HTML response, body not downloaded
+
+class UrlTable:
+    """Per-scan URL interner: each distinct URL string is stored once and referenced by a small int."""
+
+    __slots__ = ("_ids", "_urls")
+
+    def __init__(self):
+        self._ids = {}
+        self._urls = []
+
+    def intern(self, url: str) -> int:
+        url_id = self._ids.get(url)
+        if url_id is None:
+            url_id = self._ids[url] = len(self._urls)
+            self._urls.append(url)
+        return url_id
+
+    def url(self, url_id: int) -> str:
+        return self._urls[url_id]
+
+    def __len__(self):
+        return len(self._urls)
+
+def parse_crawl_page(url: str, content: bytes, encoding: str = None) -> dict:
+    """
+    Deep-crawl page -> PageRecord fields plus absolute http(s) outlinks (interned by the caller,
+    since ids are per scan and this may run in a pool worker).
+    """
+    signals = extract_page_signals(content, encoding)
+    text = signals.text
+    description = signals.meta.get("description")
+    links = []
+    for href, _ in signals.links:
+        new_link = urljoin(url, href)
+        if urlparse(new_link).scheme in ["http", "https"]:
+            links.append(new_link)
+    return {
+        "word_count": signals.word_count,
+        "has_title": bool(signals.title and signals.title.strip()),
+        "has_description": bool(description and description.strip()),
+        "has_mixed": url.startswith("https") and signals.insecure_resources,
+        # Trust signals: look for email/phone loosely
+        "has_email": "@" in text and EMAIL_RE.search(text) is not None,
+        "has_phone": PHONE_RE.search(text) is not None,
+        "content_hash": hashlib.blake2b(text.encode("utf-8"), digest_size=8).hexdigest(),
+        "links": links,
+    }
+
+def parse_candidate_page(content: bytes, encoding: str = None) -> dict:
+    """Trust-page candidate -> lowercased text and whether it contains a form."""
+    signals = extract_page_signals(content, encoding)
+    return {"text": signals.text.lower(), "has_form": signals.has_form}
+
 # Google PageSpeed Insights — Full Lighthouse Data Extraction
 async def fetch_pagespeed_data(target_url):
     """
@@ -150,7 +1300,20 @@ async def fetch_pagespeed_data(target_url):
             "has_crux": crux_lcp_ms is not None,
         }
 
+    psi_limiter = get_limiter("pagespeed", PSI_CONCURRENCY)
+
+    async def psi_get(client, url):
+        # Each individual PSI request holds a limiter slot; backoff sleeps happen outside it
+        async with psi_limiter:
+            return await client.get(url, timeout=120.0)
+
     async def fetch_strategy(client, strategy, retries=3):
+        cache_key = (normalize_url(target_url), strategy)
+        cached = await psi_cache.get(cache_key)
+        if cached:
+            print(f"[PSI] Cache hit for {strategy} {target_url}", flush=True)
+            return cached
+
         base_url = (
             f"https://www.googleapis.com/pagespeedonline/v5/runPagespeed"
             f"?url={target_url}&strategy={strategy}"
@@ -161,18 +1324,33 @@ async def fetch_pagespeed_data(target_url):
 
         for attempt in range(retries):
             use_url = url_keyless if (not PAGESPEED_API_KEY or attempt > 0) else url_with_key
+            # Every attempt spends daily quota: wait for budget rather than fire a request that will 429
+            if not await psi_budget.acquire(PSI_MAX_DEFER):
+                METRICS["psi.deferred"] += 1
+                print(f"[PSI] Quota budget exhausted (~{psi_budget.remaining} left) — skipping {strategy} for {target_url}", flush=True)
+                return None
             try:
                 print(f"[PSI] Fetching {strategy} for {target_url} (attempt {attempt+1}/{retries})", flush=True)
-                resp = await client.get(use_url, timeout=120.0)
+                METRICS["psi.requests"] += 1
+                resp = await psi_get(client, use_url)
 
                 if resp.status_code == 403:
+                    # The keyless retry is a second request against the daily quota
+                    if not await psi_budget.acquire(PSI_MAX_DEFER):
+                        METRICS["psi.deferred"] += 1
+                        print(f"[PSI] Quota budget exhausted (~{psi_budget.remaining} left) — skipping {strategy} for {target_url}", flush=True)
+                        return None
                     print(f"[PSI] 403 → retrying keyless", flush=True)
-                    resp = await client.get(url_keyless, timeout=120.0)
+                    METRICS["psi.requests"] += 1
+                    resp = await psi_get(client, url_keyless)
                 if resp.status_code == 429:
-                    wait_s = 20 + (15 * attempt)
-                    print(f"[PSI] 429 rate limit → waiting {wait_s}s then keyless", flush=True)
-                    await asyncio.sleep(wait_s)
-                    resp = await client.get(url_keyless, timeout=120.0)
+                    # Pause the shared budget so concurrent scans back off too; the next attempt
+                    # queues on the budget instead of sleeping and retrying blindly.
+                    METRICS["psi.rate_limited"] += 1
+                    pause_s = 60 * (attempt + 1)
+                    print(f"[PSI] 429 rate limit ({strategy}) → pausing PSI budget for {pause_s}s", flush=True)
+                    psi_budget.pause(pause_s)
+                    continue
                 if resp.status_code != 200:
                     print(f"[PSI] HTTP {resp.status_code} ({strategy})", flush=True)
                     if attempt < retries - 1:
@@ -284,7 +1462,7 @@ async def fetch_pagespeed_data(target_url):
 
                 print(f"[PSI] {strategy} OK — score={perf_score}, lcp={final_lcp}, ttfb={final_ttfb}, opps={len(opportunities)}", flush=True)
 
-                return {
+                result = {
                     # Core scores
                     "performance_score": perf_score,
                     "score": perf_score,
@@ -315,6 +1493,8 @@ async def fetch_pagespeed_data(target_url):
                     "render_blocking_issues": len(render_blocking),
                     "render_blocking_resources": [r.get("url", "")[:100] for r in render_blocking[:5]],
                 }
+                await psi_cache.set(cache_key, result)
+                return result
 
             except Exception as e:
                 print(f"[PSI] Error ({strategy}) attempt {attempt+1}: {e}", flush=True)
@@ -322,11 +1502,13 @@ async def fetch_pagespeed_data(target_url):
                     await asyncio.sleep(8 + (8 * attempt))
         return None
 
-    # Run both strategies — mobile is the primary signal
+    # Run both strategies concurrently — mobile is the primary signal.
+    # Retries and 429 backoff are handled independently inside each strategy.
     async with httpx.AsyncClient() as client:
-        mobile_data  = await fetch_strategy(client, "mobile")
-        await asyncio.sleep(3)   # brief pause between calls
-        desktop_data = await fetch_strategy(client, "desktop")
+        mobile_data, desktop_data = await asyncio.gather(
+            fetch_strategy(client, "mobile"),
+            fetch_strategy(client, "desktop"),
+        )
 
     if not mobile_data and not desktop_data:
         print("[PSI] Both strategies failed — returning None", flush=True)
@@ -369,58 +1551,218 @@ async def fetch_pagespeed_data(target_url):
     }
 
 
-async def verify_ssl(url):
+# Certificate details the ssl module does not expose (key type/size, signature algorithm,
+# chain entries) are read straight from the DER encoding; no extra dependency needed.
+X509_NAME_OIDS = {"2.5.4.3": "CN", "2.5.4.10": "O", "2.5.4.11": "OU", "2.5.4.6": "C"}
+X509_KEY_ALGORITHMS = {"1.2.840.113549.1.1.1": "RSA", "1.2.840.10045.2.1": "EC", "1.2.840.10040.4.1": "DSA",
+                       "1.3.101.112": "Ed25519", "1.3.101.113": "Ed448"}
+X509_EC_CURVES = {"1.2.840.10045.3.1.7": ("P-256", 256), "1.3.132.0.34": ("P-384", 384), "1.3.132.0.35": ("P-521", 521)}
+X509_SIGNATURE_ALGORITHMS = {
+    "1.2.840.113549.1.1.5": "sha1WithRSAEncryption", "1.2.840.113549.1.1.11": "sha256WithRSAEncryption",
+    "1.2.840.113549.1.1.12": "sha384WithRSAEncryption", "1.2.840.113549.1.1.13": "sha512WithRSAEncryption",
+    "1.2.840.113549.1.1.10": "RSASSA-PSS", "1.2.840.10045.4.3.2": "ecdsa-with-SHA256",
+    "1.2.840.10045.4.3.3": "ecdsa-with-SHA384", "1.2.840.10045.4.3.4": "ecdsa-with-SHA512", "1.3.101.112": "Ed25519",
+}
+
+def _der_items(data: bytes) -> list:
+    """(tag, value) for each TLV in data."""
+    items, pos = [], 0
+    while pos < len(data):
+        tag, length = data[pos], data[pos + 1]
+        pos += 2
+        if length & 0x80:
+            size = length & 0x7F
+            length = int.from_bytes(data[pos:pos + size], "big")
+            pos += size
+        items.append((tag, data[pos:pos + length]))
+        pos += length
+    return items
+
+def _der_oid(value: bytes) -> str:
+    parts, current = [], 0
+    for byte in value:
+        current = (current << 7) | (byte & 0x7F)
+        if not byte & 0x80:
+            parts.append(current)
+            current = 0
+    first = parts[0] if parts else 0
+    head = [min(first // 40, 2), first - 40 * min(first // 40, 2)]
+    return ".".join(str(p) for p in head + parts[1:])
+
+def _der_time(tag: int, value: bytes) -> str:
+    text = value.decode("ascii").rstrip("Z")
+    if tag == 0x17:  # UTCTime: two-digit year, 1950-2049
+        text = ("19" if int(text[:2]) >= 50 else "20") + text
+    return datetime.datetime.strptime(text[:14], "%Y%m%d%H%M%S").replace(tzinfo=datetime.timezone.utc).isoformat()
+
+def _der_name(value: bytes) -> dict:
+    name = {}
+    for _, rdn in _der_items(value):
+        for _, attribute in _der_items(rdn):
+            (_, oid), (_, text) = _der_items(attribute)[:2]
+            label = X509_NAME_OIDS.get(_der_oid(oid))
+            if label:
+                name.setdefault(label, text.decode("utf-8", "replace"))
+    return name
+
+def parse_certificate_der(der: bytes) -> dict:
+    """Serial, names, validity, public key and signature algorithm of a DER certificate."""
+    (_, certificate), = _der_items(der)[:1]
+    tbs_items = _der_items(_der_items(certificate)[0][1])
+    if tbs_items[0][0] == 0xA0:  # explicit version
+        tbs_items = tbs_items[1:]
+    serial, signature, issuer, validity, subject, spki = (value for _, value in tbs_items[:6])
+    (_, algorithm), (_, public_key) = _der_items(spki)[:2]
+    algorithm_items = _der_items(algorithm)
+    key_type = X509_KEY_ALGORITHMS.get(_der_oid(algorithm_items[0][1]), _der_oid(algorithm_items[0][1]))
+    key = {"type": key_type}
+    if key_type == "RSA":
+        modulus = _der_items(_der_items(public_key[1:])[0][1])[0][1]
+        key["bits"] = int.from_bytes(modulus, "big").bit_length()
+    elif key_type == "EC" and len(algorithm_items) > 1:
+        curve = _der_oid(algorithm_items[1][1])
+        key["curve"], key["bits"] = X509_EC_CURVES.get(curve, (curve, None))
+    elif key_type in ("Ed25519", "Ed448"):
+        key["bits"] = 256 if key_type == "Ed25519" else 456
+    (not_before_tag, not_before), (not_after_tag, not_after) = _der_items(validity)[:2]
+    signature_oid = _der_oid(_der_items(signature)[0][1])
+    return {
+        "serial": format(int.from_bytes(serial, "big"), "X"),
+        "subject": _der_name(subject),
+        "issuer": _der_name(issuer),
+        "not_before": _der_time(not_before_tag, not_before),
+        "not_after": _der_time(not_after_tag, not_after),
+        "key": key,
+        "signature_algorithm": X509_SIGNATURE_ALGORITHMS.get(signature_oid, signature_oid),
+    }
+
+async def tls_probe(host: str, port: int = 443, timeout: float = TLS_PROBE_TIMEOUT, context: ssl.SSLContext = None) -> dict:
+    """
+    Verified TLS handshake on the event loop (no executor thread). Returns the leaf certificate's
+    metadata plus SANs, the verified chain (where the ssl module exposes it), protocol and cipher.
+    """
+    context = context or ssl.create_default_context()
+    _, writer = await asyncio.wait_for(asyncio.open_connection(host, port, ssl=context, server_hostname=host), timeout)
     try:
-        parsed = urlparse(url)
-        host = parsed.netloc
-        if not host:
-            host = url.replace("https://", "").replace("http://", "")
-        if ':' in host:
-            host = host.split(':')[0]
-            
-        port = 443
-        context = ssl.create_default_context()
-        
-        def fetch_cert():
-            with socket.create_connection((host, port), timeout=5.0) as sock:
-                with context.wrap_socket(sock, server_hostname=host) as ssock:
-                    return ssock.getpeercert(), ssock.version()
-        
+        ssl_object = writer.get_extra_info("ssl_object")
+        peer = ssl_object.getpeercert() or {}
+        leaf = parse_certificate_der(ssl_object.getpeercert(binary_form=True))
+        leaf["san"] = [value for kind, value in peer.get("subjectAltName", ()) if kind in ("DNS", "IP Address")]
+        # Public on 3.13+, private (but present) on 3.10-3.12
+        get_chain = getattr(ssl_object, "get_verified_chain", None) or getattr(getattr(ssl_object, "_sslobj", None), "get_verified_chain", None)
+        chain = []
+        if get_chain is not None:
+            try:
+                for item in get_chain()[1:]:
+                    der = item if isinstance(item, bytes) else item.public_bytes(ssl._ssl.ENCODING_DER)
+                    entry = parse_certificate_der(der)
+                    chain.append({k: entry[k] for k in ("subject", "issuer", "not_after", "key", "signature_algorithm")})
+            except Exception as e:
+                print(f"[SSL] Could not read the certificate chain for {host}: {e}", flush=True)
+        leaf["chain"] = chain
+        leaf["protocol"] = ssl_object.version()
+        cipher = ssl_object.cipher()
+        leaf["cipher"] = cipher[0] if cipher else None
+        return leaf
+    finally:
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except Exception:
+            pass
+
+# Two kinds of entries: ("host", host) -> serial last seen (short TTL, spares the handshake on
+# repeat scans), and ("cert", host, serial) -> metadata, kept until the certificate expires.
+tls_cert_cache = ResultCache("tls_certs", TLS_CERT_CACHE_TTL)
+
+def ssl_result(meta: dict, cached: bool = False) -> dict:
+    """verify_ssl() result for certificate metadata, with validity computed as of now."""
+    not_after = datetime.datetime.fromisoformat(meta["not_after"])
+    days_left = (not_after - datetime.datetime.now(datetime.timezone.utc)).days
+    is_valid = days_left > 0
+    return {
+        "status": "passed" if is_valid else "failed",
+        "valid": is_valid,
+        "days_remaining": days_left,
+        "issuer": meta["issuer"].get("O", "Unknown"),
+        "protocol": meta.get("protocol") or "HTTPS",
+        "expires_at": meta["not_after"],
+        "serial": meta["serial"],
+        "subject": meta["subject"].get("CN"),
+        "san": meta.get("san", []),
+        "key": meta["key"],
+        "signature_algorithm": meta["signature_algorithm"],
+        "chain": meta.get("chain", []),
+        "cipher": meta.get("cipher"),
+        "cached": cached,
+    }
+
+def tls_target(url: str) -> tuple:
+    """(host, port) to handshake with for a site URL; an explicit port only counts for https."""
+    parsed = urlparse(url)
+    host = parsed.netloc
+    if not host:
+        host = url.replace("https://", "").replace("http://", "")
+    if ':' in host:
+        host = host.split(':')[0]
+    host = host.split('/')[0].lower()
+    port = (parsed.port if parsed.scheme == "https" else None) or 443
+    return host, port
+
+def tls_cache_entries(host: str, port: int, meta: dict) -> list:
+    """(key, value, ttl) entries recording a fresh probe, or [] once the certificate has expired."""
+    expires_in = (datetime.datetime.fromisoformat(meta["not_after"]) - datetime.datetime.now(datetime.timezone.utc)).total_seconds()
+    if expires_in <= 0:
+        return []
+    return [
+        (["cert", host, meta["serial"]], meta, int(expires_in)),
+        (["host", host, port], {"serial": meta["serial"]}, min(TLS_CERT_CACHE_TTL, int(expires_in))),
+    ]
+
+async def verify_ssl(url, use_cache: bool = True, context: ssl.SSLContext = None):
+    try:
+        host, port = tls_target(url)
+
+        if use_cache:
+            seen = await tls_cert_cache.get(["host", host, port])
+            meta = await tls_cert_cache.get(["cert", host, seen["serial"]]) if seen else None
+            if meta is not None:
+                return ssl_result(meta, cached=True)
+
         try:
-            cert, tls_version = await asyncio.wait_for(asyncio.to_thread(fetch_cert), timeout=6.0)
+            meta = await tls_probe(host, port, context=context)
         except Exception as e:
-            return {"status": "failed", "error": f"SSL Connection failed: {str(e)}", "protocol": "HTTP"}
-        
-        not_after_str = cert.get('notAfter')
-        if not_after_str:
-            not_after = datetime.datetime.strptime(not_after_str, '%b %d %H:%M:%S %Y %Z')
-            days_left = (not_after - datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)).days
-            is_valid = days_left > 0
-            
-            issuer = "Unknown"
-            for rdn in cert.get('issuer', []):
-                for attr, value in rdn:
-                    if attr == 'organizationName':
-                        issuer = value
-                        break
-            
-            return {
-                "status": "passed" if is_valid else "failed",
-                "valid": is_valid,
-                "days_remaining": days_left,
-                "issuer": issuer,
-                "protocol": tls_version if tls_version else "HTTPS"
-            }
-        return {"status": "failed", "error": "Could not parse expiration date", "protocol": "HTTPS"}
+            return {"status": "failed", "error": f"SSL Connection failed: {str(e) or type(e).__name__}", "protocol": "HTTP"}
+
+        for key, value, ttl in tls_cache_entries(host, port, meta):
+            await tls_cert_cache.set(key, value, ttl=ttl)
+        return ssl_result(meta)
     except Exception as e:
         return {"status": "failed", "error": str(e), "protocol": "HTTP"}
 
 # AI Policy Engine Integration
+# Bump whenever the policy prompt or the post-processing of its answer changes: cached
+# analyses are keyed by (text hash, prompt version, model) and an old version never matches.
+POLICY_PROMPT_VERSION = "1"
+POLICY_MODEL = "gemini-1.5-flash"
+policy_cache = ResultCache("ai_policy", AI_POLICY_CACHE_TTL)
+
+def policy_cache_key(text_content: str, model_name: str = POLICY_MODEL) -> list:
+    normalized = " ".join(text_content.split())
+    return [hashlib.sha256(normalized.encode("utf-8")).hexdigest(), POLICY_PROMPT_VERSION, model_name]
+
 async def analyze_policy_with_ai(text_content):
     if not GEMINI_API_KEY or GEMINI_API_KEY.startswith("AIzaSyAx"):
         print("Invalid or missing Gemini API Key.")
         return None
-        
+
+    # Unchanged homepage text: reuse the earlier analysis instead of a 45s model call
+    cache_key = policy_cache_key(text_content)
+    cached = await policy_cache.get(cache_key)
+    if cached is not None:
+        print(f"[AI Policy] Cache hit ({cache_key[0][:12]}, prompt v{POLICY_PROMPT_VERSION})", flush=True)
+        return cached
+
     try:
         genai.configure(api_key=GEMINI_API_KEY)
         
@@ -457,10 +1799,11 @@ async def analyze_policy_with_ai(text_content):
         """
         
         try:
-            model = genai.GenerativeModel('gemini-1.5-flash', generation_config={"response_mime_type": "application/json"})
+            model = genai.GenerativeModel(POLICY_MODEL, generation_config={"response_mime_type": "application/json"})
             response = await asyncio.wait_for(asyncio.to_thread(model.generate_content, prompt), timeout=45.0)
         except Exception as e:
             if "404" in str(e):
+                # Answers from the fallback model are not cached under the primary model's key
                 print("gemini-1.5-flash not found, falling back to gemini-pro", flush=True)
                 model = genai.GenerativeModel('gemini-pro') 
                 response = await asyncio.wait_for(asyncio.to_thread(model.generate_content, prompt), timeout=45.0)
@@ -480,6 +1823,7 @@ async def analyze_policy_with_ai(text_content):
             
         # Ensure fallback sanity
         parsed_json["confidence_score"] = 0.95 
+        await policy_cache.set(cache_key, parsed_json)
         return parsed_json
         
     except Exception as e:
@@ -493,8 +1837,18 @@ async def analyze_policy_with_ai(text_content):
         }
 
 # AI Missing Page Generator
-async def generate_missing_page_draft(domain: str, page_type: str) -> str:
+draft_cache = ResultCache("drafts", DRAFT_CACHE_TTL)
+draft_tasks = set()  # background draft fills still running (kept referenced until done)
+
+def draft_cache_key(domain: str, page_type: str) -> tuple:
+    return (domain.lower(), page_type)
+
+async def generate_missing_page_draft(domain: str, page_type: str, use_cache: bool = True) -> str:
     fallback_html = f"<div><h2>Missing {page_type.title()} Draft</h2><p>Our AI could not generate a draft at this moment. You can manually copy a generic template for your {page_type} page online and modify it for <b>{domain}</b>.</p></div>"
+    if use_cache:
+        cached = await draft_cache.get(draft_cache_key(domain, page_type))
+        if cached:
+            return cached
     if not GEMINI_API_KEY or GEMINI_API_KEY.startswith("AIzaSyAx"):
         print("Invalid or missing Gemini API Key for draft generation.")
         return fallback_html
@@ -510,11 +1864,14 @@ async def generate_missing_page_draft(domain: str, page_type: str) -> str:
         Return the response in formatted HTML, but ONLY the inner content (start from headers, e.g., <h1>, do not wrap in full <html> or <body> tags). Do not use markdown backticks in the final output.
         """
         model = genai.GenerativeModel('gemini-1.5-flash')
-        response = await asyncio.wait_for(asyncio.to_thread(model.generate_content, prompt), timeout=30.0)
+        async with get_limiter("ai_drafts", AI_DRAFT_CONCURRENCY):
+            response = await asyncio.wait_for(asyncio.to_thread(model.generate_content, prompt), timeout=30.0)
         
         text = response.text.strip()
         if text.startswith('```html'): text = text[7:]
         if text.endswith('```'): text = text[:-3]
+        # Only real model output is cached; fallbacks are retried on the next scan
+        await draft_cache.set(draft_cache_key(domain, page_type), text.strip())
         return text.strip()
     except Exception as e:
         print(f"Gemini AI Draft Generator Error: {e}", flush=True)
@@ -627,33 +1984,456 @@ async def generate_appeal_letter(domain: str, violations: list) -> dict:
         return {"status": "error", "message": "Failed to generate appeal letter", "draft": ""}
 
 # Google Safe Browsing API
-async def check_safe_browsing(url):
+safe_browsing_cache = ResultCache("safe_browsing", SAFE_BROWSING_SAFE_TTL, max_entries=50000)
+
+def parse_duration(value, default: float = 0.0) -> float:
+    """Protobuf JSON durations such as "300s" or "1.5s"."""
+    try:
+        return float(str(value).rstrip("s"))
+    except (TypeError, ValueError):
+        return default
+
+async def check_safe_browsing(urls, client=None) -> dict:
+    """
+    Safe Browsing v4 verdicts for many URLs: {url: {"status": "safe"|"unsafe"|"unknown", "threats": [...]}}.
+    Verdicts are cached per normalized URL (matches for the API's cacheDuration, clean URLs for
+    SAFE_BROWSING_SAFE_TTL); the rest go out SAFE_BROWSING_BATCH URLs per threatMatches:find call.
+    URLs whose lookup failed, or that can't be parsed (bad port, broken IPv6 literal), come
+    back "unknown" and are not cached. Once the local threat lists are synced
+    (SAFE_BROWSING_LOCAL), SafeBrowsingDB answers instead.
+    """
+    if isinstance(urls, str):
+        urls = [urls]
+    # One malformed outlink must not cost the verdicts for everything else
+    by_key = {}
+    unparsable = {}
+    for url in urls:
+        try:
+            by_key.setdefault(normalize_url(url), url)
+        except ValueError:
+            unparsable[url] = {"status": "unknown"}
+    if safe_browsing_db is not None and safe_browsing_db.ready:
+        owns_client = client is None
+        client = client or httpx.AsyncClient()
+        try:
+            verdicts = await safe_browsing_db.check([url for url in urls if url not in unparsable], client)
+            return {**verdicts, **unparsable}
+        finally:
+            if owns_client:
+                await client.aclose()
     # FIX: Removed the broken startswith("AIzaSyAx") check that rejected the real key
     if not SAFE_BROWSING_API_KEY:
         print("Missing Safe Browsing API Key.")
-        return {"status": "unknown"}
+        return {url: {"status": "unknown"} for url in urls}
+    verdicts = {by_key[key]: dict(value, cached=True) for key, value in (await safe_browsing_cache.get_many(list(by_key))).items()}
+    verdicts.update(unparsable)
+    pending = [url for url in by_key.values() if url not in verdicts]
+
     api_url = f"https://safebrowsing.googleapis.com/v4/threatMatches:find?key={SAFE_BROWSING_API_KEY}"
-    payload = {
-        "client": { "clientId": "ad2go", "clientVersion": "1.0" },
-        "threatInfo": {
-            "threatTypes": ["MALWARE", "SOCIAL_ENGINEERING", "UNWANTED_SOFTWARE", "POTENTIALLY_HARMFUL_APPLICATION"],
-            "platformTypes": ["ANY_PLATFORM"],
-            "threatEntryTypes": ["URL"],
-            "threatEntries": [{"url": url}]
+
+    async def lookup(batch):
+        payload = {
+            "client": { "clientId": "ad2go", "clientVersion": "1.0" },
+            "threatInfo": {
+                "threatTypes": ["MALWARE", "SOCIAL_ENGINEERING", "UNWANTED_SOFTWARE", "POTENTIALLY_HARMFUL_APPLICATION"],
+                "platformTypes": ["ANY_PLATFORM"],
+                "threatEntryTypes": ["URL"],
+                "threatEntries": [{"url": url} for url in batch]
+            }
         }
-    }
-    async with httpx.AsyncClient() as client:
         try:
-            r = await client.post(api_url, json=payload, timeout=5.0)
-            if r.status_code == 200:
-                data = r.json()
-                if "matches" in data:
-                    return {"status": "unsafe", "issues": len(data["matches"])}
-                return {"status": "safe", "issues": 0}
-            return {"status": "unknown"}
+            r = await client.post(api_url, json=payload, timeout=10.0)
+            METRICS["safe_browsing.api_calls"] += 1
+            if r.status_code != 200:
+                print(f"Safe Browsing API Error: HTTP {r.status_code}")
+                return None
+            return r.json().get("matches", [])
         except Exception as e:
             print(f"Safe Browsing API Error: {e}")
-            return {"status": "unknown"}
+            return None
+
+    owns_client = client is None
+    client = client or httpx.AsyncClient()
+    try:
+        batches = [pending[i:i + SAFE_BROWSING_BATCH] for i in range(0, len(pending), SAFE_BROWSING_BATCH)]
+        responses = await asyncio.gather(*(lookup(batch) for batch in batches))
+    finally:
+        if owns_client:
+            await client.aclose()
+
+    fresh = []
+    for batch, matches in zip(batches, responses):
+        if matches is None:
+            verdicts.update((url, {"status": "unknown"}) for url in batch)
+            continue
+        threats = {}
+        for match in matches:
+            entry = threats.setdefault(match.get("threat", {}).get("url"), {"threats": set(), "ttl": 0.0})
+            entry["threats"].add(match.get("threatType", "UNKNOWN"))
+            entry["ttl"] = max(entry["ttl"], parse_duration(match.get("cacheDuration"), 300.0))
+        for url in batch:
+            if url in threats:
+                verdict = {"status": "unsafe", "threats": sorted(threats[url]["threats"])}
+                ttl = threats[url]["ttl"]
+            else:
+                verdict = {"status": "safe", "threats": []}
+                ttl = SAFE_BROWSING_SAFE_TTL
+            verdicts[url] = dict(verdict, cached=False)
+            fresh.append((normalize_url(url), verdict, ttl))
+    if fresh:
+        await safe_browsing_cache.set_many(fresh)
+    return verdicts
+
+# ============================================================
+# Safe Browsing Local Database
+# ============================================================
+
+# With SAFE_BROWSING_LOCAL=1 the worker keeps the Safe Browsing threat lists as sorted 4-byte
+# hash prefixes (Update API, threatListUpdates:fetch) and checks URLs locally: canonicalize,
+# expand to host-suffix/path-prefix expressions, SHA-256 each and binary-search the prefixes.
+# Only a prefix hit costs a network call (fullHashes:find) to confirm the full hash.
+
+SAFE_BROWSING_CLIENT = {"clientId": "ad2go", "clientVersion": "1.0"}
+SAFE_BROWSING_THREAT_TYPES = ["MALWARE", "SOCIAL_ENGINEERING", "UNWANTED_SOFTWARE", "POTENTIALLY_HARMFUL_APPLICATION"]
+
+def _sb_unescape(value: str) -> str:
+    # Repeatedly percent-unescape until stable (latin-1 keeps one char per byte)
+    while True:
+        unescaped = unquote(value, encoding="latin-1")
+        if unescaped == value:
+            return value
+        value = unescaped
+
+def _sb_escape(value: str) -> str:
+    return "".join(f"%{ord(c):02X}" if ord(c) <= 32 or ord(c) >= 127 or c in "#%" else c for c in value)
+
+def sb_canonicalize(url: str):
+    """Safe Browsing URL canonicalization; returns (host, path, query or None) or None if unusable."""
+    url = re.sub(r"[\t\r\n]", "", url.strip()).encode("utf-8").decode("latin-1")
+    url = url.split("#", 1)[0]
+    if "://" not in url:
+        url = "http://" + url
+    rest = url.split("://", 1)[1]
+    split_at = min((i for i in (rest.find("/"), rest.find("?")) if i >= 0), default=len(rest))
+    authority, path_query = rest[:split_at], rest[split_at:]
+    host = authority.rsplit("@", 1)[-1]
+    if not host.startswith("["):
+        host = host.split(":", 1)[0]
+    host = re.sub(r"\.{2,}", ".", _sb_unescape(host).strip(".").lower())
+    if not host:
+        return None
+    if re.fullmatch(r"[0-9a-fx.]+", host) and not host.endswith("."):
+        try:
+            host = socket.inet_ntoa(socket.inet_aton(host))
+        except OSError:
+            pass
+    if "?" in path_query:
+        path, query = path_query.split("?", 1)
+    else:
+        path, query = path_query, None
+    path = _sb_unescape(path or "/")
+    if not path.startswith("/"):
+        path = "/" + path
+    segments = []
+    for segment in path.split("/")[1:]:
+        if segment == "..":
+            if segments:
+                segments.pop()
+        elif segment != ".":
+            segments.append(segment)
+    trailing = path.endswith("/") or path.endswith("/.") or path.endswith("/..")
+    path = "/" + "/".join(s for s in segments if s)
+    if trailing and path != "/":
+        path += "/"
+    return _sb_escape(host), _sb_escape(path), (_sb_escape(query) if query is not None else None)
+
+def sb_expressions(url: str) -> list:
+    """Host-suffix / path-prefix expressions to look up for a URL (at most 5 hosts x 6 paths)."""
+    canonical = sb_canonicalize(url)
+    if canonical is None:
+        return []
+    host, path, query = canonical
+    hosts = [host]
+    if not re.fullmatch(r"[0-9.]+", host):
+        components = host.split(".")
+        hosts += [".".join(components[i:]) for i in range(max(1, len(components) - 5), len(components) - 1)]
+    paths = []
+    if query is not None:
+        paths.append(f"{path}?{query}")
+    paths.append(path)
+    directories = path.split("/")[1:-1]
+    prefix = "/"
+    paths.append(prefix)
+    for directory in directories[:3]:
+        prefix += directory + "/"
+        paths.append(prefix)
+    return list(dict.fromkeys(h + p for h in hosts for p in paths))
+
+class ThreatList:
+    """One (threatType, platformType, threatEntryType) list: its client state and sorted prefixes."""
+    __slots__ = ("key", "state", "short", "long")
+
+    def __init__(self, key: tuple):
+        self.key = key
+        self.state = ""
+        self.short = array("I")  # 4-byte prefixes as big-endian integers, sorted
+        self.long = []           # the rare longer prefixes, sorted bytes
+
+    def __len__(self):
+        return len(self.short) + len(self.long)
+
+    def _short_bytes(self) -> bytes:
+        big_endian = array("I", self.short)
+        if sys.byteorder == "little":
+            big_endian.byteswap()
+        return big_endian.tobytes()
+
+    def sorted_prefixes(self) -> list:
+        blob = self._short_bytes()
+        shorts = [blob[i:i + 4] for i in range(0, len(blob), 4)]
+        return sorted(shorts + self.long) if self.long else shorts
+
+    def checksum(self) -> bytes:
+        if not self.long:
+            return hashlib.sha256(self._short_bytes()).digest()
+        return hashlib.sha256(b"".join(self.sorted_prefixes())).digest()
+
+    def apply(self, update: dict) -> bool:
+        """Apply a listUpdateResponse; False (and the list is reset) if the checksum disagrees."""
+        if update.get("responseType") == "FULL_UPDATE":
+            self.short, self.long = array("I"), []
+        removed = set()
+        for removal in update.get("removals", []):
+            removed.update(removal.get("rawIndices", {}).get("indices", []))
+        if removed:
+            # Indices refer to the lexicographically sorted list before this update's additions
+            if not self.long:
+                self.short = array("I", (p for i, p in enumerate(self.short) if i not in removed))
+            else:
+                kept = [p for i, p in enumerate(self.sorted_prefixes()) if i not in removed]
+                self.short, self.long = array("I"), []
+                self._extend(kept)
+        added = array("I")
+        for addition in update.get("additions", []):
+            raw = addition.get("rawHashes", {})
+            size = int(raw.get("prefixSize", 4))
+            blob = base64.b64decode(raw.get("rawHashes", ""))
+            if size == 4:
+                chunk = array("I")
+                chunk.frombytes(blob[:len(blob) - len(blob) % 4])
+                if sys.byteorder == "little":
+                    chunk.byteswap()
+                added.extend(chunk)
+            else:
+                self.long.extend(blob[i:i + size] for i in range(0, len(blob), size))
+        if added:
+            self.short = array("I", heapq.merge(self.short, sorted(added)))
+        self.long.sort()
+        self.state = update.get("newClientState", "")
+        expected = update.get("checksum", {}).get("sha256")
+        if expected and base64.b64decode(expected) != self.checksum():
+            print(f"[SafeBrowsing] Checksum mismatch for {'/'.join(self.key)}, resetting list", flush=True)
+            self.state, self.short, self.long = "", array("I"), []
+            return False
+        return True
+
+    def _extend(self, prefixes):
+        for prefix in prefixes:
+            if len(prefix) == 4:
+                self.short.append(int.from_bytes(prefix, "big"))
+            else:
+                self.long.append(prefix)
+
+    def match(self, full_hash: bytes):
+        """The stored prefix of full_hash, or None."""
+        value = int.from_bytes(full_hash[:4], "big")
+        i = bisect.bisect_left(self.short, value)
+        if i < len(self.short) and self.short[i] == value:
+            return full_hash[:4]
+        for size in {len(p) for p in self.long}:
+            j = bisect.bisect_left(self.long, full_hash[:size])
+            if j < len(self.long) and self.long[j] == full_hash[:size]:
+                return full_hash[:size]
+        return None
+
+class SafeBrowsingDB:
+    """
+    Local Safe Browsing threat lists plus the full-hash caches the Update API protocol asks
+    for (positive per full hash for cacheDuration, negative per prefix for negativeCacheDuration).
+    Lists are saved to `path` after every sync so a restart does not start from empty.
+    """
+
+    def __init__(self, path: str = SAFE_BROWSING_DB_DIR, threat_types=SAFE_BROWSING_THREAT_TYPES):
+        self.path = path
+        self.lists = {(t, "ANY_PLATFORM", "URL"): ThreatList((t, "ANY_PLATFORM", "URL")) for t in threat_types}
+        self.next_update = 0.0
+        self.positive = {}  # full hash -> (threat types, expires_at)
+        self.negative = {}  # prefix -> expires_at
+
+    @property
+    def ready(self) -> bool:
+        return any(lst.state for lst in self.lists.values())
+
+    def _file(self, key) -> str:
+        return os.path.join(self.path, "_".join(key).lower() + ".prefixes")
+
+    def load(self):
+        try:
+            with open(os.path.join(self.path, "state.json")) as f:
+                states = json.load(f)
+        except (OSError, ValueError):
+            return
+        for key, lst in self.lists.items():
+            saved = states.get("/".join(key))
+            if not saved:
+                continue
+            try:
+                short = array("I")
+                with open(self._file(key), "rb") as f:
+                    short.frombytes(f.read())
+            except OSError:
+                continue
+            if sys.byteorder == "little":
+                short.byteswap()
+            lst.short = short
+            lst.long = sorted(bytes.fromhex(p) for p in saved.get("long", []))
+            lst.state = saved["state"]
+        print(f"[SafeBrowsing] Loaded {sum(len(l) for l in self.lists.values())} prefixes from {self.path}", flush=True)
+
+    def save(self):
+        os.makedirs(self.path, exist_ok=True)
+        states = {}
+        for key, lst in self.lists.items():
+            tmp = self._file(key) + ".tmp"
+            with open(tmp, "wb") as f:
+                f.write(lst._short_bytes())
+            os.replace(tmp, self._file(key))
+            states["/".join(key)] = {"state": lst.state, "long": [p.hex() for p in lst.long]}
+        tmp = os.path.join(self.path, "state.json.tmp")
+        with open(tmp, "w") as f:
+            json.dump(states, f)
+        os.replace(tmp, os.path.join(self.path, "state.json"))
+
+    async def update(self, client, api_key: str = None) -> float:
+        """One threatListUpdates:fetch round; returns the seconds to wait before the next one."""
+        payload = {
+            "client": SAFE_BROWSING_CLIENT,
+            "listUpdateRequests": [
+                {"threatType": t, "platformType": p, "threatEntryType": e, "state": lst.state,
+                 "constraints": {"supportedCompressions": ["RAW"]}}
+                for (t, p, e), lst in self.lists.items()
+            ],
+        }
+        r = await client.post(f"https://safebrowsing.googleapis.com/v4/threatListUpdates:fetch?key={api_key or SAFE_BROWSING_API_KEY}",
+                              json=payload, timeout=60.0)
+        r.raise_for_status()
+        data = r.json()
+        for update in data.get("listUpdateResponses", []):
+            key = (update.get("threatType"), update.get("platformType"), update.get("threatEntryType"))
+            if key in self.lists:
+                self.lists[key].apply(update)
+        METRICS["safe_browsing.list_updates"] += 1
+        wait = max(parse_duration(data.get("minimumWaitDuration")), SAFE_BROWSING_UPDATE_INTERVAL)
+        self.next_update = time.time() + wait
+        return wait
+
+    def prefix_hits(self, url: str) -> dict:
+        """{full hash: matching prefix} for the URL's expressions that hit a local list."""
+        hits = {}
+        for expression in sb_expressions(url):
+            full_hash = hashlib.sha256(expression.encode("latin-1")).digest()
+            for lst in self.lists.values():
+                prefix = lst.match(full_hash)
+                if prefix is not None:
+                    hits[full_hash] = prefix
+                    break
+        return hits
+
+    async def _find_full_hashes(self, client, prefixes: set) -> bool:
+        payload = {
+            "client": SAFE_BROWSING_CLIENT,
+            "clientStates": [lst.state for lst in self.lists.values() if lst.state],
+            "threatInfo": {
+                "threatTypes": [key[0] for key in self.lists],
+                "platformTypes": ["ANY_PLATFORM"],
+                "threatEntryTypes": ["URL"],
+                "threatEntries": [{"hash": base64.b64encode(p).decode()} for p in sorted(prefixes)],
+            },
+        }
+        try:
+            r = await client.post(f"https://safebrowsing.googleapis.com/v4/fullHashes:find?key={SAFE_BROWSING_API_KEY}",
+                                  json=payload, timeout=10.0)
+            METRICS["safe_browsing.full_hash_calls"] += 1
+            r.raise_for_status()
+            data = r.json()
+        except Exception as e:
+            print(f"[SafeBrowsing] fullHashes:find failed: {e}", flush=True)
+            return False
+        now = time.time()
+        # Expired entries are never consulted again; drop them so a long-running worker doesn't
+        # accumulate every hash it has ever looked up (calls are rare: prefix hits only)
+        self.positive = {h: entry for h, entry in self.positive.items() if entry[1] > now}
+        self.negative = {p: until for p, until in self.negative.items() if until > now}
+        for match in data.get("matches", []):
+            full_hash = base64.b64decode(match.get("threat", {}).get("hash", ""))
+            threats = set(self.positive.get(full_hash, ((), 0))[0]) | {match.get("threatType", "UNKNOWN")}
+            self.positive[full_hash] = (sorted(threats), now + parse_duration(match.get("cacheDuration"), 300.0))
+        negative_until = now + parse_duration(data.get("negativeCacheDuration"), 300.0)
+        for prefix in prefixes:
+            self.negative[prefix] = negative_until
+        return True
+
+    def _verdict(self, hits: dict, now: float):
+        """Verdict from the caches, or None if some hit still needs a full-hash lookup."""
+        threats = set()
+        for full_hash, prefix in hits.items():
+            positive = self.positive.get(full_hash)
+            if positive and positive[1] > now:
+                threats.update(positive[0])
+            elif self.negative.get(prefix, 0) <= now:
+                return None
+        return {"status": "unsafe" if threats else "safe", "threats": sorted(threats), "local": True}
+
+    async def check(self, urls, client) -> dict:
+        """Verdicts in the check_safe_browsing() shape; clean URLs never leave the process."""
+        now = time.time()
+        verdicts, unresolved = {}, {}
+        for url in urls:
+            hits = self.prefix_hits(url)
+            verdict = self._verdict(hits, now) if hits else {"status": "safe", "threats": [], "local": True}
+            if verdict is None:
+                unresolved[url] = hits
+            else:
+                verdicts[url] = verdict
+        METRICS["safe_browsing.local_lookups"] += len(verdicts)
+        if unresolved:
+            prefixes = {prefix for hits in unresolved.values() for prefix in hits.values()}
+            found = await self._find_full_hashes(client, prefixes)
+            now = time.time()
+            for url, hits in unresolved.items():
+                verdicts[url] = (self._verdict(hits, now) if found else None) or {"status": "unknown"}
+        return verdicts
+
+safe_browsing_db = SafeBrowsingDB() if SAFE_BROWSING_LOCAL else None
+
+async def safe_browsing_sync_loop(db: SafeBrowsingDB):
+    """Keep the local threat lists current: load from disk, then sync on the server's schedule."""
+    await asyncio.to_thread(db.load)
+    backoff = 60
+    async with httpx.AsyncClient() as client:
+        while True:
+            try:
+                wait = await db.update(client)
+                await asyncio.to_thread(db.save)
+                print(f"[SafeBrowsing] Lists synced: {sum(len(l) for l in db.lists.values())} prefixes", flush=True)
+                backoff = 60
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[SafeBrowsing] List sync failed: {e}", flush=True)
+                wait = backoff
+                backoff = min(backoff * 2, SAFE_BROWSING_UPDATE_INTERVAL)
+            await asyncio.sleep(wait)
 
 # ============================================================
 # RapidAPI Integrations
@@ -711,32 +2491,59 @@ async def fetch_domain_authority(domain: str) -> dict:
 
 WHOIS_XML_API_KEY = os.getenv("WHOIS_XML_API_KEY")
 
-async def fetch_domain_age(domain: str) -> dict:
-    """
-    Fetch domain age & WHOIS details using premium whoisxmlapi.com API.
-    Returns structured JSON: domain_age (years/months), creation_date, registrar, expiration_date, domain_status.
-    """
-    if not WHOIS_XML_API_KEY:
-        print("[WHOIS] Missing WHOIS_XML_API_KEY.", flush=True)
-        return None
+def whois_summary(creation_str: str, registrar, expiration_str, status) -> dict:
+    """Domain-age result from WHOIS fields; the age is computed now, so cached records stay current."""
+    # Parse creation date safely (format usually "2020-01-09 13:42:00 UTC")
+    try:
+        # take just the YYYY-MM-DD part for calculation
+        date_part = creation_str.split(" ")[0] if " " in creation_str else creation_str[:10]
+        creation_date = datetime.datetime.strptime(date_part, "%Y-%m-%d")
 
-    clean_domain = domain.replace("https://", "").replace("http://", "").rstrip("/").split("/")[0]
+        now = datetime.datetime.now()
+        delta = now - creation_date
+        total_days = delta.days
+
+        years = total_days // 365
+        months = (total_days % 365) // 30
+
+        age_result = {
+            "years": years,
+            "months": months,
+            "total_days": total_days
+        }
+    except Exception as e:
+        print(f"[WHOIS] Date parse error for '{creation_str}': {e}", flush=True)
+        # Keep original data but nullify the age calculation
+        age_result = None
+
+    return {
+        "domain_age": age_result,
+        "creation_date": creation_str,
+        "registrar": registrar,
+        "expiration_date": expiration_str,
+        "domain_status": status,
+        "source": "whoisxmlapi"
+    }
+
+async def fetch_whois_record(clean_domain: str) -> dict:
+    """Raw WHOIS fields from whoisxmlapi.com, or None when the lookup fails."""
     # WHOIS API sometimes fails on the api/v1 domain format, using the core server endpoint:
     api_url = f"https://www.whoisxmlapi.com/whoisserver/WhoisService?apiKey={WHOIS_XML_API_KEY}&domainName={clean_domain}&outputFormat=JSON"
 
     print(f"[WHOIS] Fetching details for {clean_domain} via WHOISXMLAPI...", flush=True)
-    
+    METRICS["whois.api_calls"] += 1
+
     try:
         async with httpx.AsyncClient(timeout=15.0, follow_redirects=True) as client:
             r = await client.get(api_url)
-            
+
             if r.status_code != 200:
                 print(f"[WHOIS] API Error HTTP {r.status_code}", flush=True)
                 return None
-                
+
             data = r.json()
             whois_rec = data.get("WhoisRecord", {})
-            
+
             if not whois_rec or "dataError" in whois_rec:
                 err = whois_rec.get("dataError", "Unknown domain or parse error")
                 print(f"[WHOIS] API returned error: {err}", flush=True)
@@ -746,55 +2553,91 @@ async def fetch_domain_age(domain: str) -> dict:
             creation_str = whois_rec.get("createdDateNormalized") or whois_rec.get("createdDate")
             expiration_str = whois_rec.get("expiresDateNormalized") or whois_rec.get("expiresDate")
             registrar = whois_rec.get("registrarName")
-            
+
             # Status can be varied; join if it's a list
             status = whois_rec.get("status")
             if isinstance(status, list):
                 status = status[0] if status else None
-                
+
             # If we don't even have a creation date, we can't calculate age
             if not creation_str:
                 print(f"[WHOIS] No creation date found for {clean_domain}", flush=True)
                 return None
 
-            # Parse creation date safely (format usually "2020-01-09 13:42:00 UTC")
-            try:
-                # take just the YYYY-MM-DD part for calculation
-                date_part = creation_str.split(" ")[0] if " " in creation_str else creation_str[:10]
-                creation_date = datetime.datetime.strptime(date_part, "%Y-%m-%d")
-                
-                now = datetime.datetime.now()
-                delta = now - creation_date
-                total_days = delta.days
-                
-                years = total_days // 365
-                months = (total_days % 365) // 30
-                
-                age_result = {
-                    "years": years,
-                    "months": months,
-                    "total_days": total_days
-                }
-            except Exception as e:
-                print(f"[WHOIS] Date parse error for '{creation_str}': {e}", flush=True)
-                # Keep original data but nullify the age calculation
-                age_result = None
-
-            print(f"[WHOIS] Success for {clean_domain} — Age: {age_result['years']}y {age_result['months']}m" if age_result else f"[WHOIS] Success for {clean_domain} (No age calc)", flush=True)
-
             return {
-                "domain_age": age_result,
                 "creation_date": creation_str,
                 "registrar": registrar,
                 "expiration_date": expiration_str,
                 "domain_status": status,
-                "source": "whoisxmlapi"
+                "fetched_at": time.time(),
             }
 
     except Exception as e:
         print(f"[WHOIS] Network/Exception Error: {e}", flush=True)
         return None
 
+# A domain's creation date never changes, so records are kept (almost) forever; registrar,
+# expiry and status are only trusted for WHOIS_DETAILS_TTL and refreshed in the background.
+whois_cache = ResultCache("whois", WHOIS_CREATION_TTL)
+whois_refreshes = {}  # clean domain -> in-flight background refresh task
+
+def whois_details_stale(record: dict) -> bool:
+    if time.time() - record.get("fetched_at", 0) > WHOIS_DETAILS_TTL:
+        return True
+    # A registration that has lapsed since the last lookup was probably renewed. A lookup made
+    # after the date that still reports it is just the registry's answer: wait out the TTL.
+    try:
+        expires = parse_iso_timestamp(record["expiration_date"].replace(" UTC", "").replace(" ", "T")).timestamp()
+    except Exception:
+        return False
+    return record.get("fetched_at", 0) < expires < time.time()
+
+async def refresh_whois_record(clean_domain: str) -> dict:
+    record = await fetch_whois_record(clean_domain)
+    if record is not None:
+        await whois_cache.set(clean_domain, record)
+    return record
+
+def schedule_whois_refresh(clean_domain: str):
+    if clean_domain in whois_refreshes:
+        return
+    task = asyncio.create_task(refresh_whois_record(clean_domain))
+    whois_refreshes[clean_domain] = task
+    task.add_done_callback(lambda _: whois_refreshes.pop(clean_domain, None))
+
+async def fetch_domain_age(domain: str) -> dict:
+    """
+    Fetch domain age & WHOIS details using premium whoisxmlapi.com API, read through whois_cache.
+    Returns structured JSON: domain_age (years/months), creation_date, registrar, expiration_date, domain_status.
+    A cached record whose registrar/expiry/status are stale is returned at once while a
+    background lookup refreshes it (stale-while-revalidate).
+    """
+    if not WHOIS_XML_API_KEY:
+        print("[WHOIS] Missing WHOIS_XML_API_KEY.", flush=True)
+        return None
+
+    clean_domain = domain.replace("https://", "").replace("http://", "").rstrip("/").split("/")[0].lower()
+
+    entry = await whois_cache.get_entry(clean_domain)
+    record = entry[0] if entry is not None else None
+    if record is not None and entry[1] > time.time():
+        METRICS["cache.whois.hits"] += 1
+        if whois_details_stale(record):
+            METRICS["whois.stale_served"] += 1
+            schedule_whois_refresh(clean_domain)
+    else:
+        METRICS["cache.whois.misses"] += 1
+        fresh = await refresh_whois_record(clean_domain)
+        # An expired record still beats nothing when the API is down
+        record = fresh or record
+    if record is None:
+        return None
+
+    result = whois_summary(record["creation_date"], record.get("registrar"), record.get("expiration_date"), record.get("domain_status"))
+    age_result = result["domain_age"]
+    print(f"[WHOIS] Success for {clean_domain} — Age: {age_result['years']}y {age_result['months']}m" if age_result else f"[WHOIS] Success for {clean_domain} (No age calc)", flush=True)
+    return result
+
 async def fetch_similarweb_data(domain: str) -> dict:
     """Fetch Similarweb traffic overview data. Requires RapidAPI key — no free alternative (Cloudflare-protected)."""
     if not RAPIDAPI_KEY:
@@ -829,97 +2672,104 @@ async def fetch_similarweb_data(domain: str) -> dict:
         print(f"Similarweb API Error: {e}")
     return None
 
-async def _extract_keywords_tfidf(url: str) -> dict:
-    """Free fallback: extract on-page keywords using multiple sources in priority order:
+def _keywords_from_html(url: str, content: bytes, encoding: str = None) -> dict:
+    """Pure keyword extraction (runs in the parse pool for large pages), sources in priority order:
        1. <meta name="keywords"> tag (most explicit)
        2. Title + H1 + H2 tags (structural signals)
        3. Body text TF-IDF (broad extraction)
     """
+    import math, string
+    from collections import Counter
+    soup = BeautifulSoup(decode_html(content, encoding), "lxml")
+
+    keywords_list = []
+
+    # --- Source 1: <meta name="keywords"> ---
+    meta_kw_tag = soup.find("meta", attrs={"name": "keywords"})
+    if meta_kw_tag and meta_kw_tag.get("content"):
+        raw_meta_kws = [k.strip().lower() for k in meta_kw_tag["content"].split(",") if k.strip()]
+        for i, kw in enumerate(raw_meta_kws[:5]):
+            keywords_list.append({"keyword": kw, "rank": i + 1,
+                                   "search_volume": None, "seo_clicks": None,
+                                   "difficulty": None, "source": "meta_keywords"})
+        if keywords_list:
+            print(f"[Keywords] Used meta keywords tag: {[k['keyword'] for k in keywords_list]}", flush=True)
+
+    # --- Source 2: Title + H1 + H2 (always add as supplementary) ---
+    structural_words = []
+    if soup.title and soup.title.string:
+        structural_words += soup.title.string.strip().lower().split()
+    for h in soup.find_all(["h1", "h2"]):
+        structural_words += h.get_text(separator=" ", strip=True).lower().split()
+
+    STOPS = set(
+        "the a an and or but in on at to for of with by from is are was were be been being "
+        "have has had do does did will would could should may might shall can this that these "
+        "those it its we our you your they their all any some as so if not no more most "
+        "than when where who which how what about into over after before just also only com org net www".split()
+    )
+    structural_words = [w.strip(string.punctuation) for w in structural_words
+                         if w.strip(string.punctuation).isalpha() and len(w) >= 3 and w not in STOPS]
+    struct_counter = Counter(structural_words)
+    struct_top = struct_counter.most_common(5)
+    existing_kws = {k["keyword"] for k in keywords_list}
+    for i, (word, _) in enumerate(struct_top):
+        if word not in existing_kws and len(keywords_list) < 10:
+            keywords_list.append({"keyword": word, "rank": len(keywords_list) + 1,
+                                   "search_volume": None, "seo_clicks": None,
+                                   "difficulty": None, "source": "structural"})
+            existing_kws.add(word)
+
+    # --- Source 3: TF-IDF on body text (fill remaining slots) ---
+    if len(keywords_list) < 5:
+        # Skip boilerplate tags (script/style/navigation) without mutating the tree
+        SKIP_TAGS = {"script", "style", "noscript", "header", "footer", "nav"}
+        raw_text = " ".join(
+            t.strip() for t in soup.find_all(string=True)
+            if type(t) is NavigableString and t.strip() and not any(p.name in SKIP_TAGS for p in t.parents)
+        ).lower()
+        tokens = [w.strip(string.punctuation) for w in raw_text.split()]
+        tokens = [w for w in tokens if w.isalpha() and 3 <= len(w) <= 30 and w not in STOPS]
+        if tokens:
+            tf = Counter(tokens)
+            total = sum(tf.values())
+            scored = {word: (count / total) * math.log(1 + count) for word, count in tf.items()}
+            # Bigrams
+            bigrams = [f"{tokens[i]} {tokens[i+1]}" for i in range(len(tokens) - 1)]
+            bigram_counts = Counter(bigrams)
+            for bg, cnt in bigram_counts.most_common(20):
+                if cnt >= 2:
+                    scored[bg] = (cnt / total) * math.log(1 + cnt) * 1.5
+            top = sorted(scored.items(), key=lambda x: x[1], reverse=True)[:10]
+            for kw, _ in top:
+                if kw not in existing_kws and len(keywords_list) < 10:
+                    keywords_list.append({"keyword": kw, "rank": len(keywords_list) + 1,
+                                           "search_volume": None, "seo_clicks": None,
+                                           "difficulty": None, "source": "tfidf"})
+                    existing_kws.add(kw)
+
+    if not keywords_list:
+        return {}
+
+    # Re-rank sequentially
+    for i, k in enumerate(keywords_list):
+        k["rank"] = i + 1
+
+    print(f"[Keywords] Extracted {len(keywords_list)} keywords from {url} (sources: meta/structural/tfidf)", flush=True)
+    return {"keywords": keywords_list, "total": len(keywords_list), "source": "tfidf"}
+
+async def _extract_keywords_tfidf(url: str, documents: "ScanDocumentStore" = None) -> dict:
+    """Free fallback: extract on-page keywords from the (shared) homepage download."""
     try:
-        import math, string
-        from collections import Counter
-        async with httpx.AsyncClient(verify=False, follow_redirects=True, timeout=15.0) as client:
-            r = await client.get(url)
-            r.raise_for_status()
-        soup = BeautifulSoup(r.text, "lxml")
-
-        keywords_list = []
-
-        # --- Source 1: <meta name="keywords"> ---
-        meta_kw_tag = soup.find("meta", attrs={"name": "keywords"})
-        if meta_kw_tag and meta_kw_tag.get("content"):
-            raw_meta_kws = [k.strip().lower() for k in meta_kw_tag["content"].split(",") if k.strip()]
-            for i, kw in enumerate(raw_meta_kws[:5]):
-                keywords_list.append({"keyword": kw, "rank": i + 1,
-                                       "search_volume": None, "seo_clicks": None,
-                                       "difficulty": None, "source": "meta_keywords"})
-            if keywords_list:
-                print(f"[Keywords] Used meta keywords tag: {[k['keyword'] for k in keywords_list]}", flush=True)
-
-        # --- Source 2: Title + H1 + H2 (always add as supplementary) ---
-        structural_words = []
-        if soup.title and soup.title.string:
-            structural_words += soup.title.string.strip().lower().split()
-        for h in soup.find_all(["h1", "h2"]):
-            structural_words += h.get_text(separator=" ", strip=True).lower().split()
-
-        STOPS = set(
-            "the a an and or but in on at to for of with by from is are was were be been being "
-            "have has had do does did will would could should may might shall can this that these "
-            "those it its we our you your they their all any some as so if not no more most "
-            "than when where who which how what about into over after before just also only com org net www".split()
-        )
-        structural_words = [w.strip(string.punctuation) for w in structural_words
-                             if w.strip(string.punctuation).isalpha() and len(w) >= 3 and w not in STOPS]
-        struct_counter = Counter(structural_words)
-        struct_top = struct_counter.most_common(5)
-        existing_kws = {k["keyword"] for k in keywords_list}
-        for i, (word, _) in enumerate(struct_top):
-            if word not in existing_kws and len(keywords_list) < 10:
-                keywords_list.append({"keyword": word, "rank": len(keywords_list) + 1,
-                                       "search_volume": None, "seo_clicks": None,
-                                       "difficulty": None, "source": "structural"})
-                existing_kws.add(word)
-
-        # --- Source 3: TF-IDF on body text (fill remaining slots) ---
-        if len(keywords_list) < 5:
-            for tag in soup(["script", "style", "noscript", "header", "footer", "nav"]):
-                tag.decompose()
-            raw_text = soup.get_text(separator=" ", strip=True).lower()
-            tokens = [w.strip(string.punctuation) for w in raw_text.split()]
-            tokens = [w for w in tokens if w.isalpha() and 3 <= len(w) <= 30 and w not in STOPS]
-            if tokens:
-                tf = Counter(tokens)
-                total = sum(tf.values())
-                scored = {word: (count / total) * math.log(1 + count) for word, count in tf.items()}
-                # Bigrams
-                bigrams = [f"{tokens[i]} {tokens[i+1]}" for i in range(len(tokens) - 1)]
-                bigram_counts = Counter(bigrams)
-                for bg, cnt in bigram_counts.most_common(20):
-                    if cnt >= 2:
-                        scored[bg] = (cnt / total) * math.log(1 + cnt) * 1.5
-                top = sorted(scored.items(), key=lambda x: x[1], reverse=True)[:10]
-                for kw, _ in top:
-                    if kw not in existing_kws and len(keywords_list) < 10:
-                        keywords_list.append({"keyword": kw, "rank": len(keywords_list) + 1,
-                                               "search_volume": None, "seo_clicks": None,
-                                               "difficulty": None, "source": "tfidf"})
-                        existing_kws.add(kw)
-
-        if not keywords_list:
-            return {}
-
-        # Re-rank sequentially
-        for i, k in enumerate(keywords_list):
-            k["rank"] = i + 1
-
-        print(f"[Keywords] Extracted {len(keywords_list)} keywords from {url} (sources: meta/structural/tfidf)", flush=True)
-        return {"keywords": keywords_list, "total": len(keywords_list), "source": "tfidf"}
+        documents = documents or ScanDocumentStore()
+        doc = await documents.get(url, timeout=15.0)
+        doc.raise_for_status()
+        return await run_parser(_keywords_from_html, url, doc.content, doc.encoding, size=len(doc.content))
     except Exception as e:
         print(f"[Keywords] Extraction failed: {e}", flush=True)
         return {}
 
-async def fetch_seo_keywords(domain: str) -> dict:
+async def fetch_seo_keywords(domain: str, documents: "ScanDocumentStore" = None) -> dict:
     """Fetch top SEO keywords. Tries RapidAPI first, falls back to free TF-IDF extraction."""
     # --- Try RapidAPI (paid) first ---
     if RAPIDAPI_KEY:
@@ -949,50 +2799,56 @@ async def fetch_seo_keywords(domain: str) -> dict:
             print(f"SEO Keywords RapidAPI Error (falling back to TF-IDF): {e}")
     # --- Free fallback: crawl + TF-IDF ---
     url_to_crawl = domain if domain.startswith("http") else f"https://{domain}"
-    return await _extract_keywords_tfidf(url_to_crawl)
+    return await _extract_keywords_tfidf(url_to_crawl, documents)
+
+SOCIAL_PATTERNS = {
+    "facebook":  ["facebook.com", "fb.com"],
+    "twitter":   ["twitter.com", "x.com"],
+    "instagram": ["instagram.com"],
+    "linkedin":  ["linkedin.com"],
+    "youtube":   ["youtube.com", "youtu.be"],
+    "tiktok":    ["tiktok.com"],
+    "pinterest": ["pinterest.com"],
+    "snapchat":  ["snapchat.com"],
+    "reddit":    ["reddit.com"],
+    "github":    ["github.com"],
+}
+
+def _social_links_from_html(content: bytes, encoding: str = None) -> dict:
+    """Pure social-profile/mailto link extraction (runs in the parse pool for large pages)."""
+    soup = BeautifulSoup(decode_html(content, encoding), "lxml")
+    found = {}
+    for a_tag in soup.find_all("a", href=True):
+        href = a_tag["href"].strip()
+        for platform, domains in SOCIAL_PATTERNS.items():
+            if platform in found:
+                continue  # already found one for this platform
+            for d in domains:
+                if d in href:
+                    # Only keep actual profile links (not share buttons etc.)
+                    if href.startswith("http") and len(href) > len(f"https://{d}/"):
+                        found[platform] = href
+                        break
+    # Also check for email contact links
+    emails = [a["href"].replace("mailto:", "") for a in soup.find_all("a", href=True) if a["href"].startswith("mailto:")]
+    if emails:
+        found["email"] = emails[0]
+    return found
 
-async def _scrape_social_links(website_url: str) -> dict:
+async def _scrape_social_links(website_url: str, documents: "ScanDocumentStore" = None) -> dict:
     """Free fallback: scrape social media profile links directly from the homepage."""
-    SOCIAL_PATTERNS = {
-        "facebook":  ["facebook.com", "fb.com"],
-        "twitter":   ["twitter.com", "x.com"],
-        "instagram": ["instagram.com"],
-        "linkedin":  ["linkedin.com"],
-        "youtube":   ["youtube.com", "youtu.be"],
-        "tiktok":    ["tiktok.com"],
-        "pinterest": ["pinterest.com"],
-        "snapchat":  ["snapchat.com"],
-        "reddit":    ["reddit.com"],
-        "github":    ["github.com"],
-    }
     try:
-        async with httpx.AsyncClient(verify=False, follow_redirects=True, timeout=12.0) as client:
-            r = await client.get(website_url)
-            r.raise_for_status()
-        soup = BeautifulSoup(r.text, "lxml")
-        found = {}
-        for a_tag in soup.find_all("a", href=True):
-            href = a_tag["href"].strip()
-            for platform, domains in SOCIAL_PATTERNS.items():
-                if platform in found:
-                    continue  # already found one for this platform
-                for d in domains:
-                    if d in href:
-                        # Only keep actual profile links (not share buttons etc.)
-                        if href.startswith("http") and len(href) > len(f"https://{d}/"):
-                            found[platform] = href
-                            break
-        # Also check for email contact links
-        emails = [a["href"].replace("mailto:", "") for a in soup.find_all("a", href=True) if a["href"].startswith("mailto:")]
-        if emails:
-            found["email"] = emails[0]
+        documents = documents or ScanDocumentStore()
+        doc = await documents.get(website_url, timeout=12.0)
+        doc.raise_for_status()
+        found = await run_parser(_social_links_from_html, doc.content, doc.encoding, size=len(doc.content))
         print(f"[Social Scraper] Found {len(found)} social links on {website_url}: {list(found.keys())}", flush=True)
         return found
     except Exception as e:
         print(f"[Social Scraper] Free scrape failed: {e}", flush=True)
         return {}
 
-async def fetch_social_links(website_url: str) -> dict:
+async def fetch_social_links(website_url: str, documents: "ScanDocumentStore" = None) -> dict:
     """Fetch social media links. Tries RapidAPI first, falls back to free BeautifulSoup scrape."""
     # --- Try RapidAPI (paid) first ---
     if RAPIDAPI_KEY:
@@ -1011,58 +2867,63 @@ async def fetch_social_links(website_url: str) -> dict:
         except Exception as e:
             print(f"Social Scraper RapidAPI Error (falling back to BS4): {e}")
     # --- Free fallback: scrape homepage directly ---
-    return await _scrape_social_links(website_url)
+    return await _scrape_social_links(website_url, documents)
+
+def _website_info_from_html(content: bytes, encoding: str = None) -> dict:
+    """Pure metadata extraction (runs in the parse pool for large pages)."""
+    soup = BeautifulSoup(decode_html(content, encoding), "lxml")
+    # Title
+    title = soup.title.string.strip() if soup.title and soup.title.string else None
+    # Meta description
+    meta_desc = soup.find("meta", attrs={"name": "description"})
+    description = meta_desc["content"].strip() if meta_desc and meta_desc.has_attr("content") else None
+    # Meta keywords
+    meta_kw = soup.find("meta", attrs={"name": "keywords"})
+    keywords_raw = meta_kw["content"].strip() if meta_kw and meta_kw.has_attr("content") else ""
+    keywords = [k.strip() for k in keywords_raw.split(",") if k.strip()] if keywords_raw else []
+    # Language
+    lang = soup.html.get("lang", "") if soup.html else ""
+    # Favicon
+    favicon_tag = soup.find("link", rel=lambda r: r and "icon" in " ".join(r).lower())
+    favicon = favicon_tag.get("href", "") if favicon_tag else ""
+    # OpenGraph
+    og_image = ""
+    og_tag = soup.find("meta", property="og:image") or soup.find("meta", attrs={"name": "og:image"})
+    if og_tag and og_tag.has_attr("content"):
+        og_image = og_tag["content"]
+    # Theme color
+    theme_tag = soup.find("meta", attrs={"name": "theme-color"})
+    theme_color = theme_tag["content"] if theme_tag and theme_tag.has_attr("content") else None
+    # Viewport
+    vp_tag = soup.find("meta", attrs={"name": "viewport"})
+    has_viewport = vp_tag is not None
+    result = {
+        "title": title,
+        "description": description,
+        "keywords": keywords,
+        "language": lang,
+        "favicon": favicon,
+        "og_image": og_image,
+        "theme_color": theme_color,
+        "has_viewport_meta": has_viewport,
+        "source": "scraped"
+    }
+    return result
 
-async def _scrape_website_info(website_url: str) -> dict:
+async def _scrape_website_info(website_url: str, documents: "ScanDocumentStore" = None) -> dict:
     """Free fallback: scrape website metadata using BeautifulSoup."""
     try:
-        async with httpx.AsyncClient(verify=False, follow_redirects=True, timeout=12.0) as client:
-            r = await client.get(website_url)
-            r.raise_for_status()
-        soup = BeautifulSoup(r.text, "lxml")
-        # Title
-        title = soup.title.string.strip() if soup.title and soup.title.string else None
-        # Meta description
-        meta_desc = soup.find("meta", attrs={"name": "description"})
-        description = meta_desc["content"].strip() if meta_desc and meta_desc.has_attr("content") else None
-        # Meta keywords
-        meta_kw = soup.find("meta", attrs={"name": "keywords"})
-        keywords_raw = meta_kw["content"].strip() if meta_kw and meta_kw.has_attr("content") else ""
-        keywords = [k.strip() for k in keywords_raw.split(",") if k.strip()] if keywords_raw else []
-        # Language
-        lang = soup.html.get("lang", "") if soup.html else ""
-        # Favicon
-        favicon_tag = soup.find("link", rel=lambda r: r and "icon" in " ".join(r).lower())
-        favicon = favicon_tag.get("href", "") if favicon_tag else ""
-        # OpenGraph
-        og_image = ""
-        og_tag = soup.find("meta", property="og:image") or soup.find("meta", attrs={"name": "og:image"})
-        if og_tag and og_tag.has_attr("content"):
-            og_image = og_tag["content"]
-        # Theme color
-        theme_tag = soup.find("meta", attrs={"name": "theme-color"})
-        theme_color = theme_tag["content"] if theme_tag and theme_tag.has_attr("content") else None
-        # Viewport
-        vp_tag = soup.find("meta", attrs={"name": "viewport"})
-        has_viewport = vp_tag is not None
-        result = {
-            "title": title,
-            "description": description,
-            "keywords": keywords,
-            "language": lang,
-            "favicon": favicon,
-            "og_image": og_image,
-            "theme_color": theme_color,
-            "has_viewport_meta": has_viewport,
-            "source": "scraped"
-        }
+        documents = documents or ScanDocumentStore()
+        doc = await documents.get(website_url, timeout=12.0)
+        doc.raise_for_status()
+        result = await run_parser(_website_info_from_html, doc.content, doc.encoding, size=len(doc.content))
         print(f"[Website Info] Scraped metadata for {website_url}", flush=True)
         return result
     except Exception as e:
         print(f"[Website Info] Free scrape failed: {e}", flush=True)
         return {}
 
-async def fetch_website_info(website_url: str) -> dict:
+async def fetch_website_info(website_url: str, documents: "ScanDocumentStore" = None) -> dict:
     """Fetch website metadata. Tries RapidAPI first, falls back to free BeautifulSoup scrape."""
     # --- Try RapidAPI (paid) first ---
     if RAPIDAPI_KEY:
@@ -1078,29 +2939,57 @@ async def fetch_website_info(website_url: str) -> dict:
         except Exception as e:
             print(f"Website Info RapidAPI Error (falling back to scrape): {e}")
     # --- Free fallback: BeautifulSoup scrape ---
-    return await _scrape_website_info(website_url)
+    return await _scrape_website_info(website_url, documents)
 
 # ============================================================
 # Supabase Data Access
 # ============================================================
 
-# Provide simple methods for Supabase data fetching
+# Provide simple methods for Supabase data fetching.
+# All of them share one application-lifetime client: keep-alive pooling (and HTTP/2 when h2
+# is installed) means a scan's database round trips reuse a warm connection instead of a
+# fresh TCP+TLS handshake per call. Paths below are relative to {SUPABASE_URL}/rest/v1.
+
+SUPABASE_HEADERS = {
+    "apikey": SUPABASE_KEY,
+    "Authorization": f"Bearer {SUPABASE_KEY}"
+}
+
+supabase_client = None
+
+def get_supabase_client() -> httpx.AsyncClient:
+    """Return the shared Supabase REST client. Created in lifespan(); lazily for standalone scripts."""
+    global supabase_client
+    if supabase_client is None or supabase_client.is_closed:
+        supabase_client = httpx.AsyncClient(
+            base_url=f"{SUPABASE_URL}/rest/v1",
+            headers=SUPABASE_HEADERS,
+            http2=HTTP2_AVAILABLE,
+            limits=httpx.Limits(
+                max_connections=SUPABASE_MAX_CONNECTIONS,
+                max_keepalive_connections=SUPABASE_MAX_KEEPALIVE,
+                keepalive_expiry=SUPABASE_KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(15.0, connect=5.0),
+        )
+    return supabase_client
+
+async def close_supabase_client():
+    global supabase_client
+    if supabase_client is not None:
+        await supabase_client.aclose()
+        supabase_client = None
 
 async def fetch_user_integrations(user_id):
     if not user_id:
         return None
-    url = f"{SUPABASE_URL}/rest/v1/user_integrations?user_id=eq.{user_id}&provider=eq.google"
-    headers = {
-        "apikey": SUPABASE_KEY,
-        "Authorization": f"Bearer {SUPABASE_KEY}"
-    }
-    async with httpx.AsyncClient() as client:
-        try:
-            r = await client.get(url, headers=headers)
-            if r.status_code == 200 and r.json():
-                return r.json()[0]
-        except Exception as e:
-            print(f"Error fetching integrations for {user_id}: {e}")
+    client = get_supabase_client()
+    try:
+        r = await client.get(f"/user_integrations?user_id=eq.{user_id}&provider=eq.google")
+        if r.status_code == 200 and r.json():
+            return r.json()[0]
+    except Exception as e:
+        print(f"Error fetching integrations for {user_id}: {e}")
     return None
 
 async def fetch_user_webhooks(user_id, event_type="scan.completed"):
@@ -1108,20 +2997,29 @@ async def fetch_user_webhooks(user_id, event_type="scan.completed"):
         return []
     
     # Filter for active webhooks that contain the event_type in 'events' text array
-    url = f"{SUPABASE_URL}/rest/v1/webhooks?user_id=eq.{user_id}&is_active=eq.true&events=cs.{{\"{event_type}\"}}"
-    headers = {
-        "apikey": SUPABASE_KEY,
-        "Authorization": f"Bearer {SUPABASE_KEY}"
-    }
-    async with httpx.AsyncClient() as client:
-        try:
-            r = await client.get(url, headers=headers)
-            if r.status_code == 200:
-                return r.json()
-        except Exception as e:
-            print(f"Error fetching webhooks for {user_id}: {e}")
+    client = get_supabase_client()
+    try:
+        r = await client.get(f"/webhooks?user_id=eq.{user_id}&is_active=eq.true&events=cs.{{\"{event_type}\"}}")
+        if r.status_code == 200:
+            return r.json()
+    except Exception as e:
+        print(f"Error fetching webhooks for {user_id}: {e}")
     return []
 
+async def create_notification(user_id, title, message, notif_type="success", action_url=None):
+    """Insert an in-app notification row for the user."""
+    payload = {
+        "user_id": user_id,
+        "title": title,
+        "message": message,
+        "type": notif_type
+    }
+    if action_url:
+        payload["action_url"] = action_url
+    client = get_supabase_client()
+    r = await client.post("/notifications", json=payload, headers={"Prefer": "return=minimal"})
+    r.raise_for_status()
+
 async def dispatch_webhooks(webhooks, payload):
     if not webhooks:
         return
@@ -1150,7 +3048,7 @@ async def dispatch_webhooks(webhooks, payload):
         tasks = [send_webhook(client, w) for w in webhooks]
         await asyncio.gather(*tasks, return_exceptions=True)
 
-async def fetch_gsc_data(access_token, domain):
+async def fetch_gsc_data(access_token, domain, client: httpx.AsyncClient = None):
     # Strip https:// and trailing slashes for GSC inspect URL
     clean_domain = domain.replace("https://", "").replace("http://", "").strip("/")
     site_url = f"sc-domain:{clean_domain}"
@@ -1171,110 +3069,199 @@ async def fetch_gsc_data(access_token, domain):
         "dimensions": ["query", "device"]
     }
     
+    owns_client = client is None
+    client = client or httpx.AsyncClient()
     try:
-        async with httpx.AsyncClient() as client:
-            r = await client.post(url, headers=headers, json=payload, timeout=10.0)
-            if r.status_code == 200:
-                data = r.json()
-                rows = data.get("rows", [])
-                clicks = sum(row.get("clicks", 0) for row in rows)
-                impressions = sum(row.get("impressions", 0) for row in rows)
-                return {
-                    "connected": True,
-                    "clicks_30d": clicks,
-                    "impressions_30d": impressions,
-                    "queries_count": len(rows),
-                    "status": "success"
-                }
-            elif r.status_code == 403:
-                return {"connected": False, "error": "Permission denied. Ensure site is verified in GSC."}
-            else:
-                return {"connected": False, "error": f"API returned {r.status_code}"}
+        r = await client.post(url, headers=headers, json=payload, timeout=10.0)
+        if r.status_code == 200:
+            data = r.json()
+            rows = data.get("rows", [])
+            clicks = sum(row.get("clicks", 0) for row in rows)
+            impressions = sum(row.get("impressions", 0) for row in rows)
+            return {
+                "connected": True,
+                "clicks_30d": clicks,
+                "impressions_30d": impressions,
+                "queries_count": len(rows),
+                "status": "success"
+            }
+        elif r.status_code == 403:
+            return {"connected": False, "error": "Permission denied. Ensure site is verified in GSC."}
+        else:
+            return {"connected": False, "error": f"API returned {r.status_code}"}
     except Exception as e:
         print(f"GSC fetch error: {e}")
         return {"connected": False, "error": str(e)}
+    finally:
+        if owns_client:
+            await client.aclose()
 
-async def fetch_adsense_data(access_token):
+async def fetch_adsense_data(access_token, client: httpx.AsyncClient = None):
     url = "https://adsense.googleapis.com/v2/accounts"
     headers = {
          "Authorization": f"Bearer {access_token}"
     }
+    owns_client = client is None
+    client = client or httpx.AsyncClient()
     try:
-         async with httpx.AsyncClient() as client:
-             r = await client.get(url, headers=headers, timeout=10.0)
-             if r.status_code == 200:
-                 data = r.json()
-                 accounts = data.get("accounts", [])
-                 if not accounts:
-                     return {"connected": True, "has_account": False, "status": "No AdSense account found"}
-                 
-                 # Just return basic info for the first account
-                 acc = accounts[0]
-                 return {
-                     "connected": True,
-                     "has_account": True,
-                     "account_id": acc.get("name"),
-                     "state": acc.get("state"),
-                     "status": "success"
-                 }
-             else:
-                 return {"connected": False, "error": f"API returned {r.status_code}"}
+         r = await client.get(url, headers=headers, timeout=10.0)
+         if r.status_code == 200:
+             data = r.json()
+             accounts = data.get("accounts", [])
+             if not accounts:
+                 return {"connected": True, "has_account": False, "status": "No AdSense account found"}
+
+             # Just return basic info for the first account
+             acc = accounts[0]
+             return {
+                 "connected": True,
+                 "has_account": True,
+                 "account_id": acc.get("name"),
+                 "state": acc.get("state"),
+                 "status": "success"
+             }
+         else:
+             return {"connected": False, "error": f"API returned {r.status_code}"}
     except Exception as e:
          print(f"AdSense fetch error: {e}")
          return {"connected": False, "error": str(e)}
+    finally:
+         if owns_client:
+             await client.aclose()
 
-async def fetch_pending_scans():
-    url = f"{SUPABASE_URL}/rest/v1/adsense_scans?status=eq.pending&select=*&limit=5"
-    headers = {
-        "apikey": SUPABASE_KEY,
-        "Authorization": f"Bearer {SUPABASE_KEY}"
+async def claim_pending_scans(limit=5):
+    """
+    Atomically lease up to `limit` pending scans (plus running scans whose lease expired)
+    to this worker via the claim_pending_scans RPC (FOR UPDATE SKIP LOCKED), so several
+    worker replicas never pick up the same row.
+    """
+    payload = {
+        "p_worker_id": WORKER_ID,
+        "p_limit": limit,
+        "p_lease_seconds": SCAN_LEASE_SECONDS,
+        "p_max_attempts": SCAN_MAX_ATTEMPTS
     }
-    async with httpx.AsyncClient() as client:
-        try:
-            r = await client.get(url, headers=headers)
-            r.raise_for_status()
-            return r.json()
-        except:
-            return []
+    client = get_supabase_client()
+    try:
+        r = await client.post("/rpc/claim_pending_scans", json=payload)
+        r.raise_for_status()
+        return r.json()
+    except Exception as e:
+        print(f"Failed to claim pending scans: {e}", flush=True)
+        return []
 
-async def fetch_site_url(site_id):
-    url = f"{SUPABASE_URL}/rest/v1/sites?id=eq.{site_id}&select=url"
-    headers = {
-        "apikey": SUPABASE_KEY,
-        "Authorization": f"Bearer {SUPABASE_KEY}"
+async def claim_scan(scan_id):
+    """
+    Lease one specific scan if it is still pending. Returns the claimed row or None.
+    Goes through the claim_scan RPC so claim_attempts is counted as for polled scans.
+    """
+    payload = {
+        "p_scan_id": scan_id,
+        "p_worker_id": WORKER_ID,
+        "p_lease_seconds": SCAN_LEASE_SECONDS
     }
-    async with httpx.AsyncClient() as client:
-        try:
-            r = await client.get(url, headers=headers)
-            r.raise_for_status()
-            data = r.json()
-            if data:
-                return data[0]["url"]
-            print(f"Zero rows returned when finding url for site {site_id}. Supabase says: {r.text}", flush=True)
-            return None
-        except httpx.HTTPError as e:
-            print(f"HTTP Exception while fetching site URL: {e}", flush=True)
-            if 'r' in locals() and r is not None:
-                print(f"Supabase Response Body: {r.text}", flush=True)
-            return None
-        except Exception as e:
-            print(f"Generic Python exception when fetching site URL: {e}", flush=True)
-            return None
+    client = get_supabase_client()
+    try:
+        r = await client.post("/rpc/claim_scan", json=payload)
+        r.raise_for_status()
+        rows = r.json()
+        return rows[0] if rows else None
+    except Exception as e:
+        print(f"Failed to claim scan {scan_id}: {e}", flush=True)
+        return None
 
-async def update_scan_record(scan_id, payload):
-    url = f"{SUPABASE_URL}/rest/v1/adsense_scans?id=eq.{scan_id}"
-    headers = {
-        "apikey": SUPABASE_KEY,
-        "Authorization": f"Bearer {SUPABASE_KEY}",
-        "Content-Type": "application/json",
-        "Prefer": "return=minimal"
+async def renew_scan_leases(scan_ids):
+    """Heartbeat: extend the lease on every scan this worker still holds."""
+    if not scan_ids:
+        return
+    ids = ",".join(str(i) for i in scan_ids)
+    now = datetime.datetime.now(datetime.timezone.utc)
+    payload = {
+        "heartbeat_at": now.isoformat(),
+        "lease_expires_at": (now + datetime.timedelta(seconds=SCAN_LEASE_SECONDS)).isoformat()
     }
-    async with httpx.AsyncClient() as client:
-        try:
-            r = await client.patch(url, headers=headers, json=payload)
-            r.raise_for_status()
-        except Exception as e:
-            print(f"Failed to update scan {scan_id} in DB:", e)
+    client = get_supabase_client()
+    try:
+        r = await client.patch(f"/adsense_scans?id=in.({ids})&claimed_by=eq.{WORKER_ID}&status=eq.running", json=payload,
+                               headers={"Prefer": "return=minimal"})
+        r.raise_for_status()
+    except Exception as e:
+        print(f"Failed to renew scan leases: {e}", flush=True)
+
+async def release_scans(scan_ids):
+    """Hand scans this worker claimed but never started back to the pending queue."""
+    if not scan_ids:
+        return
+    ids = ",".join(str(i) for i in scan_ids)
+    payload = {"status": "pending", "claimed_by": None, "lease_expires_at": None}
+    client = get_supabase_client()
+    try:
+        r = await client.patch(f"/adsense_scans?id=in.({ids})&claimed_by=eq.{WORKER_ID}", json=payload,
+                               headers={"Prefer": "return=minimal"})
+        r.raise_for_status()
+    except Exception as e:
+        print(f"Failed to release scans: {e}", flush=True)
+
+async def fetch_site_url(site_id):
+    client = get_supabase_client()
+    r = None
+    try:
+        r = await client.get(f"/sites?id=eq.{site_id}&select=url")
+        r.raise_for_status()
+        data = r.json()
+        if data:
+            return data[0]["url"]
+        print(f"Zero rows returned when finding url for site {site_id}. Supabase says: {r.text}", flush=True)
+        return None
+    except httpx.HTTPError as e:
+        print(f"HTTP Exception while fetching site URL: {e}", flush=True)
+        if r is not None:
+            print(f"Supabase Response Body: {r.text}", flush=True)
+        return None
+    except Exception as e:
+        print(f"Generic Python exception when fetching site URL: {e}", flush=True)
+        return None
+
+async def update_scan_record(scan_id, payload):
+    client = get_supabase_client()
+    try:
+        r = await client.patch(f"/adsense_scans?id=eq.{scan_id}", json=payload, headers={"Prefer": "return=minimal"})
+        r.raise_for_status()
+    except Exception as e:
+        print(f"Failed to update scan {scan_id} in DB:", e)
+
+async def save_scan_drafts(scan_id, drafts: dict, settled=(), overwrite: bool = True) -> bool:
+    """
+    Merge drafts into the scan's trust_pages_data and drop the `settled` page types from its
+    drafts_pending list. The merge_scan_drafts RPC does it per page type in one statement, so
+    the background fill and /regenerate-draft never overwrite each other's keys; with
+    overwrite=False, drafts already stored win. Returns False if the scan row does not exist;
+    raises on DB errors.
+    """
+    payload = {"p_scan_id": scan_id, "p_drafts": drafts, "p_settled": list(settled), "p_overwrite": overwrite}
+    client = get_supabase_client()
+    r = await client.post("/rpc/merge_scan_drafts", json=payload)
+    r.raise_for_status()
+    return bool(r.json())
+
+async def fill_missing_drafts(scan_id, domain: str, page_types: list):
+    """Generate the drafts a finished scan is still missing (concurrently, under the AI limiter) and store them."""
+    started = time.monotonic()
+    # process_scan already looked these up in draft_cache and missed
+    results = await asyncio.gather(*(generate_missing_page_draft(domain, t, use_cache=False) for t in page_types),
+                                   return_exceptions=True)
+    drafts = {t: d for t, d in zip(page_types, results) if isinstance(d, str) and d}
+    try:
+        # A draft regenerated meanwhile is newer than this one
+        await save_scan_drafts(scan_id, drafts, settled=page_types, overwrite=False)
+        print(f"[{scan_id}] {len(drafts)} missing page draft(s) added in {time.monotonic() - started:.1f}s", flush=True)
+    except Exception as e:
+        print(f"[{scan_id}] Failed to store missing page drafts: {e}", flush=True)
+
+def schedule_draft_fill(scan_id, domain: str, page_types: list):
+    task = asyncio.create_task(fill_missing_drafts(scan_id, domain, page_types))
+    draft_tasks.add(task)
+    task.add_done_callback(draft_tasks.discard)
 
 async def check_url_status(client, url):
     try:
@@ -1283,80 +3270,267 @@ async def check_url_status(client, url):
     except Exception:
         return False
 
+# ============================================================
+# Google Integration Data
+# ============================================================
+
+# Both Google calls of a scan go out together on one client. The stored OAuth token is
+# refreshed shortly before it expires (or once after a 401), and successful answers are
+# reused for GOOGLE_DATA_CACHE_TTL so back-to-back scans of a property don't re-query Google.
+
+GOOGLE_TOKEN_URL = "https://oauth2.googleapis.com/token"
+google_data_cache = ResultCache("google_data", GOOGLE_DATA_CACHE_TTL)
+google_token_refreshes = {}  # user id -> in-flight refresh task
+
+async def refresh_google_token(integration: dict):
+    """Trade the stored refresh token for a new access token and save it. Returns the new fields or None."""
+    user_id = integration.get("user_id")
+    if not (GOOGLE_CLIENT_ID and GOOGLE_CLIENT_SECRET and integration.get("refresh_token")):
+        return None
+    try:
+        async with httpx.AsyncClient() as client:
+            r = await client.post(GOOGLE_TOKEN_URL, data={
+                "client_id": GOOGLE_CLIENT_ID,
+                "client_secret": GOOGLE_CLIENT_SECRET,
+                "refresh_token": integration["refresh_token"],
+                "grant_type": "refresh_token",
+            }, timeout=10.0)
+        if r.status_code != 200:
+            # invalid_grant: the user revoked access, so only reconnecting helps
+            print(f"[Google] Token refresh failed for user {user_id}: {r.status_code} {r.text[:200]}", flush=True)
+            return None
+        data = r.json()
+    except Exception as e:
+        print(f"[Google] Token refresh error for user {user_id}: {e}", flush=True)
+        return None
+    METRICS["google.token_refreshes"] += 1
+
+    now = datetime.datetime.now(datetime.timezone.utc)
+    updated = {
+        "access_token": data["access_token"],
+        "token_expires_at": (now + datetime.timedelta(seconds=int(data.get("expires_in", 3600)))).isoformat(),
+        "updated_at": now.isoformat(),
+    }
+    if data.get("refresh_token"):
+        updated["refresh_token"] = data["refresh_token"]
+    client = get_supabase_client()
+    try:
+        r = await client.patch(f"/user_integrations?user_id=eq.{user_id}&provider=eq.google", json=updated,
+                               headers={"Prefer": "return=minimal"})
+        r.raise_for_status()
+    except Exception as e:
+        print(f"[Google] Failed to store the refreshed token for user {user_id}: {e}", flush=True)
+    return updated
+
+async def google_access_token(integration: dict, force: bool = False):
+    """The integration's access token, refreshed first if it expires within GOOGLE_TOKEN_REFRESH_MARGIN."""
+    due = force
+    if not due and integration.get("token_expires_at"):
+        try:
+            due = parse_iso_timestamp(integration["token_expires_at"]).timestamp() - time.time() < GOOGLE_TOKEN_REFRESH_MARGIN
+        except ValueError:
+            due = False
+    if due:
+        # Concurrent scans for one user share a single refresh
+        user_id = integration.get("user_id")
+        task = google_token_refreshes.get(user_id)
+        if task is None:
+            task = asyncio.create_task(refresh_google_token(integration))
+            google_token_refreshes[user_id] = task
+            task.add_done_callback(lambda _: google_token_refreshes.pop(user_id, None))
+        refreshed = await task
+        if refreshed:
+            integration.update(refreshed)
+    return integration.get("access_token")
+
+def google_unauthorized(result: dict) -> bool:
+    return bool(result) and result.get("error") == "API returned 401"
+
+async def fetch_google_data(integration: dict, site_root: str) -> tuple:
+    """(GSC insights, AdSense status) for a connected user, from the cache or both APIs at once."""
+    user_id = integration.get("user_id")
+    keys = {"gsc": ("gsc", user_id, site_root), "adsense": ("adsense", user_id)}
+    cached = await google_data_cache.get_many(list(keys.values()))
+    results = {name: cached.get(key) for name, key in keys.items()}
+    missing = [name for name, value in results.items() if value is None]
+
+    if missing:
+        async with httpx.AsyncClient() as client:
+            calls = {
+                "gsc": lambda token: fetch_gsc_data(token, site_root, client),
+                "adsense": lambda token: fetch_adsense_data(token, client),
+            }
+
+            async def fetch_all(names, token):
+                return dict(zip(names, await asyncio.gather(*(calls[name](token) for name in names))))
+
+            token = await google_access_token(integration)
+            fresh = await fetch_all(missing, token)
+            rejected = [name for name, result in fresh.items() if google_unauthorized(result)]
+            if rejected and integration.get("refresh_token"):
+                print(f"[Google] Access token rejected for user {user_id}, refreshing", flush=True)
+                refreshed = await google_access_token(integration, force=True)
+                # A failed refresh (e.g. invalid_grant) leaves the rejected token: don't resend it
+                if refreshed and refreshed != token:
+                    fresh.update(await fetch_all(rejected, refreshed))
+        results.update(fresh)
+        await google_data_cache.set_many([(keys[name], result, None) for name, result in fresh.items() if result.get("connected")])
+    return results["gsc"], results["adsense"]
+
+# ============================================================
+# Scan Stage Graph
+# ============================================================
+
+class ScanStageGraph:
+    """
+    Dependency graph of the stages that make up one scan.
+    Every stage declares the stages it needs and starts as soon as those have finished,
+    so network-bound checks that only need the site URL (SSL, PageSpeed, Safe Browsing,
+    WHOIS, ...) overlap with the homepage fetch and crawl instead of queueing behind them.
+    """
+
+    def __init__(self, label: str = ""):
+        self.label = label
+        self.stages = {}
+        self.results = {}
+        self.timings = {}
+
+    def stage(self, name: str, after=(), optional: bool = False):
+        """
+        Decorator registering an async, argument-less stage function.
+        A failing required stage cancels the whole run and re-raises; an optional stage
+        records the exception as its result instead (like gather(return_exceptions=True)).
+        """
+        def register(fn):
+            if name in self.stages:
+                raise ValueError(f"Duplicate scan stage: {name}")
+            self.stages[name] = (fn, tuple(after), optional)
+            return fn
+        return register
+
+    def _check(self):
+        for name, (_, after, _) in self.stages.items():
+            unknown = [dep for dep in after if dep not in self.stages]
+            if unknown:
+                raise ValueError(f"Scan stage {name} depends on unknown stage(s): {unknown}")
+        # Kahn's algorithm: anything left over sits on a cycle and would wait forever
+        pending = {name: set(after) for name, (_, after, _) in self.stages.items()}
+        while pending:
+            ready = [name for name, deps in pending.items() if not deps]
+            if not ready:
+                raise ValueError(f"Scan stages form a cycle: {sorted(pending)}")
+            for name in ready:
+                del pending[name]
+            for deps in pending.values():
+                deps.difference_update(ready)
+
+    async def run(self) -> dict:
+        self._check()
+        started = time.monotonic()
+        tasks = {}
+
+        async def run_stage(name):
+            fn, after, optional = self.stages[name]
+            if after:
+                await asyncio.gather(*(tasks[dep] for dep in after))
+            stage_started = time.monotonic()
+            try:
+                self.results[name] = await fn()
+            except Exception as e:
+                if not optional:
+                    raise
+                self.results[name] = e
+            finally:
+                self.timings[name] = {
+                    "start": round(stage_started - started, 3),
+                    "seconds": round(time.monotonic() - stage_started, 3),
+                }
+
+        for name in self.stages:
+            tasks[name] = asyncio.create_task(run_stage(name), name=f"{self.label}:{name}")
+        try:
+            await asyncio.gather(*tasks.values())
+        except BaseException:
+            for task in tasks.values():
+                task.cancel()
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+            raise
+        return self.results
+
+    def timing_summary(self) -> str:
+        ordered = sorted(self.timings.items(), key=lambda item: item[1]["start"])
+        return ", ".join(f"{name}@{t['start']}s+{t['seconds']}s" for name, t in ordered)
+
 async def process_scan(scan_record):
-    import httpx as httpx  # Explicit local binding to prevent UnboundLocalError from closure machinery
     scan_id = scan_record["id"]
     site_id = scan_record["site_id"]
     print(f"[{scan_id}] Starting process_scan... Received site_id: {site_id}", flush=True)
 
-    
+
     try:
         target_url = await fetch_site_url(site_id)
         if not target_url:
             print(f"[{scan_id}] FATAL: Site ID {site_id} not found in sites table. Cannot proceed.", flush=True)
             await update_scan_record(scan_id, {"status": "failed"})
             return
-            
+
         print(f"[{scan_id}] Target URL extracted: {target_url}", flush=True)
         if not target_url.startswith("http"):
             target_url = "https://" + target_url
 
         print(f"[{scan_id}] Starting scan for {target_url}...")
-        
-        # Check for Google integrations
         user_id = scan_record.get("user_id")
-        integration = await fetch_user_integrations(user_id) if user_id else None
-        
-        gsc_data_api = None
-        adsense_data_api = None
-
-        if integration and integration.get("access_token"):
-            print(f"[{scan_id}] Found Google integration for user {user_id}. Fetching GSC/AdSense...")
-            access_token = integration.get("access_token")
-            domain = f"{urlparse(target_url).scheme}://{urlparse(target_url).netloc}"
-            
-            gsc_data_api = await fetch_gsc_data(access_token, domain)
-            adsense_data_api = await fetch_adsense_data(access_token)
-            
-            if gsc_data_api.get("error") and "401" in str(gsc_data_api.get("error")):
-                 print("Access token might be expired. TODO: Implement refresh flow.")
 
         # Mark as running
         await update_scan_record(scan_id, {"status": "running"})
-        
+
         core_scan_data = {}
         trust_pages_data = {}
         seo_data = {}
         security_data = {}
-        
-        async with httpx.AsyncClient(verify=False, follow_redirects=True) as client:
+
+        # State shared between stages. Stages write it through `nonlocal` and only read what
+        # the stages they declared in `after=` have produced.
+        homepage = None
+        final_url = target_url
+        domain = f"{urlparse(target_url).scheme}://{urlparse(target_url).netloc}"
+        page = None
+        internal_links = set()
+        external_links = set()
+        candidate_links = {}
+        has_cookie_consent = False
+        mixed_content_found = False
+        homepage_words = 0
+        all_links_to_check = set()
+        target_domain = urlparse(target_url).netloc
+
+        graph = ScanStageGraph(label=str(scan_id))
+
+        # Check for Google integrations
+        @graph.stage("google")
+        async def google_stage():
+            integration = await fetch_user_integrations(user_id) if user_id else None
+            if not (integration and integration.get("access_token")):
+                return None, None
+
+            print(f"[{scan_id}] Found Google integration for user {user_id}. Fetching GSC/AdSense...")
+            site_root = f"{urlparse(target_url).scheme}://{urlparse(target_url).netloc}"
+            return await fetch_google_data(integration, site_root)
+
+        @graph.stage("homepage")
+        async def homepage_stage():
+            nonlocal homepage, final_url, domain
             try:
-                response = await client.get(target_url, timeout=15.0)
-                final_url = str(response.url)
-                
+                homepage = await documents.get(target_url, timeout=15.0)
+                final_url = homepage.final_url
+
                 # Check for redirect chain
                 core_scan_data["redirects"] = {
-                    "chain_length": len(response.history),
-                    "has_chain": len(response.history) > 2
+                    "chain_length": homepage.history_length,
+                    "has_chain": homepage.history_length > 2
                 }
-                
-                # Enhanced SSL/HTTPS check
-                ssl_check_result = await verify_ssl(final_url)
-                
-                # Check HTTP -> HTTPS redirect explicitly
-                if final_url.startswith("https"):
-                    http_url = final_url.replace("https://", "http://", 1)
-                    try:
-                        http_res = await client.get(http_url, timeout=5.0)
-                        if not str(http_res.url).startswith("https://"):
-                            ssl_check_result["protocol"] = "HTTP" # Penalty for weak setup
-                            ssl_check_result["status"] = "failed"
-                    except:
-                        pass # if it doesn't resolve or timeouts, it's virtually unattackable via pure http
-                        
-                core_scan_data["ssl_check"] = ssl_check_result
-                html_content = response.text
-                headers = response.headers
+
+                headers = homepage.headers
 
                 # Caching headers check
                 cache_control = headers.get("cache-control", "")
@@ -1369,23 +3543,23 @@ async def process_scan(scan_record):
                     "expires": expires or None,
                     "policy_summary": cache_policy
                 }
-                
+
                 # Security Headers (Enhanced)
                 csp_val = None
                 sts_val = None
                 frame_val = None
                 ctype_val = None
-                
+
                 for k, v in headers.items():
                     kl = k.lower()
                     if kl == "content-security-policy": csp_val = v
                     elif kl == "strict-transport-security": sts_val = v
                     elif kl == "x-frame-options": frame_val = v
                     elif kl == "x-content-type-options": ctype_val = v
-                    
+
                 sts_active = sts_val is not None and "max-age" in sts_val.lower() and "max-age=0" not in sts_val.lower()
                 frame_active = frame_val is not None and frame_val.upper() in ["DENY", "SAMEORIGIN"]
-                
+
                 security_data["headers"] = {
                     "csp": csp_val is not None,
                     "sts": sts_active,
@@ -1394,15 +3568,44 @@ async def process_scan(scan_record):
                 }
             except Exception as e:
                 print(f"Error fetching main URL: {e}")
-                html_content = ""
+                homepage = None
                 final_url = target_url
-                
+
             domain = f"{urlparse(final_url).scheme}://{urlparse(final_url).netloc}"
-            
-            # 2. robots.txt & sitemap.xml
+
+        # The certificate only depends on the host, so start the handshake with the homepage fetch
+        @graph.stage("ssl")
+        async def ssl_stage():
+            return await verify_ssl(target_url)
+
+        @graph.stage("ssl_check", after=("homepage", "ssl"))
+        async def ssl_check_stage():
+            if homepage is None:
+                return
+            # Enhanced SSL/HTTPS check (repeated only if the redirects landed on another host)
+            ssl_check_result = graph.results["ssl"]
+            if urlparse(final_url).hostname != urlparse(target_url).hostname:
+                ssl_check_result = await verify_ssl(final_url)
+
+            # Check HTTP -> HTTPS redirect explicitly
+            if final_url.startswith("https"):
+                http_url = final_url.replace("https://", "http://", 1)
+                try:
+                    http_res = await client.get(http_url, timeout=5.0)
+                    if not str(http_res.url).startswith("https://"):
+                        ssl_check_result["protocol"] = "HTTP" # Penalty for weak setup
+                        ssl_check_result["status"] = "failed"
+                except:
+                    pass # if it doesn't resolve or timeouts, it's virtually unattackable via pure http
+
+            core_scan_data["ssl_check"] = ssl_check_result
+
+        # 2. robots.txt & sitemap.xml
+        @graph.stage("robots", after=("homepage",))
+        async def robots_stage():
             try:
                 robots_url = f"{domain}/robots.txt"
-                robots_res = await client.get(robots_url, timeout=5.0)
+                robots_res = await documents.get(robots_url, timeout=5.0)
                 if robots_res.status_code == 200:
                     rp = urllib.robotparser.RobotFileParser()
                     rp.parse(robots_res.text.splitlines())
@@ -1417,80 +3620,80 @@ async def process_scan(scan_record):
             except:
                 core_scan_data["robots_txt"] = {"exists": False}
 
+        @graph.stage("sitemap", after=("robots",))
+        async def sitemap_stage():
+            default_sitemap = f"{domain}/sitemap.xml"
+            robots_sitemaps = []
+            if core_scan_data.get("robots_txt", {}).get("exists"):
+                try:
+                    # Already downloaded by the robots.txt check above
+                    robots_full_res = await documents.get(f"{domain}/robots.txt", timeout=5.0)
+                    for line in robots_full_res.text.splitlines():
+                        if line.strip().lower().startswith("sitemap:"):
+                            declared = line.split(":", 1)[1].strip()
+                            if declared:
+                                robots_sitemaps.append(urljoin(f"{domain}/", declared))
+                except Exception:
+                    pass
             try:
-                sitemap_response = await client.get(f"{domain}/sitemap.xml", timeout=8.0)
-                if sitemap_response.status_code == 200 and sitemap_response.text.strip():
-                    sitemap_text = sitemap_response.text.strip()
-                    sitemap_url_count = 0
-                    is_valid_xml = False
-                    # FIX: Use built-in ElementTree (no lxml needed), with namespace stripping
-                    try:
-                        # Strip XML namespaces for easier tag matching
-                        sitemap_text_clean = re.sub(r' xmlns[^"]*"[^"]*"', '', sitemap_text)
-                        sitemap_text_clean = re.sub(r'<([a-zA-Z]+):', '<', sitemap_text_clean)
-                        sitemap_text_clean = re.sub(r'</([a-zA-Z]+):', '</', sitemap_text_clean)
-                        root = ET.fromstring(sitemap_text_clean)
-                        root_tag = root.tag.lower()
-                        is_valid_xml = 'urlset' in root_tag or 'sitemapindex' in root_tag
-                        # Count <loc> elements
-                        sitemap_url_count = len(root.findall('.//loc'))
-                        if sitemap_url_count == 0:
-                            # Fallback: count via regex if tag had namespace issues
-                            sitemap_url_count = len(re.findall(r'<loc>', sitemap_text, re.IGNORECASE))
-                    except ET.ParseError:
-                        # Fallback to regex for malformed XML
-                        is_valid_xml = bool(re.search(r'<(urlset|sitemapindex)', sitemap_text, re.IGNORECASE))
-                        sitemap_url_count = len(re.findall(r'<loc>', sitemap_text, re.IGNORECASE))
-                    core_scan_data["sitemap_xml"] = {
-                        "exists": True,
-                        "url": f"{domain}/sitemap.xml",
-                        "url_count": sitemap_url_count,
-                        "is_valid_xml": is_valid_xml
-                    }
-                else:
-                    # Also check robots.txt for Sitemap: directive
-                    sitemap_from_robots = None
-                    robots_txt_content = core_scan_data.get("robots_txt", {})
-                    if robots_txt_content.get("exists"):
-                        try:
-                            robots_full_res = await client.get(f"{domain}/robots.txt", timeout=5.0)
-                            for line in robots_full_res.text.splitlines():
-                                if line.lower().startswith("sitemap:"):
-                                    sitemap_from_robots = line.split(":", 1)[1].strip()
-                                    break
-                        except Exception:
-                            pass
-                    if sitemap_from_robots:
-                        core_scan_data["sitemap_xml"] = {"exists": True, "url": sitemap_from_robots, "url_count": 0, "is_valid_xml": True, "from_robots": True}
-                    else:
-                        core_scan_data["sitemap_xml"] = {"exists": False, "url_count": 0, "is_valid_xml": False}
+                sitemaps = await read_sitemaps(client, [default_sitemap] + robots_sitemaps, stats=documents.transfer)
             except Exception as sitemap_err:
                 print(f"[{scan_id}] Sitemap check error: {sitemap_err}")
                 core_scan_data["sitemap_xml"] = {"exists": False, "url_count": 0, "is_valid_xml": False}
+                return None
 
-            # 3. HTML Parsing (SEO & Trust Pages) on Homepage
-            soup = BeautifulSoup(html_content, 'html.parser')
-            
-            seo_data["title"] = soup.title.string if soup.title else None
+            primary = next((f for f in sitemaps.files if f.depth == 0 and f.exists), None)
+            if primary is not None:
+                core_scan_data["sitemap_xml"] = {
+                    "exists": True,
+                    "url": primary.url,
+                    "url_count": sitemaps.url_count,
+                    "is_valid_xml": primary.is_valid,
+                    "is_index": sitemaps.is_index,
+                    "sitemaps_read": sum(1 for f in sitemaps.files if f.exists),
+                    "truncated": sitemaps.truncated,
+                }
+                if primary.url != default_sitemap:
+                    core_scan_data["sitemap_xml"]["from_robots"] = True
+            elif robots_sitemaps:
+                # Declared but unreadable right now: trust the directive, as before
+                core_scan_data["sitemap_xml"] = {"exists": True, "url": robots_sitemaps[0], "url_count": 0, "is_valid_xml": True, "from_robots": True}
+            else:
+                core_scan_data["sitemap_xml"] = {"exists": False, "url_count": 0, "is_valid_xml": False}
+            errors = [f"{f.url}: {f.error}" for f in sitemaps.files if f.error]
+            print(f"[{scan_id}] Sitemaps: {len(sitemaps.files)} file(s), {sitemaps.url_count} URLs"
+                  f"{' (budget/depth reached)' if sitemaps.truncated else ''}"
+                  f"{'; errors: ' + '; '.join(errors[:3]) if errors else ''}", flush=True)
+            return sitemaps
+
+        # 3. HTML Parsing (SEO & Trust Pages) on Homepage
+        @graph.stage("html_analysis", after=("homepage",))
+        async def html_analysis_stage():
+            nonlocal page, candidate_links, has_cookie_consent, mixed_content_found, homepage_words
+            # One walk of the homepage tree (in the parse pool when the page is large)
+            if homepage is not None:
+                page = await run_parser(extract_page_signals, homepage.content, homepage.encoding, size=len(homepage.content))
+            else:
+                page = PageSignals()
+
+            seo_data["title"] = page.title
             title_text = seo_data["title"].strip() if seo_data["title"] else ""
-            
-            meta_desc = soup.find("meta", attrs={"name": "description"})
-            seo_data["meta_description"] = meta_desc["content"] if meta_desc and meta_desc.has_attr("content") else None
+
+            seo_data["meta_description"] = page.meta.get("description")
             desc_text = seo_data["meta_description"].strip() if seo_data["meta_description"] else ""
-            
+
             seo_data["title_optimization"] = {
                 "length": len(title_text),
                 "is_optimal": 50 <= len(title_text) <= 60 if title_text else False
             }
-            
+
             seo_data["description_optimization"] = {
                 "length": len(desc_text),
                 "is_optimal": 120 <= len(desc_text) <= 160 if desc_text else False
             }
-            
-            canonical = soup.find("link", rel="canonical")
-            seo_data["canonical"] = canonical["href"] if canonical and canonical.has_attr("href") else None
-            
+
+            seo_data["canonical"] = page.canonical
+
             seo_data["canonical_conflict"] = False
             if seo_data["canonical"]:
                 canonical_parsed = urlparse(seo_data["canonical"])
@@ -1499,52 +3702,49 @@ async def process_scan(scan_record):
                     seo_data["canonical_conflict"] = True
                 elif canonical_parsed.path and canonical_parsed.path != final_parsed.path:
                     seo_data["canonical_conflict"] = True
-            
+
             # Headings analysis
-            h1_tags = soup.find_all("h1")
-            h2_tags = soup.find_all("h2")
-            h3_tags = soup.find_all("h3")
+            h1_count = page.headings["h1"]
+            h2_count = page.headings["h2"]
+            h3_count = page.headings["h3"]
             seo_data["headings"] = {
-                "h1_count": len(h1_tags),
-                "h2_count": len(h2_tags),
-                "h3_count": len(h3_tags),
-                "h4_count": len(soup.find_all("h4")),
-                "h5_count": len(soup.find_all("h5")),
-                "h6_count": len(soup.find_all("h6")),
-                "multiple_h1": len(h1_tags) > 1,
-                "missing_h1": len(h1_tags) == 0,
-                "hierarchy_issue": len(h1_tags) == 0 and (len(h2_tags) > 0 or len(h3_tags) > 0)
+                "h1_count": h1_count,
+                "h2_count": h2_count,
+                "h3_count": h3_count,
+                "h4_count": page.headings["h4"],
+                "h5_count": page.headings["h5"],
+                "h6_count": page.headings["h6"],
+                "multiple_h1": h1_count > 1,
+                "missing_h1": h1_count == 0,
+                "hierarchy_issue": h1_count == 0 and (h2_count > 0 or h3_count > 0)
             }
 
             # Meta Robots analysis
-            meta_robots = soup.find("meta", attrs={"name": "robots"})
-            robots_content = meta_robots["content"].lower() if meta_robots and meta_robots.has_attr("content") else ""
+            robots_content = (page.meta.get("robots") or "").lower()
             seo_data["meta_robots"] = {
                 "noindex": "noindex" in robots_content,
                 "nofollow": "nofollow" in robots_content
             }
 
             # Image checks — lazy loading and alt text
-            all_imgs = soup.find_all("img")
-            lazy_load_count = sum(1 for img in all_imgs if img.get("loading", "").lower() == "lazy")
-            no_alt_count = sum(1 for img in all_imgs if not img.get("alt", "").strip())
+            total_images = page.image_count
             core_scan_data["image_checks"] = {
-                "total_images": len(all_imgs),
-                "lazy_loaded": lazy_load_count,
-                "lazy_load_ratio": round(lazy_load_count / len(all_imgs), 2) if all_imgs else 0,
-                "no_alt_count": no_alt_count,
-                "no_alt_ratio": round(no_alt_count / len(all_imgs), 2) if all_imgs else 0
+                "total_images": total_images,
+                "lazy_loaded": page.lazy_images,
+                "lazy_load_ratio": round(page.lazy_images / total_images, 2) if total_images else 0,
+                "no_alt_count": page.images_missing_alt,
+                "no_alt_ratio": round(page.images_missing_alt / total_images, 2) if total_images else 0
             }
-            
+
             # Structured Data Analysis
-            json_lds = soup.find_all("script", type="application/ld+json")
-            
+            json_lds = page.json_ld
+
             # Simple Schema Type Detection
             schema_types = set()
             valid_syntax_count = 0
-            for script in json_lds:
+            for script_body in json_lds:
                 try:
-                    js_data = json.loads(script.string if script.string else "")
+                    js_data = json.loads(script_body)
                     valid_syntax_count += 1
                     # Handle both single objects and arrays of JSON-LD
                     items = js_data if isinstance(js_data, list) else [js_data]
@@ -1558,7 +3758,7 @@ async def process_scan(scan_record):
                                 schema_types.add(t)
                 except Exception as e:
                     pass
-                    
+
             seo_data["structured_data"] = {
                 "detected": len(json_lds) > 0,
                 "count": len(json_lds),
@@ -1566,7 +3766,7 @@ async def process_scan(scan_record):
                 "valid_count": valid_syntax_count,
                 "types": list(schema_types)
             }
-            
+
             trust_keywords = {
                 "privacy": ["privacy-policy", "privacy"],
                 "about": ["about-us", "about"],
@@ -1574,42 +3774,10 @@ async def process_scan(scan_record):
                 "terms": ["terms-of-service", "terms-and-conditions", "terms"],
                 "disclaimer": ["disclaimer", "disclosure"]
             }
-            
-            detected_pages = {}
-            internal_links = set()
-            external_links = set()
-            
-            mixed_content_found = False
-            
-            # FIX: Cookie Consent Detection — properly set the flag
-            has_cookie_consent = False
-            # Check text nodes for cookie consent banners
-            for text_elem in soup.find_all(string=True):
-                lower_text = text_elem.lower()
-                if "cookie" in lower_text and ("accept" in lower_text or "consent" in lower_text or "agree" in lower_text):
-                    has_cookie_consent = True
-                    break
-            # Also check for common cookie consent class names/IDs in elements
-            if not has_cookie_consent:
-                for elem in soup.find_all(attrs={"id": True}):
-                    eid = elem.get("id", "").lower()
-                    if any(k in eid for k in ["cookie", "gdpr", "consent", "ccpa"]):
-                        has_cookie_consent = True
-                        break
-            if not has_cookie_consent:
-                for elem in soup.find_all(attrs={"class": True}):
-                    eclasses = " ".join(elem.get("class", [])).lower()
-                    if any(k in eclasses for k in ["cookie-banner", "cookie-consent", "gdpr", "ccpa", "consent-banner"]):
-                        has_cookie_consent = True
-                        break
-            
-            # Incorporate external API data into seo_data
-            if gsc_data_api:
-                seo_data["gsc_insights"] = gsc_data_api
-            
-            if adsense_data_api:
-                core_scan_data["adsense_api_status"] = adsense_data_api
-            
+
+            # Cookie consent: banner text, or cookie/gdpr/consent ids and classes
+            has_cookie_consent = page.cookie_consent
+
             # Categorize link URLs based on simple matching first
             candidate_links = {
                 "privacy": set(),
@@ -1618,22 +3786,19 @@ async def process_scan(scan_record):
                 "terms": set(),
                 "disclaimer": set()
             }
-            
-            for a_tag in soup.find_all("a", href=True):
-                href = a_tag["href"]
-                text = a_tag.get_text(strip=True).lower()
-                
+
+            for href, text in page.links:
                 link_url = urljoin(final_url, href)
                 parsed_link = urlparse(link_url)
-                
+
                 if parsed_link.netloc == urlparse(final_url).netloc:
                     # Filter out purely anchor/hash links to same page if it's just the homepage
                     if parsed_link.path == urlparse(final_url).path and href.startswith("#"):
                         continue
-                        
+
                     internal_links.add(link_url)
                     lower_href = parsed_link.path.lower()
-                    
+
                     for kw_key, kw_list in trust_keywords.items():
                         # More strict matching for keywords so "/category/privacy-tips" isn't a Privacy Policy
                         if any(re.search(rf"\b{kw}\b", lower_href) for kw in kw_list) or any(re.search(rf"\b{kw}\b", text) for kw in kw_list):
@@ -1644,20 +3809,84 @@ async def process_scan(scan_record):
 
             seo_data["internal_links"] = len(internal_links)
             seo_data["external_links"] = len(external_links)
-            
+
             seo_data["internal_linking_analysis"] = {
                 "total_internal": len(internal_links),
                 "orphan_risk": "High" if len(internal_links) < 5 else "Low",
                 "adequate_links": len(internal_links) >= 10
             }
-            
+
+            # Check mixed content (images, scripts, iframes, audio, video, stylesheets)
+            mixed_content_found = final_url.startswith("https") and page.insecure_resources
+
+            security_data["mixed_content"] = mixed_content_found
+
+            # Count homepage words
+            homepage_words = page.word_count
+
+            # --- Ad Placement Readiness Heuristic (Fix 5) ---
+            ad_placement_issues = []
+            ad_placement_notes = []
+
+            # 1. Viewport meta tag (mobile-ready layout required for ad delivery)
+            has_viewport = "width=device-width" in (page.meta.get("viewport") or "")
+            if not has_viewport:
+                ad_placement_issues.append("Missing responsive viewport meta tag")
+            else:
+                ad_placement_notes.append("Responsive layout detected")
+
+            # 2. HTTPS is required for AdSense ad delivery
+            is_https = final_url.startswith("https://")
+            if not is_https:
+                ad_placement_issues.append("HTTPS required for ad delivery")
+            else:
+                ad_placement_notes.append("HTTPS enabled")
+
+            # 3. Sufficient content for ad placement (content-to-ad ratio)
+            if homepage_words < 250:
+                ad_placement_issues.append(f"Insufficient content ({homepage_words} words) for meaningful ad placement")
+            else:
+                ad_placement_notes.append(f"Sufficient content volume ({homepage_words} words)")
+
+            # 4. Check for fixed/sticky nav that could overlap ads
+            if page.sticky_nav:
+                ad_placement_issues.append("Sticky/fixed navigation may overlap ad units")
+            else:
+                ad_placement_notes.append("No sticky nav conflicts detected")
+
+            # 5. Check for excessive popup/overlay elements (ad experience violations)
+            if page.popup_count > 2:
+                ad_placement_issues.append(f"{page.popup_count} overlay/popup elements may violate ad experience policy")
+
+            # Determine final ad placement status
+            if len(ad_placement_issues) == 0:
+                ad_status = "pass"
+                ad_summary = "Site appears ready for ad placement"
+            elif len(ad_placement_issues) <= 1:
+                ad_status = "warning"
+                ad_summary = f"{len(ad_placement_issues)} minor issue: {ad_placement_issues[0]}"
+            else:
+                ad_status = "fail"
+                ad_summary = f"{len(ad_placement_issues)} issues: " + "; ".join(ad_placement_issues[:2])
+
+            core_scan_data["ad_placement"] = {
+                "status": ad_status,
+                "summary": ad_summary,
+                "issues": ad_placement_issues,
+                "notes": ad_placement_notes
+            }
+
+        @graph.stage("trust_pages", after=("html_analysis",))
+        async def trust_pages_stage():
+            detected_pages = {}
+
             # Validate Candidates
             async def validate_candidate(link, page_type):
                 try:
-                    res = await client.get(link, timeout=5.0)
-                    if res.status_code == 200:
-                        page_soup = BeautifulSoup(res.text, 'html.parser')
-                        text_content = page_soup.get_text(separator=' ', strip=True).lower()
+                    res = await fetch_document(client, link, 5.0, html_only=True, stats=documents.transfer)
+                    if res.status_code == 200 and not res.skipped:
+                        page = await run_parser(parse_candidate_page, res.content, res.encoding, size=len(res.content))
+                        text_content = page["text"]
                         # Very basic heuristic: if it's a contact page it should have a form or email or "contact" explicitly inside H1/H2, etc.
                         # For privacy/terms it should be at least a few paragraphs.
                         words = len(text_content.split())
@@ -1666,53 +3895,38 @@ async def process_scan(scan_record):
                             if page_type == "terms" and ("terms of service" in text_content or "terms and conditions" in text_content or "limitation of liability" in text_content): return link
                             if page_type == "disclaimer" and ("disclaimer" in text_content or "do not warrant" in text_content or "no liability" in text_content): return link
                             if page_type == "about" and ("about us" in text_content or "our team" in text_content or "our mission" in text_content or words > 100): return link
-                            if page_type == "contact" and ("contact us" in text_content or "email" in text_content or page_soup.find("form")): return link
+                            if page_type == "contact" and ("contact us" in text_content or "email" in text_content or page["has_form"]): return link
                 except:
                     pass
                 return None
-                
+
             async def find_valid_page(page_type, candidates):
                 for candidate in candidates:
                     valid_link = await validate_candidate(candidate, page_type)
                     if valid_link: return valid_link
                 return None
-                
+
             validation_tasks = [find_valid_page(kw_key, list(candidate_links[kw_key])[:3]) for kw_key in candidate_links.keys()]
             validated_pages = await asyncio.gather(*validation_tasks)
-            
-            drafts = {}
+
+            missing_pages = []
             for i, kw_key in enumerate(candidate_links.keys()):
                 valid_url = validated_pages[i]
                 if valid_url:
                     detected_pages[kw_key] = {"exists": True, "url": valid_url}
                 else:
                     detected_pages[kw_key] = {"exists": False}
-                    # Trigger draft generation
-                    print(f"[{scan_id}] Generating missing page draft for {kw_key}...", flush=True)
-                    draft_content = await generate_missing_page_draft(urlparse(final_url).netloc, kw_key)
-                    if draft_content:
-                        drafts[kw_key] = draft_content
-            
-            # Check mixed content
-            if final_url.startswith("https"):
-                # Check images, scripts, iframes, audio, video
-                for tag in soup.find_all(["img", "script", "iframe", "audio", "video"]):
-                    src = tag.get("src")
-                    if src and src.startswith("http://"):
-                        mixed_content_found = True
-                        break
-                if not mixed_content_found:
-                    # Check stylesheets
-                    for tag in soup.find_all("link", rel="stylesheet", href=True):
-                        href = tag.get("href")
-                        if href and href.startswith("http://"):
-                            mixed_content_found = True
-                            break
-                            
-            security_data["mixed_content"] = mixed_content_found
+                    missing_pages.append(kw_key)
+
+            # Drafts for missing pages: cached ones go out with the result, the rest are
+            # generated after the scan is written (see schedule_draft_fill)
+            draft_domain = urlparse(final_url).netloc
+            cached_drafts = await draft_cache.get_many([draft_cache_key(draft_domain, t) for t in missing_pages])
+            drafts = {page_type: draft for (_, page_type), draft in cached_drafts.items()}
 
             trust_pages_data["pages"] = detected_pages
             trust_pages_data["drafts"] = drafts
+            trust_pages_data["drafts_pending"] = [t for t in missing_pages if t not in drafts]
             trust_pages_data["summary"] = {
                 "privacy": detected_pages.get("privacy", {}).get("exists", False),
                 "about": detected_pages.get("about", {}).get("exists", False),
@@ -1722,137 +3936,101 @@ async def process_scan(scan_record):
                 "cookie_consent": has_cookie_consent
             }
 
-            # Multi-Page Crawl (Deep Traverse)
-            max_pages = 50
+        # Multi-Page Crawl (Deep Traverse)
+        @graph.stage("crawl", after=("html_analysis", "sitemap"), optional=True)
+        async def crawl_stage():
+            nonlocal mixed_content_found, all_links_to_check
+            max_pages = CRAWL_MAX_PAGES
             scanned_pages = 1
             thin_content_count = 0
-            
+
             # Deep crawl aggregates
             missing_title_count = 0 if seo_data.get("title") else 1
             missing_desc_count = 0 if seo_data.get("meta_description") else 1
             found_email, found_phone = False, False
-            
-            # Count homepage words
-            homepage_words = len(soup.get_text(separator=' ', strip=True).split())
+
             # FIX: Lowered threshold to 250 words (300 was flagging legitimate short pages)
             if homepage_words < 250:
                 thin_content_count += 1
-                
-            broken_links_found = 0
-            visited_urls = {final_url}
-            queue = list(internal_links)
+
+            frontier = CrawlFrontier(allowed_host=urlparse(final_url).hostname)
+            frontier.mark_seen(final_url)
+            for link in internal_links:
+                frontier.add(link, depth=1, priority=crawl_priority(link))
+            # Sitemap entries seed the frontier too, fresh and high-priority content first
+            sitemaps = graph.results.get("sitemap")
+            sitemap_seeds = 0
+            if sitemaps is not None:
+                now = datetime.datetime.now(datetime.timezone.utc)
+                for loc, lastmod, priority in sitemaps.entries:
+                    sitemap_seeds += frontier.add(loc, depth=1, priority=crawl_priority(loc, 1, lastmod, priority, now))
             all_links_to_check = set(internal_links).union(external_links)
-            
+
             # 1. Crawl up to max_pages
+            url_table = UrlTable()
+            pages = []
+
             async def fetch_and_parse(url):
+                url_id = url_table.intern(url)
                 try:
-                    res = await client.get(url, timeout=10.0)
+                    res = await fetch_document(client, url, 10.0, html_only=True, stats=documents.transfer)
+                    if res.skipped:
+                        return PageRecord(url_id, res.status_code, skipped=True)
                     if res.status_code == 200:
-                        page_soup = BeautifulSoup(res.text, 'html.parser')
-                        text = page_soup.get_text(separator=' ', strip=True)
-                        
-                        has_mixed = False
-                        if url.startswith("https"):
-                            for tag in page_soup.find_all(["img", "script", "iframe", "audio", "video"]):
-                                src = tag.get("src")
-                                if src and src.startswith("http://"):
-                                    has_mixed = True
-                                    break
-                            if not has_mixed:
-                                for tag in page_soup.find_all("link", rel="stylesheet", href=True):
-                                    href = tag.get("href")
-                                    if href and href.startswith("http://"):
-                                        has_mixed = True
-                                        break
-                                        
-                        return {"url": url, "status": res.status_code, "text": text, "soup": page_soup, "has_mixed": has_mixed}
-                    return {"url": url, "status": res.status_code}
+                        fields = await run_parser(parse_crawl_page, url, res.content, res.encoding, size=len(res.content))
+                        outlinks = tuple(url_table.intern(link) for link in fields.pop("links"))
+                        return PageRecord(url_id, res.status_code, outlinks=outlinks, **fields)
+                    return PageRecord(url_id, res.status_code)
                 except:
-                    return {"url": url, "status": 999}
+                    return PageRecord(url_id, 999)
+
+            # Sliding-window crawl: each finished fetch frees its slot for the next URL
+            crawl_started = time.monotonic()
+            # Skipped responses (downloads, non-HTML) don't use up the page budget
+            async for r, depth in crawl_pages(frontier, fetch_and_parse, max_pages - scanned_pages,
+                                              counts=lambda r: not r.skipped):
+                if r.skipped:
+                    continue  # not an HTML page (e.g. an extensionless download); nothing to analyse
+                scanned_pages += 1
+                pages.append(r)
+                if r.status == 200:
+                    if r.has_mixed:
+                        mixed_content_found = True
+
+                    # Skip utility pages from thin content count
+                    url_path_lower = urlparse(url_table.url(r.url_id)).path.lower()
+                    is_utility_page = any(p in url_path_lower for p in UTILITY_PATH_MARKERS)
+                    if r.word_count < 250 and not is_utility_page:
+                        thin_content_count += 1
+
+                    # Trust signals: look for email/phone loosely
+                    found_email = found_email or r.has_email
+                    found_phone = found_phone or r.has_phone
+
+                    # Missing SEO tags on deep pages
+                    if not r.has_title:
+                        missing_title_count += 1
+
+                    if not r.has_description:
+                        missing_desc_count += 1
+
+                    # Extract more links
+                    for link_id in r.outlinks:
+                        new_link = url_table.url(link_id)
+                        all_links_to_check.add(new_link)
+                        frontier.add(new_link, depth=depth + 1, priority=crawl_priority(new_link, depth + 1))
+
+            for counter, value in frontier.stats.items():
+                METRICS[f"crawl.{counter}"] += value
+            crawl_seconds = time.monotonic() - crawl_started
+            pages_per_second = round((scanned_pages - 1) / crawl_seconds, 1) if crawl_seconds > 0 else 0
+            duplicate_pages = sum(1 for r in pages if r.content_hash) - len({r.content_hash for r in pages if r.content_hash})
+            print(f"[{scan_id}] Crawl: {scanned_pages - 1} pages in {crawl_seconds:.1f}s ({pages_per_second} pages/s), "
+                  f"frontier {dict(frontier.stats)} ({sitemap_seeds} from sitemaps), {len(frontier)} left unvisited, "
+                  f"{duplicate_pages} duplicate bodies, {len(url_table)} distinct URLs seen", flush=True)
 
-            # Batch crawl
-            while queue and scanned_pages < max_pages:
-                batch = queue[:10]
-                queue = queue[10:]
-                
-                tasks = []
-                for link in batch:
-                    if link not in visited_urls:
-                        visited_urls.add(link)
-                        tasks.append(fetch_and_parse(link))
-                        
-                if not tasks:
-                    continue
-                    
-                results = await asyncio.gather(*tasks)
-                scanned_pages += len(results)
-
-                for r in results:
-                    if r["status"] == 200 and "text" in r:
-                        if r.get("has_mixed"):
-                            mixed_content_found = True
-
-                        word_cnt = len(r["text"].split())
-                        # Skip utility pages from thin content count
-                        url_path_lower = urlparse(r["url"]).path.lower()
-                        is_utility_page = any(p in url_path_lower for p in ["/contact", "/about", "/tag/", "/category/", "/author/", "/search"])
-                        if word_cnt < 250 and not is_utility_page:
-                            thin_content_count += 1
-
-                        # Trust signals: look for email/phone loosely
-                        if not found_email and "@" in r["text"] and re.search(r"[\w\.-]+@[\w\.-]+\.\w+", r["text"]):
-                            found_email = True
-                        if not found_phone and re.search(r"\+?[0-9][\d\s\-\(\)]{7,15}\d", r["text"]):
-                            found_phone = True
-
-                        # Missing SEO tags on deep pages
-                        if not r["soup"].title or not r["soup"].title.string or not r["soup"].title.string.strip():
-                            missing_title_count += 1
-
-                        meta_desc = r["soup"].find("meta", attrs={"name": "description"})
-                        if not meta_desc or not meta_desc.get("content") or not meta_desc.get("content").strip():
-                            missing_desc_count += 1
-
-                        # Extract more links
-                        for a_tag in r["soup"].find_all("a", href=True):
-                            new_link = urljoin(r["url"], a_tag["href"])
-                            parsed = urlparse(new_link)
-                            if parsed.scheme in ["http", "https"]:
-                                all_links_to_check.add(new_link)
-                                if parsed.netloc == urlparse(final_url).netloc and new_link not in set(visited_urls).union(queue):
-                                    queue.append(new_link)
-
-
-            # 2. Check broken links
-            checked_links = 0
-            # Sample up to 50 links to avoid massive delays
-            links_to_verify = list(all_links_to_check)[:50]
-            
-            async def verify_link(url):
-                try:
-                    res = await client.head(url, timeout=5.0)
-                    if res.status_code >= 400 and res.status_code != 405:
-                        # Fallback to GET for 405 Method Not Allowed
-                        res_get = await client.get(url, timeout=5.0)
-                        return res_get.status_code >= 400
-                    return res.status_code >= 400
-                except:
-                    return True
-                    
-            broken_tasks = [verify_link(l) for l in links_to_verify]
-            if broken_tasks:
-                broken_results = await asyncio.gather(*broken_tasks)
-                broken_links_found = sum(1 for is_broken in broken_results if is_broken)
-                checked_links = len(links_to_verify)
-            
-            core_scan_data["broken_links"] = {
-                "checked": checked_links,
-                "broken": broken_links_found,
-                "status": "failed" if broken_links_found > 0 else "passed"
-            }
-            
             # Keyword density — find top 3 words (4+ chars), compute density
-            all_words = [w.lower() for w in soup.get_text(separator=' ', strip=True).split() if len(w) >= 4 and w.isalpha()]
+            all_words = [w.lower() for w in page.text.split() if len(w) >= 4 and w.isalpha()]
             word_freq: dict = {}
             for w in all_words:
                 word_freq[w] = word_freq.get(w, 0) + 1
@@ -1862,7 +4040,7 @@ async def process_scan(scan_record):
             keyword_stuffed = keyword_density > 5  # over 5% is considered over-optimization
 
             # Readability approximation — average words per sentence (lower is more readable)
-            raw_text = soup.get_text(separator=' ', strip=True)
+            raw_text = page.text
             sentences = [s.strip() for s in raw_text.replace('!', '.').replace('?', '.').split('.') if len(s.strip()) > 10]
             avg_sentence_length = round(len(all_words) / len(sentences), 1) if sentences else 0
             readability_grade = "Easy" if avg_sentence_length <= 15 else ("Moderate" if avg_sentence_length <= 25 else "Difficult")
@@ -1873,7 +4051,7 @@ async def process_scan(scan_record):
                 "missing_titles": missing_title_count,
                 "missing_descriptions": missing_desc_count
             }
-            
+
             trust_pages_data["contact_signals"] = {
                 "found_email": found_email,
                 "found_phone": found_phone
@@ -1891,84 +4069,139 @@ async def process_scan(scan_record):
                 "readability_grade": readability_grade,
                 "sentence_count": len(sentences)
             }
+            return [url_table.url(r.url_id) for r in pages]
 
-            # --- Ad Placement Readiness Heuristic (Fix 5) ---
-            ad_placement_issues = []
-            ad_placement_notes = []
+        # 2. Check broken links
+        @graph.stage("broken_links", after=("crawl",), optional=True)
+        async def broken_links_stage():
+            # Own-site links first, then external ones; each group in a stable order
+            site_host = urlparse(final_url).hostname
 
-            # 1. Viewport meta tag (mobile-ready layout required for ad delivery)
-            viewport_meta = soup.find("meta", attrs={"name": "viewport"})
-            has_viewport = viewport_meta is not None and "width=device-width" in (viewport_meta.get("content", ""))
-            if not has_viewport:
-                ad_placement_issues.append("Missing responsive viewport meta tag")
-            else:
-                ad_placement_notes.append("Responsive layout detected")
+            def external(url):
+                try:
+                    return urlparse(url).hostname != site_host
+                except ValueError:
+                    return True  # unparsable; check_links reports it as broken
 
-            # 2. HTTPS is required for AdSense ad delivery
-            is_https = final_url.startswith("https://")
-            if not is_https:
-                ad_placement_issues.append("HTTPS required for ad delivery")
-            else:
-                ad_placement_notes.append("HTTPS enabled")
+            links = sorted(all_links_to_check, key=lambda u: (external(u), u))
+            statuses = await check_links(client, links)
+            broken_links_found = sum(1 for s in statuses.values() if s["broken"])
+            from_cache = sum(1 for s in statuses.values() if s["cached"])
+            print(f"[{scan_id}] Links: {len(statuses)} checked ({from_cache} from cache), {broken_links_found} broken", flush=True)
 
-            # 3. Sufficient content for ad placement (content-to-ad ratio)
-            if homepage_words < 250:
-                ad_placement_issues.append(f"Insufficient content ({homepage_words} words) for meaningful ad placement")
-            else:
-                ad_placement_notes.append(f"Sufficient content volume ({homepage_words} words)")
+            core_scan_data["broken_links"] = {
+                "checked": len(statuses),
+                "broken": broken_links_found,
+                "cached": from_cache,
+                "status": "failed" if broken_links_found > 0 else "passed"
+            }
 
-            # 4. Check for fixed/sticky nav that could overlap ads
-            fixed_nav_risk = False
-            for nav in soup.find_all(["nav", "header"]):
-                style = nav.get("style", "").lower()
-                cls = " ".join(nav.get("class", [])).lower()
-                if "fixed" in style or "sticky" in style or "fixed" in cls or "sticky" in cls:
-                    fixed_nav_risk = True
-                    break
-            if fixed_nav_risk:
-                ad_placement_issues.append("Sticky/fixed navigation may overlap ad units")
-            else:
-                ad_placement_notes.append("No sticky nav conflicts detected")
+        # AI Policy Engine Analysis
+        @graph.stage("ai_policy", after=("html_analysis",))
+        async def ai_policy_stage():
+            extracted_text = page.text
+            # Pass up to 4000 chars to avoid massive token limits if text is huge
+            ai_policy_result = await analyze_policy_with_ai(extracted_text[:4000])
+            if ai_policy_result:
+                core_scan_data["ai_policy"] = ai_policy_result
+
+        # Safe Browsing API Analysis (the AI risk fallback is applied once ai_policy is in)
+        @graph.stage("safe_browsing", after=("crawl",))
+        async def safe_browsing_stage():
+            # Homepage first, then the pages crawled, then every other link found
+            crawled = graph.results.get("crawl")
+            if not isinstance(crawled, list):
+                crawled = []  # crawl failed; the homepage links are still checked
+            urls = [target_url, final_url] + crawled + sorted(all_links_to_check)
+            urls = list(dict.fromkeys(urls))[:SAFE_BROWSING_MAX_URLS]
+            try:
+                print(f"[{scan_id}] Checking Safe Browsing API for {len(urls)} URLs...", flush=True)
+                # Not the scan client: it skips TLS verification and these requests carry the API key
+                verdicts = await check_safe_browsing(urls)
+            except Exception as e:
+                print(f"[{scan_id}] Safe Browsing check failed: {e}", flush=True)
+                return None
+            if verdicts[target_url]["status"] == "unknown":
+                return {"status": "unknown"}
+            site_host = urlparse(final_url).hostname
+            unsafe_site = [u for u, v in verdicts.items() if v["status"] == "unsafe" and urlparse(u).hostname in (site_host, urlparse(target_url).hostname)]
+            unsafe_links = [u for u, v in verdicts.items() if v["status"] == "unsafe" and u not in unsafe_site]
+            return {
+                "status": "unsafe" if unsafe_site else "safe",
+                "issues": len(unsafe_site),
+                "urls_checked": sum(1 for v in verdicts.values() if v["status"] != "unknown"),
+                "cached": sum(1 for v in verdicts.values() if v.get("cached")),
+                "unsafe_urls": [{"url": u, "threats": verdicts[u]["threats"]} for u in unsafe_site[:20]],
+                "unsafe_external_links": [{"url": u, "threats": verdicts[u]["threats"]} for u in unsafe_links[:20]],
+            }
 
-            # 5. Check for excessive popup/overlay elements (ad experience violations)
-            popups = []
-            for elem in soup.find_all(attrs={"class": True}):
-                cls = " ".join(elem.get("class", [])).lower()
-                if any(k in cls for k in ["popup", "modal", "overlay", "interstitial"]):
-                    popups.append(cls)
-            if len(popups) > 2:
-                ad_placement_issues.append(f"{len(popups)} overlay/popup elements may violate ad experience policy")
+        @graph.stage("pagespeed")
+        async def pagespeed_stage():
+            try:
+                print(f"[{scan_id}] Fetching PageSpeed Insights...", flush=True)
+                pagespeed_result = await fetch_pagespeed_data(target_url)
+                if pagespeed_result:
+                    core_scan_data["pagespeed"] = pagespeed_result
+            except Exception as e:
+                print(f"[{scan_id}] PageSpeed check failed: {e}", flush=True)
 
-            # Determine final ad placement status
-            if len(ad_placement_issues) == 0:
-                ad_status = "pass"
-                ad_summary = "Site appears ready for ad placement"
-            elif len(ad_placement_issues) <= 1:
-                ad_status = "warning"
-                ad_summary = f"{len(ad_placement_issues)} minor issue: {ad_placement_issues[0]}"
-            else:
-                ad_status = "fail"
-                ad_summary = f"{len(ad_placement_issues)} issues: " + "; ".join(ad_placement_issues[:2])
+        # -------------------------------------------------------------------
+        # Enrichment (domain age, keywords, social links, website info)
+        # Each function tries RapidAPI first if key available, then falls back to
+        # a fully free alternative. NO guard on RAPIDAPI_KEY here.
+        # Domain-level lookups only need the target host; the page scrapers reuse the
+        # homepage already held by the document store.
+        # -------------------------------------------------------------------
+        @graph.stage("domain_age", optional=True)
+        async def domain_age_stage():
+            return await fetch_domain_age(target_domain)
 
-            core_scan_data["ad_placement"] = {
-                "status": ad_status,
-                "summary": ad_summary,
-                "issues": ad_placement_issues,
-                "notes": ad_placement_notes
-            }
+        @graph.stage("similarweb", optional=True)
+        async def similarweb_stage():
+            return await fetch_similarweb_data(target_domain)
 
-        # AI Policy Engine Analysis
-        extracted_text = soup.get_text(separator=' ', strip=True)
-        # Pass up to 4000 chars to avoid massive token limits if text is huge
-        ai_policy_result = await analyze_policy_with_ai(extracted_text[:4000])
-        if ai_policy_result:
-            core_scan_data["ai_policy"] = ai_policy_result
+        @graph.stage("domain_authority", optional=True)
+        async def domain_authority_stage():
+            return await fetch_domain_authority(target_domain)
 
-        # Safe Browsing API Analysis
-        try:
-            print(f"[{scan_id}] Checking Safe Browsing API...", flush=True)
-            safe_browsing = await check_safe_browsing(final_url)
-            
+        @graph.stage("seo_keywords", after=("homepage",), optional=True)
+        async def seo_keywords_stage():
+            return await fetch_seo_keywords(final_url, documents)
+
+        @graph.stage("social_links", after=("homepage",), optional=True)
+        async def social_links_stage():
+            return await fetch_social_links(final_url, documents)
+
+        @graph.stage("website_info", after=("homepage",), optional=True)
+        async def website_info_stage():
+            return await fetch_website_info(final_url, documents)
+
+        print(f"[{scan_id}] Fetching enrichment data (free fallbacks active)...", flush=True)
+        async with httpx.AsyncClient(verify=False, follow_redirects=True) as client:
+            # Fetch-once store: the homepage and robots.txt downloaded here are reused by the
+            # enrichment helpers below instead of being downloaded and parsed again.
+            documents = ScanDocumentStore(client)
+            await graph.run()
+        print(f"[{scan_id}] Stage timings: {graph.timing_summary()}", flush=True)
+        for counter, value in documents.transfer.items():
+            METRICS[f"fetch.{counter}"] += value
+        print(f"[{scan_id}] Transfer: {dict(documents.transfer)}", flush=True)
+        for name in ("crawl", "broken_links"):
+            if isinstance(graph.results.get(name), Exception):
+                print(f"[{scan_id}] Stage {name} failed, continuing without it: {graph.results[name]!r}", flush=True)
+
+        # Incorporate external API data into seo_data
+        gsc_data_api, adsense_data_api = graph.results["google"]
+        if gsc_data_api:
+            seo_data["gsc_insights"] = gsc_data_api
+
+        if adsense_data_api:
+            core_scan_data["adsense_api_status"] = adsense_data_api
+
+        safe_browsing = graph.results["safe_browsing"]
+        if safe_browsing is None:
+            security_data["safe_browsing"] = {"status": "unknown"}
+        else:
             if safe_browsing.get("status") == "unknown":
                 # Fallback: Use AI Risk Score if Safe Browsing API is unconfigured/failed
                 ai_risk = core_scan_data.get("ai_policy", {}).get("risk_score", 0)
@@ -1976,55 +4209,25 @@ async def process_scan(scan_record):
                     safe_browsing = {"status": "unsafe", "issues": 1, "fallback_used": True}
                 else:
                     safe_browsing = {"status": "safe", "issues": 0, "fallback_used": True}
-                    
+
             security_data["safe_browsing"] = safe_browsing
-        except Exception as e:
-            print(f"[{scan_id}] Safe Browsing check failed: {e}", flush=True)
-            security_data["safe_browsing"] = {"status": "unknown"}
 
-        # Concurrently Fetch PageSpeed data
         try:
-            print(f"[{scan_id}] Fetching PageSpeed Insights...", flush=True)
-            pagespeed_result = await fetch_pagespeed_data(final_url)
-            if pagespeed_result:
-                core_scan_data["pagespeed"] = pagespeed_result
-        except Exception as e:
-            print(f"[{scan_id}] PageSpeed check failed: {e}", flush=True)
-
-
-        # -------------------------------------------------------------------
-        # Enrichment (domain age, keywords, social links, website info)
-        # Each function tries RapidAPI first if key available, then falls back to
-        # a fully free alternative. NO guard on RAPIDAPI_KEY here.
-        # -------------------------------------------------------------------
-        print(f"[{scan_id}] Fetching enrichment data (free fallbacks active)...", flush=True)
-        parsed_domain = urlparse(final_url).netloc or urlparse(target_url).netloc
-        try:
-            (
-                domain_age_data,
-                similarweb_data,
-                seo_keywords_data,
-                social_links_data,
-                website_info_data,
-                domain_authority_data,
-            ) = await asyncio.gather(
-                fetch_domain_age(parsed_domain),
-                fetch_similarweb_data(parsed_domain),
-                fetch_seo_keywords(final_url),
-                fetch_social_links(final_url),
-                fetch_website_info(final_url),
-                fetch_domain_authority(parsed_domain),
-                return_exceptions=True
-            )
+            domain_age_data = graph.results["domain_age"]
+            similarweb_data = graph.results["similarweb"]
+            seo_keywords_data = graph.results["seo_keywords"]
+            social_links_data = graph.results["social_links"]
+            website_info_data = graph.results["website_info"]
+            domain_authority_data = graph.results["domain_authority"]
 
             # ---- Domain age + WHOIS visibility ----
             if isinstance(domain_age_data, dict) and domain_age_data:
                 # Store the exact structure returned by fetch_domain_age
                 core_scan_data["domain_age"] = domain_age_data.get("domain_age")
-                
+
                 age_years = domain_age_data.get("domain_age", {}).get("years", "?") if domain_age_data.get("domain_age") else "?"
                 print(f"[{scan_id}] Domain age: {age_years} years (source: {domain_age_data.get('source','?')})", flush=True)
-                
+
                 # Update whois_visibility to reflect the new richer fields
                 core_scan_data["whois_visibility"] = {
                     "is_public": bool(domain_age_data.get("creation_date")),
@@ -2066,13 +4269,11 @@ async def process_scan(scan_record):
         except Exception as e:
             print(f"[{scan_id}] Enrichment error: {e}", flush=True)
 
-
         # ---- Mobile friendliness (from PageSpeed mobile score + viewport check) ----
         ps = core_scan_data.get("pagespeed", {})
         mobile_score = ps.get("mobile_score")
-        vp_tag = soup.find("meta", attrs={"name": "viewport"}) if soup else None
-        has_viewport = vp_tag is not None
-        viewport_content = vp_tag.get("content", "") if vp_tag else ""
+        has_viewport = page is not None and "viewport" in page.meta
+        viewport_content = (page.meta.get("viewport") or "") if has_viewport else ""
         is_viewport_correct = "width=device-width" in viewport_content
         core_scan_data["mobile_friendly"] = {
             "has_viewport_meta": has_viewport,
@@ -2181,27 +4382,20 @@ async def process_scan(scan_record):
         await update_scan_record(scan_id, update_payload)
         print(f"[{scan_id}] Process complete, successfully updated!", flush=True)
 
+        if trust_pages_data.get("drafts_pending"):
+            print(f"[{scan_id}] Generating missing page drafts in the background: {trust_pages_data['drafts_pending']}", flush=True)
+            schedule_draft_fill(scan_id, urlparse(final_url).netloc, trust_pages_data["drafts_pending"])
+
         # Create In-App Notification
         if user_id:
             try:
-                import httpx
-                notif_url = f"{SUPABASE_URL}/rest/v1/notifications"
-                notif_headers = {
-                    "apikey": SUPABASE_KEY,
-                    "Authorization": f"Bearer {SUPABASE_KEY}",
-                    "Content-Type": "application/json",
-                    "Prefer": "return=minimal"
-                }
-                notif_payload = {
-                    "user_id": user_id,
-                    "title": "Analysis Complete",
-                    "message": f"Scan finished for {domain} with a score of {int(min(score, 99))}/100.",
-                    "type": "success",
-                    "action_url": f"/results?id={scan_id}"
-                }
-                async with httpx.AsyncClient() as notif_client:
-                    notif_res = await notif_client.post(notif_url, headers=notif_headers, json=notif_payload)
-                    notif_res.raise_for_status()
+                await create_notification(
+                    user_id,
+                    "Analysis Complete",
+                    f"Scan finished for {domain} with a score of {int(min(score, 99))}/100.",
+                    "success",
+                    action_url=f"/results?id={scan_id}"
+                )
             except Exception as notif_err:
                 print(f"[{scan_id}] Failed to create notification: {notif_err}", flush=True)
         
@@ -2231,50 +4425,439 @@ async def process_scan(scan_record):
         # Create Failure Notification
         if user_id:
             try:
-                import httpx
-                notif_url = f"{SUPABASE_URL}/rest/v1/notifications"
-                notif_headers = {
-                    "apikey": SUPABASE_KEY,
-                    "Authorization": f"Bearer {SUPABASE_KEY}",
-                    "Content-Type": "application/json",
-                    "Prefer": "return=minimal"
-                }
-                notif_payload = {
-                    "user_id": user_id,
-                    "title": "Analysis Failed",
-                    "message": f"The scan for {domain} failed to complete due to an error.",
-                    "type": "error"
-                }
-                async with httpx.AsyncClient() as notif_client:
-                    notif_res = await notif_client.post(notif_url, headers=notif_headers, json=notif_payload)
-                    notif_res.raise_for_status()
+                await create_notification(
+                    user_id,
+                    "Analysis Failed",
+                    f"The scan for {domain} failed to complete due to an error.",
+                    "error"
+                )
             except Exception as notif_err:
                 pass
 
-async def poll_jobs():
-    print("Background worker started. Polling for pending scans...")
+# ============================================================
+# SSL Expiry Monitoring
+# ============================================================
+
+# A lightweight alternative to a full process_scan for certificate expiry: a sweep claims
+# sites in batches (claim_ssl_checks stamps ssl_checked_at, so sweeps on several workers
+# split the table), handshakes with each distinct host once, writes only the SSL result
+# back and alerts when a certificate crosses one of SSL_ALERT_DAYS.
+
+X509_V_ERR_CERT_HAS_EXPIRED = 10
+
+async def claim_ssl_checks(limit: int = SSL_MONITOR_BATCH) -> list:
+    """Lease up to `limit` sites due for an SSL check via the claim_ssl_checks RPC."""
+    payload = {"p_limit": limit, "p_recheck_seconds": SSL_MONITOR_RECHECK}
+    client = get_supabase_client()
+    try:
+        r = await client.post("/rpc/claim_ssl_checks", json=payload)
+        r.raise_for_status()
+        return r.json()
+    except Exception as e:
+        print(f"[SSL Monitor] Failed to claim sites: {e}", flush=True)
+        return []
+
+async def record_ssl_checks(checks: list) -> bool:
+    """Write one batch of {id, ssl_data, ssl_expires_at, ssl_alerted_days} rows in a single call."""
+    if not checks:
+        return True
+    client = get_supabase_client()
+    try:
+        r = await client.post("/rpc/record_ssl_checks", json={"p_checks": checks})
+        r.raise_for_status()
+        return True
+    except Exception as e:
+        print(f"[SSL Monitor] Failed to record {len(checks)} results: {e}", flush=True)
+        return False
+
+def ssl_alert_threshold(days_remaining: int):
+    """Smallest of SSL_ALERT_DAYS the certificate is within (0 once it has expired), or None."""
+    if days_remaining <= 0:
+        return 0
+    crossed = [days for days in SSL_ALERT_DAYS if days_remaining <= days]
+    return min(crossed) if crossed else None
+
+async def probe_tls_targets(targets, concurrency: int = SSL_MONITOR_CONCURRENCY, context: ssl.SSLContext = None) -> dict:
+    """Handshake once with every (host, port); maps each to its certificate metadata or the exception."""
+    # One context for the whole sweep: loading the CA bundle per handshake would dominate
+    context = context or ssl.create_default_context()
+    semaphore = asyncio.Semaphore(concurrency)
+    results = {}
+
+    async def probe(target):
+        async with semaphore:
+            try:
+                results[target] = await tls_probe(*target, context=context)
+            except Exception as e:
+                results[target] = e
+
+    await asyncio.gather(*(probe(target) for target in targets))
+    # Scans of these hosts within the hour can then skip their own handshake
+    await tls_cert_cache.set_many([entry for target, meta in results.items() if isinstance(meta, dict)
+                                   for entry in tls_cache_entries(*target, meta)])
+    return results
+
+def site_ssl_check(site: dict, probed) -> tuple:
+    """(record_ssl_checks row, alert threshold to notify about or None) for one site's probe outcome."""
+    alerted = site.get("ssl_alerted_days")
+    if isinstance(probed, dict):
+        result = ssl_result(probed)
+        threshold = ssl_alert_threshold(result["days_remaining"])
+        expires_at = probed["not_after"]
+    else:
+        result = {"status": "failed", "error": f"SSL Connection failed: {str(probed) or type(probed).__name__}", "protocol": "HTTP"}
+        expires_at = None
+        # An expired certificate fails verification, so it never reaches ssl_result(); any
+        # other failure (DNS, refused, timeout) may be transient and keeps the alert state
+        if isinstance(probed, ssl.SSLCertVerificationError) and probed.verify_code == X509_V_ERR_CERT_HAS_EXPIRED:
+            result.update(valid=False, days_remaining=0, expires_at=site.get("ssl_expires_at"))
+            threshold = 0
+        else:
+            threshold = alerted
+    row = {"id": str(site["id"]), "ssl_data": result, "ssl_expires_at": expires_at, "ssl_alerted_days": threshold}
+    # Each threshold alerts once per certificate; a renewal moves it out of range and resets it
+    notify = threshold is not None and (alerted is None or threshold < alerted)
+    return row, threshold if notify else None
+
+async def send_ssl_alert(site: dict, result: dict, threshold: int):
+    user_id = site.get("user_id")
+    if not user_id:
+        return
+    domain = site.get("domain") or tls_target(site["url"])[0]
+    days = result.get("days_remaining")
+    if threshold == 0:
+        title = "SSL Certificate Expired"
+        message = f"The SSL certificate for {domain} has expired. Visitors now see a security warning."
+    else:
+        title = "SSL Certificate Expiring Soon"
+        message = f"The SSL certificate for {domain} expires in {days} day{'' if days == 1 else 's'} ({result['expires_at'][:10]})."
+    try:
+        await create_notification(user_id, title, message, "error" if threshold == 0 else "warning")
+    except Exception as e:
+        print(f"[SSL Monitor] Failed to create notification for {domain}: {e}", flush=True)
+    try:
+        webhooks = await fetch_user_webhooks(user_id, "ssl.expiring")
+        if webhooks:
+            payload = {
+                "event": "ssl.expiring",
+                "site_id": site["id"],
+                "domain": domain,
+                "expired": threshold == 0,
+                "days_remaining": days,
+                "expires_at": result.get("expires_at"),
+                "issuer": result.get("issuer"),
+                "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat()
+            }
+            await dispatch_webhooks(webhooks, payload)
+    except Exception as e:
+        print(f"[SSL Monitor] Webhook dispatch error for {domain}: {e}", flush=True)
+
+async def check_site_certificates(sites: list, context: ssl.SSLContext = None) -> Counter:
+    """Probe, record and alert for one claimed batch of sites."""
+    targets = {}
+    for site in sites:
+        if site.get("url"):
+            targets[site["id"]] = tls_target(site["url"])
+    probed = await probe_tls_targets(set(targets.values()), context=context)
+
+    rows, alerts = [], []
+    for site in sites:
+        if site["id"] not in targets:
+            continue
+        row, notify = site_ssl_check(site, probed[targets[site["id"]]])
+        rows.append(row)
+        if notify is not None:
+            alerts.append((site, row["ssl_data"], notify))
+    await record_ssl_checks(rows)
+    await asyncio.gather(*(send_ssl_alert(*alert) for alert in alerts))
+
+    stats = Counter(sites=len(rows), hosts=len(probed), alerts=len(alerts),
+                    failed=sum(1 for row in rows if row["ssl_data"]["status"] == "failed"))
+    for counter, value in stats.items():
+        METRICS[f"ssl_monitor.{counter}"] += value
+    return stats
+
+async def run_ssl_sweep(batch_size: int = SSL_MONITOR_BATCH, context: ssl.SSLContext = None) -> dict:
+    """Check every site due for an SSL check, one claimed batch at a time, until none are left."""
+    started = time.monotonic()
+    totals = Counter()
+    try:
+        while True:
+            sites = await claim_ssl_checks(batch_size)
+            if not sites:
+                break
+            totals.update(await check_site_certificates(sites, context))
+    except Exception as e:
+        print(f"[SSL Monitor] Sweep aborted: {e}", flush=True)
+    METRICS["ssl_monitor.sweeps"] += 1
+    summary = dict(totals, seconds=round(time.monotonic() - started, 1))
+    print(f"[SSL Monitor] Sweep done: {summary}", flush=True)
+    return summary
+
+ssl_sweep_task = None
+
+def start_ssl_sweep() -> bool:
+    """Start a sweep in the background unless this worker is already running one."""
+    global ssl_sweep_task
+    if ssl_sweep_task is not None and not ssl_sweep_task.done():
+        return False
+    ssl_sweep_task = asyncio.create_task(run_ssl_sweep())
+    return True
+
+async def ssl_monitor_loop(interval: int = SSL_MONITOR_INTERVAL):
     while True:
+        start_ssl_sweep()
+        await asyncio.gather(ssl_sweep_task, return_exceptions=True)
+        await asyncio.sleep(interval)
+
+# ============================================================
+# Scan Scheduler
+# ============================================================
+
+class LocalScanNotifier:
+    """
+    In-process stand-in for the Postgres notification channel (tests, local dev).
+    Subscribers are plain callbacks receiving the new scan id.
+    """
+
+    def __init__(self):
+        self._subscribers = []
+        self.connected = True
+
+    def subscribe(self, callback):
+        self._subscribers.append(callback)
+
+    def notify(self, scan_id=None):
+        for callback in self._subscribers:
+            try:
+                callback(scan_id)
+            except Exception as e:
+                print(f"Scan notifier callback error: {e}", flush=True)
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+class PostgresScanNotifier(LocalScanNotifier):
+    """
+    LISTENs on SCAN_NOTIFY_CHANNEL, which the adsense_scans insert trigger notifies with the
+    new scan id. Reconnects with backoff; `connected` is False while the listener is down so
+    the scheduler falls back to fast polling.
+    """
+
+    def __init__(self, dsn, channel=SCAN_NOTIFY_CHANNEL):
+        super().__init__()
+        self.dsn = dsn
+        self.channel = channel
+        self.connected = False
+        self._task = None
+
+    def _on_notification(self, connection, pid, channel, payload):
+        self.notify(payload or None)
+
+    async def _listen_loop(self):
+        backoff = 1
+        while True:
+            conn = None
+            try:
+                conn = await asyncpg.connect(self.dsn)
+                await conn.add_listener(self.channel, self._on_notification)
+                self.connected = True
+                backoff = 1
+                print(f"Listening for new scans on '{self.channel}'", flush=True)
+                # Anything inserted while we were disconnected is picked up by this wakeup
+                self.notify(None)
+                while not conn.is_closed():
+                    await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Scan notification listener error: {e} (retrying in {backoff}s)", flush=True)
+            finally:
+                self.connected = False
+                if conn is not None and not conn.is_closed():
+                    await conn.close()
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 60)
+
+    async def start(self):
+        self._task = asyncio.create_task(self._listen_loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+def create_scan_notifier():
+    if not SCAN_NOTIFY_DSN:
+        print("No SUPABASE_DB_URL set — scan wakeups fall back to polling.", flush=True)
+        return None
+    if asyncpg is None:
+        print("asyncpg not installed — scan wakeups fall back to polling.", flush=True)
+        return None
+    return PostgresScanNotifier(SCAN_NOTIFY_DSN)
+
+class ScanScheduler:
+    """
+    Runs process_scan in a fixed number of concurrent slots fed from a bounded in-memory queue.
+    The refill loop tops the queue up from Supabase as soon as a slot frees, so one slow
+    site (PSI alone can take minutes) no longer stalls every other queued scan.
+
+    Every queued or running scan is leased to WORKER_ID; the heartbeat loop keeps those
+    leases alive so other replicas only reclaim scans whose worker actually died.
+
+    With a notifier attached the refill loop is woken the moment a scan row is inserted and
+    polling drops to a slow safety net (SCAN_SAFETY_POLL_INTERVAL).
+    """
+
+    def __init__(self, concurrency=SCAN_CONCURRENCY, queue_size=SCAN_QUEUE_SIZE, poll_interval=SCAN_POLL_INTERVAL,
+                 notifier=None, safety_poll_interval=SCAN_SAFETY_POLL_INTERVAL):
+        self.concurrency = max(1, concurrency)
+        self.queue = asyncio.Queue(maxsize=max(1, queue_size))
+        self.poll_interval = poll_interval
+        self.safety_poll_interval = safety_poll_interval
+        self.notifier = notifier
+        if notifier is not None:
+            notifier.subscribe(lambda scan_id: self.wakeup.set())
+        self.active_ids = set()   # scan ids queued or running on this worker
+        self.running = 0
+        self.wakeup = asyncio.Event()
+        self._tasks = []
+
+    def submit(self, scan_record) -> bool:
+        """Queue a scan without blocking. Returns False when the queue is full."""
+        scan_id = scan_record.get("id")
+        if scan_id in self.active_ids:
+            return True
+        if self.queue.full():
+            return False
+        self.active_ids.add(scan_id)
+        self.queue.put_nowait(scan_record)
+        return True
+
+    @property
+    def idle_interval(self):
+        if self.notifier is not None and self.notifier.connected:
+            return self.safety_poll_interval
+        return self.poll_interval
+
+    def stats(self) -> dict:
+        return {
+            "concurrency": self.concurrency,
+            "running": self.running,
+            "queued": self.queue.qsize(),
+            "queue_size": self.queue.maxsize,
+        }
+
+    async def _run_slot(self, slot):
+        while True:
+            scan = await self.queue.get()
+            self.running += 1
+            try:
+                await process_scan(scan)
+            except Exception as e:
+                print(f"[slot {slot}] Unhandled error in scan {scan.get('id')}: {e}", flush=True)
+            finally:
+                self.running -= 1
+                self.active_ids.discard(scan.get("id"))
+                self.queue.task_done()
+                # A slot just freed: let the refill loop pull the next row immediately
+                self.wakeup.set()
+
+    async def _wait_for_wakeup(self, timeout):
         try:
-            # Fetch pending scans
-            pending_scans = await fetch_pending_scans()
-            
-            if pending_scans:
-                print(f"Found {len(pending_scans)} pending scans. Processing...")
-                for scan in pending_scans:
-                    await process_scan(scan)
-            else:
-                await asyncio.sleep(5)
-        except Exception as e:
-            print(f"Polling error: {e}", flush=True)
-            await asyncio.sleep(5)
+            await asyncio.wait_for(self.wakeup.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+        self.wakeup.clear()
+
+    async def _refill_loop(self):
+        print(f"Background worker started. Polling for pending scans ({self.concurrency} slots)...", flush=True)
+        while True:
+            try:
+                accepted = 0
+                free = self.queue.maxsize - self.queue.qsize()
+                if free > 0:
+                    for scan in await claim_pending_scans(limit=free):
+                        if scan.get("id") in self.active_ids:
+                            continue
+                        if not self.submit(scan):
+                            await release_scans([scan.get("id")])
+                            continue
+                        accepted += 1
+                    if accepted:
+                        print(f"Claimed {accepted} pending scans ({self.stats()})", flush=True)
+
+                # Go straight back for more only if we made progress and still have room
+                if accepted and not self.queue.full():
+                    continue
+                await self._wait_for_wakeup(self.idle_interval)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Polling error: {e}", flush=True)
+                await asyncio.sleep(self.poll_interval)
+
+    async def _heartbeat_loop(self):
+        interval = max(5, SCAN_LEASE_SECONDS // 3)
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await renew_scan_leases(list(self.active_ids))
+            except Exception as e:
+                print(f"Lease heartbeat error: {e}", flush=True)
+
+    async def start(self):
+        if self.notifier is not None:
+            await self.notifier.start()
+        self._tasks = [asyncio.create_task(self._run_slot(i)) for i in range(self.concurrency)]
+        self._tasks.append(asyncio.create_task(self._refill_loop()))
+        self._tasks.append(asyncio.create_task(self._heartbeat_loop()))
+
+    async def stop(self):
+        if self.notifier is not None:
+            await self.notifier.stop()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        # Scans still sitting in the queue were never started: give them back right away
+        # instead of making another replica wait for the lease to expire.
+        unstarted = []
+        while not self.queue.empty():
+            unstarted.append(self.queue.get_nowait().get("id"))
+        if unstarted:
+            await release_scans(unstarted)
+
+scheduler = None
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Start the polling worker in the background
-    worker_task = asyncio.create_task(poll_jobs())
+    global scheduler
+    # Start the scan scheduler (slots + refill loop) in the background
+    # One pooled Supabase client for the whole process lifetime
+    get_supabase_client()
+    scheduler = ScanScheduler(notifier=create_scan_notifier())
+    await scheduler.start()
+    sb_sync = asyncio.create_task(safe_browsing_sync_loop(safe_browsing_db)) if safe_browsing_db is not None else None
+    ssl_monitor = asyncio.create_task(ssl_monitor_loop()) if SSL_MONITOR_INTERVAL > 0 else None
     yield
+    if sb_sync is not None:
+        sb_sync.cancel()
+    if ssl_monitor is not None:
+        ssl_monitor.cancel()
+    if ssl_sweep_task is not None:
+        ssl_sweep_task.cancel()
     # Cancel the worker gracefully when the server shuts down
-    worker_task.cancel()
+    await scheduler.stop()
+    # Give background draft fills a moment to store what they have before the client closes
+    if draft_tasks:
+        await asyncio.wait(set(draft_tasks), timeout=10)
+    await close_supabase_client()
+    shutdown_parse_pool()
 
 app = FastAPI(lifespan=lifespan)
 
@@ -2295,16 +4878,45 @@ class ScanRequest(BaseModel):
 def health_check():
     return Response(content="OK", status_code=200)
 
+@app.get("/metrics")
+def metrics():
+    snapshot = metrics_snapshot()
+    if scheduler is not None:
+        snapshot.update({f"scheduler.{k}": v for k, v in scheduler.stats().items()})
+    return snapshot
+
 @app.post("/scan")
 async def trigger_scan(request: ScanRequest, background_tasks: BackgroundTasks):
     scan_record = {
         "id": request.id,
         "site_id": request.site_id
     }
+    # Hand the scan to the scheduler so it shares the slot limit with polled scans.
+    # If the queue is full the row stays pending and the refill loop picks it up later.
+    if scheduler is not None:
+        if request.id in scheduler.active_ids:
+            return {"status": "success", "message": "Scan already queued on this worker", "scan_id": request.id}
+        if scheduler.queue.full():
+            return {"status": "success", "message": "Worker busy, scan will be picked up from the pending queue", "scan_id": request.id}
+        claimed = await claim_scan(request.id)
+        if not claimed:
+            return {"status": "success", "message": "Scan already claimed by a worker", "scan_id": request.id}
+        if scheduler.submit(claimed):
+            return {"status": "success", "message": "Scan queued for processing", "scan_id": request.id}
+        await release_scans([request.id])
+        return {"status": "success", "message": "Worker busy, scan will be picked up from the pending queue", "scan_id": request.id}
     # Run the scan in the background to avoid frontend/gateway timeouts
     background_tasks.add_task(process_scan, scan_record)
     return {"status": "success", "message": "Scan triggered and running in the background", "scan_id": request.id}
 
+@app.post("/monitor/ssl")
+async def trigger_ssl_sweep():
+    # Certificate expiry only: no page fetch, crawl, PageSpeed or Gemini call. Safe to call
+    # from a cron on every worker, since sites are claimed so no two sweeps check the same one.
+    if start_ssl_sweep():
+        return {"status": "success", "message": "SSL expiry sweep started"}
+    return {"status": "success", "message": "SSL expiry sweep already running on this worker"}
+
 class RegenerateDraftRequest(BaseModel):
     scan_id: str
     domain: str
@@ -2312,36 +4924,15 @@ class RegenerateDraftRequest(BaseModel):
 
 @app.post("/regenerate-draft")
 async def handle_regenerate_draft(request: RegenerateDraftRequest):
-    draft_content = await generate_missing_page_draft(request.domain, request.page_type)
+    # An explicit regenerate asks for a fresh draft, which then replaces the cached one
+    draft_content = await generate_missing_page_draft(request.domain, request.page_type, use_cache=False)
     if draft_content:
-        import httpx
-        url = f"{SUPABASE_URL}/rest/v1/adsense_scans?id=eq.{request.scan_id}&select=trust_pages_data"
-        headers = {
-            "apikey": SUPABASE_KEY,
-            "Authorization": f"Bearer {SUPABASE_KEY}"
-        }
-        async with httpx.AsyncClient() as client:
-            try:
-                r = await client.get(url, headers=headers)
-                r.raise_for_status()
-                data = r.json()
-                if data:
-                    trust_data = data[0].get("trust_pages_data", {})
-                    if "drafts" not in trust_data:
-                        trust_data["drafts"] = {}
-                    trust_data["drafts"][request.page_type] = draft_content
-                    
-                    update_url = f"{SUPABASE_URL}/rest/v1/adsense_scans?id=eq.{request.scan_id}"
-                    patch_headers = headers.copy()
-                    patch_headers["Content-Type"] = "application/json"
-                    patch_headers["Prefer"] = "return=minimal"
-                    
-                    patch_r = await client.patch(update_url, headers=patch_headers, json={"trust_pages_data": trust_data})
-                    patch_r.raise_for_status()
-                    return {"status": "success", "draft": draft_content}
-            except Exception as e:
-                print(f"Failed to fetch/update trust_pages_data for {request.scan_id}: {e}")
-                return Response(content="Database update failed", status_code=500)
+        try:
+            if await save_scan_drafts(request.scan_id, {request.page_type: draft_content}):
+                return {"status": "success", "draft": draft_content}
+        except Exception as e:
+            print(f"Failed to fetch/update trust_pages_data for {request.scan_id}: {e}")
+            return Response(content="Database update failed", status_code=500)
     return Response(content="Draft generation failed", status_code=500)
 
 class ContentImprovementsRequest(BaseModel):
@@ -0,0 +1,271 @@
+import asyncio
+import os
+import time
+
+# Mock env vars before importing main
+os.environ["SUPABASE_URL"] = "http://mock.url"
+os.environ["SUPABASE_SERVICE_ROLE_KEY"] = "mock_key"
+
+import httpx
+import main
+
+def test_whois_cache_serves_stale_and_refreshes():
+    main.WHOIS_XML_API_KEY = "test-key"
+    main.whois_cache = main.ResultCache("whois", main.WHOIS_CREATION_TTL, persistent=False)
+    lookups = []
+
+    async def fake_fetch(clean_domain):
+        lookups.append(clean_domain)
+        await asyncio.sleep(0.01)
+        return {"creation_date": "2015-03-01 00:00:00 UTC", "registrar": f"Registrar {len(lookups)}",
+                "expiration_date": "2099-03-01 00:00:00 UTC", "domain_status": "ok", "fetched_at": time.time()}
+
+    main.fetch_whois_record = fake_fetch
+
+    async def run():
+        first = await main.fetch_domain_age("https://Example.com/")
+        cached = await main.fetch_domain_age("example.com")
+        assert lookups == ["example.com"] and cached == first
+        assert first["domain_age"]["years"] >= 10 and first["registrar"] == "Registrar 1"
+
+        # Details past their TTL: the stale record comes back at once, a refresh runs behind it
+        record, expires_at = main.whois_cache._memory[main.whois_cache._cache_key("example.com")]
+        await main.whois_cache.set("example.com", dict(record, fetched_at=time.time() - main.WHOIS_DETAILS_TTL - 1))
+        started = time.monotonic()
+        stale = await main.fetch_domain_age("example.com")
+        again = await main.fetch_domain_age("example.com")
+        assert time.monotonic() - started < 0.01
+        assert stale["registrar"] == "Registrar 1" and again["registrar"] == "Registrar 1"
+        await asyncio.gather(*main.whois_refreshes.values())
+        assert lookups == ["example.com", "example.com"]  # one refresh, not one per stale read
+        refreshed = await main.fetch_domain_age("example.com")
+        assert refreshed["registrar"] == "Registrar 2"
+
+    asyncio.run(run())
+
+def test_whois_lapsed_expiry_refreshes_once():
+    now = time.time()
+    lapsed = {"expiration_date": "2020-01-01 00:00:00 UTC"}
+    # Fetched before the date passed: probably renewed since, so refresh
+    assert main.whois_details_stale(dict(lapsed, fetched_at=1500000000))
+    # A refresh that still reports the past date is trusted for WHOIS_DETAILS_TTL like any other
+    assert not main.whois_details_stale(dict(lapsed, fetched_at=now - 60))
+    assert main.whois_details_stale(dict(lapsed, fetched_at=now - main.WHOIS_DETAILS_TTL - 1))
+
+def test_policy_analysis_cached_by_content():
+    main.GEMINI_API_KEY = "test-gemini-key"
+    main.policy_cache = main.ResultCache("ai_policy", main.AI_POLICY_CACHE_TTL, persistent=False)
+    prompts = []
+
+    class FakeResponse:
+        text = '{"issues_found": false, "risk_score": 5, "policy_violations": []}'
+
+    class FakeModel:
+        def __init__(self, name, generation_config=None):
+            self.name = name
+
+        def generate_content(self, prompt):
+            prompts.append(prompt)
+            return FakeResponse()
+
+    main.genai.configure = lambda **kwargs: None
+    main.genai.GenerativeModel = FakeModel
+    hits_before = main.METRICS["cache.ai_policy.hits"]
+
+    async def run():
+        first = await main.analyze_policy_with_ai("Welcome to  our\nsite")
+        # Whitespace-only differences hash the same; real edits do not
+        second = await main.analyze_policy_with_ai("Welcome to our site ")
+        edited = await main.analyze_policy_with_ai("Welcome to our new site")
+        return first, second, edited
+
+    first, second, edited = asyncio.run(run())
+    assert len(prompts) == 2
+    assert first == second == edited and first["risk_score"] == 5
+    assert main.METRICS["cache.ai_policy.hits"] - hits_before == 1
+    assert main.metrics_snapshot()["cache.ai_policy.hit_ratio"] is not None
+    # A new prompt version invalidates every cached analysis
+    main.POLICY_PROMPT_VERSION = "test-bump"
+    try:
+        assert asyncio.run(main.policy_cache.get(main.policy_cache_key("Welcome to our site"))) is None
+    finally:
+        main.POLICY_PROMPT_VERSION = "1"
+
+def test_missing_drafts_generated_concurrently_and_cached():
+    main.GEMINI_API_KEY = "test-gemini-key"
+    main.draft_cache = main.ResultCache("drafts", main.DRAFT_CACHE_TTL, persistent=False)
+    main.AI_DRAFT_CONCURRENCY = 2
+    main._limiters.pop("ai_drafts", None)
+    calls = []
+    active = [0, 0]  # current, peak
+
+    class FakeResponse:
+        def __init__(self, text):
+            self.text = text
+
+    class FakeModel:
+        def __init__(self, name, generation_config=None):
+            pass
+
+        def generate_content(self, prompt):
+            active[0] += 1
+            active[1] = max(active[1], active[0])
+            time.sleep(0.1)
+            active[0] -= 1
+            calls.append(prompt)
+            return FakeResponse(f"<h1>Draft {len(calls)}</h1>")
+
+    main.genai.configure = lambda **kwargs: None
+    main.genai.GenerativeModel = FakeModel
+    saved = []
+
+    async def fake_save(scan_id, drafts, settled=(), overwrite=True):
+        saved.append((scan_id, drafts, list(settled), overwrite))
+        return True
+
+    main.save_scan_drafts = fake_save
+    page_types = ["privacy", "about", "contact", "terms"]
+
+    async def run():
+        started = time.monotonic()
+        lookups_before = main.METRICS["cache.drafts.misses"] + main.METRICS["cache.drafts.hits"]
+        main.schedule_draft_fill("scan-1", "Example.com", page_types)
+        await asyncio.gather(*main.draft_tasks)
+        elapsed = time.monotonic() - started
+        # Four 0.1s generations two at a time, instead of one after another
+        assert elapsed < 0.35
+        assert active[1] == 2
+        assert saved[0][0] == "scan-1" and sorted(saved[0][1]) == sorted(page_types) and saved[0][2] == page_types
+        # The scan already missed the cache for these; the fill neither re-reads it nor replaces stored drafts
+        assert main.METRICS["cache.drafts.misses"] + main.METRICS["cache.drafts.hits"] == lookups_before
+        assert saved[0][3] is False
+
+        # The next scan of the same domain finds them all cached
+        cached = await main.draft_cache.get_many([main.draft_cache_key("example.com", t) for t in page_types])
+        assert len(cached) == 4 and len(calls) == 4
+        assert await main.generate_missing_page_draft("example.com", "about") == saved[0][1]["about"]
+        # An explicit regenerate bypasses the cache and replaces the entry
+        fresh = await main.generate_missing_page_draft("example.com", "about", use_cache=False)
+        assert len(calls) == 5 and await main.draft_cache.get(main.draft_cache_key("example.com", "about")) == fresh
+
+    asyncio.run(run())
+
+def test_safe_browsing_batches_and_caches_verdicts():
+    main.SAFE_BROWSING_API_KEY = "test-sb-key"
+    main.safe_browsing_cache = main.ResultCache("safe_browsing", main.SAFE_BROWSING_SAFE_TTL, max_entries=50000, persistent=False)
+    batch_sizes = []
+
+    def handler(request):
+        entries = main.json.loads(request.content)["threatInfo"]["threatEntries"]
+        batch_sizes.append(len(entries))
+        matches = [{"threatType": "MALWARE", "threat": {"url": e["url"]}, "cacheDuration": "300s"}
+                   for e in entries if "evil" in e["url"]]
+        return httpx.Response(200, json={"matches": matches} if matches else {})
+
+    urls = ["https://example.com/"] + [f"https://example.com/p/{i}" for i in range(1100)] + ["http://evil.test/x", "https://example.com/p/1#dup",
+            "https://example.com:8o8o/", "http://[::1/"]
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            first = await main.check_safe_browsing(urls, client)
+            second = await main.check_safe_browsing(urls, client)
+        return first, second
+
+    first, second = asyncio.run(run())
+    # 1102 distinct URLs in three calls of at most 500; the fragment variant is the same URL
+    assert sorted(batch_sizes) == [102, 500, 500]
+    assert first["http://evil.test/x"] == {"status": "unsafe", "threats": ["MALWARE"], "cached": False}
+    assert first["https://example.com/"]["status"] == "safe"
+    # Malformed links are left unknown without sinking the rest of the batch
+    assert first["https://example.com:8o8o/"] == first["http://[::1/"] == {"status": "unknown"}
+    # Everything is cached the second time round; the match only for its cacheDuration
+    assert len(batch_sizes) == 3 and all(v.get("cached") for u, v in second.items() if v["status"] != "unknown")
+    safe_expiry = main.safe_browsing_cache._memory[main.safe_browsing_cache._cache_key("https://example.com/")][1]
+    evil_expiry = main.safe_browsing_cache._memory[main.safe_browsing_cache._cache_key("http://evil.test/x")][1]
+    assert evil_expiry - time.time() <= 300 < safe_expiry - time.time()
+
+def test_google_data_fetched_together_with_token_refresh_and_cache():
+    main.GOOGLE_CLIENT_ID, main.GOOGLE_CLIENT_SECRET = "client-id", "client-secret"
+    main.google_data_cache = main.ResultCache("google_data", main.GOOGLE_DATA_CACHE_TTL, persistent=False)
+    calls, stored = [], []
+    tokens = iter(["fresh-1", "fresh-2"])
+
+    async def handler(request):
+        if request.url.host == "oauth2.googleapis.com":
+            form = dict(httpx.QueryParams(request.content.decode()))
+            assert form["grant_type"] == "refresh_token" and form["client_secret"] == "client-secret"
+            calls.append(("token", form["refresh_token"]))
+            if form["refresh_token"] == "dead":
+                return httpx.Response(400, json={"error": "invalid_grant"})
+            return httpx.Response(200, json={"access_token": next(tokens), "expires_in": 3599})
+        if request.url.path.endswith("/user_integrations"):
+            stored.append((request.url.params["user_id"], main.json.loads(request.content)["access_token"]))
+            return httpx.Response(204)
+        token = request.headers["Authorization"].split()[-1]
+        api = "gsc" if request.url.host == "searchconsole.googleapis.com" else "adsense"
+        calls.append((api, token))
+        await asyncio.sleep(0.1)
+        if token == "revoked":
+            return httpx.Response(401)
+        if api == "gsc":
+            return httpx.Response(200, json={"rows": [{"clicks": 3, "impressions": 40}, {"clicks": 2, "impressions": 10}]})
+        return httpx.Response(200, json={"accounts": [{"name": "accounts/pub-1", "state": "READY"}]})
+
+    real_client = httpx.AsyncClient
+    main.httpx.AsyncClient = lambda *args, **kwargs: real_client(*args, transport=httpx.MockTransport(handler), **kwargs)
+    main.supabase_client = None
+
+    async def run():
+        # Token about to expire: refreshed (and saved) before either call is made
+        soon = (main.datetime.datetime.now(main.datetime.timezone.utc) + main.datetime.timedelta(seconds=60)).isoformat()
+        integration = {"user_id": "u1", "access_token": "old", "refresh_token": "r1", "token_expires_at": soon}
+        started = time.monotonic()
+        gsc, adsense = await main.fetch_google_data(integration, "https://example.com")
+        assert time.monotonic() - started < 0.18  # both 0.1s calls in flight together
+        assert calls == [("token", "r1"), ("gsc", "fresh-1"), ("adsense", "fresh-1")] or \
+               calls == [("token", "r1"), ("adsense", "fresh-1"), ("gsc", "fresh-1")]
+        assert stored == [("eq.u1", "fresh-1")] and integration["access_token"] == "fresh-1"
+        assert gsc["clicks_30d"] == 5 and adsense["account_id"] == "accounts/pub-1"
+
+        # Back-to-back scan: nothing goes to Google; another property only re-queries GSC
+        calls.clear()
+        assert await main.fetch_google_data(integration, "https://example.com") == (gsc, adsense)
+        await main.fetch_google_data(integration, "https://other.example")
+        assert calls == [("gsc", "fresh-1")]
+
+        # A token rejected before its recorded expiry is refreshed once and the calls retried
+        calls.clear()
+        later = (main.datetime.datetime.now(main.datetime.timezone.utc) + main.datetime.timedelta(hours=1)).isoformat()
+        revoked = {"user_id": "u2", "access_token": "revoked", "refresh_token": "r2", "token_expires_at": later}
+        gsc, adsense = await main.fetch_google_data(revoked, "https://example.com")
+        assert calls[-3] == ("token", "r2") and sorted(calls[-2:]) == [("adsense", "fresh-2"), ("gsc", "fresh-2")]
+        assert gsc["status"] == "success" and adsense["status"] == "success"
+
+        # Without a refresh token the 401 is returned as before, and not cached
+        calls.clear()
+        stuck = {"user_id": "u3", "access_token": "revoked", "token_expires_at": later}
+        gsc, _ = await main.fetch_google_data(stuck, "https://example.com")
+        assert gsc == {"connected": False, "error": "API returned 401"} and len(calls) == 2
+        await main.fetch_google_data(stuck, "https://example.com")
+        assert len(calls) == 4
+
+        # A refresh that fails (access revoked) is not followed by a retry with the same token
+        calls.clear()
+        dead = {"user_id": "u4", "access_token": "revoked", "refresh_token": "dead", "token_expires_at": later}
+        gsc, _ = await main.fetch_google_data(dead, "https://example.com")
+        assert gsc == {"connected": False, "error": "API returned 401"}
+        assert len(calls) == 3 and ("token", "dead") in calls
+
+    try:
+        asyncio.run(run())
+    finally:
+        main.httpx.AsyncClient = real_client
+        main.supabase_client = None
+
+if __name__ == "__main__":
+    test_whois_cache_serves_stale_and_refreshes()
+    test_whois_lapsed_expiry_refreshes_once()
+    test_policy_analysis_cached_by_content()
+    test_missing_drafts_generated_concurrently_and_cached()
+    test_safe_browsing_batches_and_caches_verdicts()
+    test_google_data_fetched_together_with_token_refresh_and_cache()
@@ -0,0 +1,464 @@
+import asyncio
+import contextlib
+import gzip
+import os
+import time
+
+# Mock env vars before importing main
+os.environ["SUPABASE_URL"] = "http://mock.url"
+os.environ["SUPABASE_SERVICE_ROLE_KEY"] = "mock_key"
+
+import httpx
+import main
+
+@contextlib.contextmanager
+def fresh_link_cache():
+    """Swap in an empty, memory-only link cache for one test."""
+    saved = main.link_cache
+    main.link_cache = main.ResultCache("link_status", main.LINK_CACHE_OK_TTL, persistent=False)
+    try:
+        yield
+    finally:
+        main.link_cache = saved
+
+def test_crawl_url_key_collapses_duplicates():
+    variants = [
+        "https://Example.com/about",
+        "https://example.com/about/",
+        "https://example.com:443/about#team",
+        "https://example.com/about?utm_source=x&utm_medium=y",
+        "https://example.com/about?fbclid=abc",
+    ]
+    keys = {main.crawl_url_key(u) for u in variants}
+    print(f"Keys: {keys}")
+    assert keys == {"https://example.com/about"}
+    # Meaningful query parameters survive (order-insensitive) and path case is kept
+    assert main.crawl_url_key("https://example.com/p?b=2&a=1") == main.crawl_url_key("https://example.com/p?a=1&b=2")
+    assert main.crawl_url_key("https://example.com/p?page=2") != main.crawl_url_key("https://example.com/p")
+    assert main.crawl_url_key("https://example.com/About") != main.crawl_url_key("https://example.com/about")
+
+def test_frontier_dedups_and_orders():
+    frontier = main.CrawlFrontier(allowed_host="example.com")
+    frontier.mark_seen("https://example.com/")
+    assert not frontier.add("https://example.com/#top")
+    assert frontier.add("https://example.com/deep", depth=3)
+    assert frontier.add("https://example.com/about", depth=1)
+    assert not frontier.add("https://example.com/about/?utm_campaign=z", depth=1)
+    assert not frontier.add("https://other.com/page", depth=1)
+    assert not frontier.add("mailto:hi@example.com", depth=1)
+
+    assert frontier.pop() == ("https://example.com/about", 1)
+    assert frontier.pop() == ("https://example.com/deep", 3)
+    assert frontier.pop() is None
+    assert dict(frontier.stats) == {"enqueued": 2, "visited": 2, "skipped": 4}
+
+def test_frontier_skips_unparsable_urls():
+    frontier = main.CrawlFrontier(allowed_host="example.com")
+    bad = ["https://example.com:abc/", "https://example.com:99999/x", "http://[::1/"]
+    for url in bad:
+        assert not frontier.add(url, priority=main.crawl_priority(url))
+        # Still keyed, without needing a valid port
+        assert main.crawl_url_key(url + "#frag") == url
+    assert frontier.add("https://example.com/ok")
+    assert len(frontier) == 1 and frontier.stats["skipped"] == 3
+
+def test_frontier_scales_linearly():
+    # Link-heavy site: every page links to every other page
+    urls = [f"https://example.com/post-{i}" for i in range(2000)]
+    frontier = main.CrawlFrontier(allowed_host="example.com")
+    started = time.monotonic()
+    for _ in range(20):
+        for url in urls:
+            frontier.add(url)
+    elapsed = time.monotonic() - started
+    print(f"40k link discoveries deduplicated in {elapsed * 1000:.1f} ms")
+    assert len(frontier) == 2000
+    assert frontier.stats["skipped"] == 38000
+
+def test_bloom_frontier():
+    frontier = main.CrawlFrontier(allowed_host="example.com", bloom_capacity=10000)
+    added = sum(frontier.add(f"https://example.com/p/{i}") for i in range(5000))
+    # A Bloom filter may reject a handful of new URLs as false positives, never accept a repeat
+    assert added >= 4990
+    assert not any(frontier.add(f"https://example.com/p/{i}/") for i in range(5000))
+
+def test_sliding_window_crawl_uneven_latency():
+    async def run():
+        # 40 pages: every tenth one takes 0.3s, the rest 0.02s
+        frontier = main.CrawlFrontier(allowed_host="example.com")
+        for i in range(40):
+            frontier.add(f"https://example.com/p/{i}")
+
+        async def fetch_page(url):
+            await asyncio.sleep(0.3 if url.endswith("0") else 0.02)
+            return {"url": url, "status": 200}
+
+        started = time.monotonic()
+        pages = [r async for r, _ in main.crawl_pages(frontier, fetch_page, max_pages=40, concurrency=10, per_host=10)]
+        elapsed = time.monotonic() - started
+        print(f"40 pages in {elapsed:.2f}s ({40 / elapsed:.0f} pages/s)")
+        assert len(pages) == 40
+        # Fixed batches of 10 would wait ~0.3s per batch (~1.2s); a sliding window overlaps the slow ones
+        assert elapsed < 0.8
+
+    asyncio.run(run())
+
+def test_crawl_respects_per_host_limit():
+    async def run():
+        frontier = main.CrawlFrontier()
+        for i in range(12):
+            frontier.add(f"https://{'a' if i % 2 else 'b'}.example.com/{i}")
+        active = {}
+        peak = {}
+
+        async def fetch_page(url):
+            host = url.split("/")[2]
+            active[host] = active.get(host, 0) + 1
+            peak[host] = max(peak.get(host, 0), active[host])
+            await asyncio.sleep(0.02)
+            active[host] -= 1
+            return {"url": url, "status": 200}
+
+        pages = [r async for r, _ in main.crawl_pages(frontier, fetch_page, max_pages=12, concurrency=6, per_host=2)]
+        assert len(pages) == 12
+        assert max(peak.values()) <= 2
+
+    asyncio.run(run())
+
+def test_crawl_per_host_waiters_do_not_hold_window_slots():
+    async def run():
+        active = [0, 0]  # current, peak
+        started_at = {}
+
+        async def fetch_page(url):
+            started_at[url] = time.monotonic()
+            active[0] += 1
+            active[1] = max(active[1], active[0])
+            await asyncio.sleep(0.05)
+            active[0] -= 1
+            return {"url": url, "status": 200}
+
+        # A single-host crawl may use the whole window
+        frontier = main.CrawlFrontier(allowed_host="example.com")
+        for i in range(20):
+            frontier.add(f"https://example.com/p/{i}")
+        pages = [r async for r, _ in main.crawl_pages(frontier, fetch_page, max_pages=20, concurrency=10)]
+        assert len(pages) == 20 and active[1] == 10
+
+        # Ten queued URLs for one host must not keep the other host's URLs out of the window
+        frontier = main.CrawlFrontier()
+        for i in range(10):
+            frontier.add(f"https://a.example.com/{i}")
+        frontier.add("https://b.example.com/1")
+        frontier.add("https://b.example.com/2")
+        begin = time.monotonic()
+        pages = [r async for r, _ in main.crawl_pages(frontier, fetch_page, max_pages=12, concurrency=4, per_host=2)]
+        assert len(pages) == 12 and frontier.stats["visited"] == 12
+        assert started_at["https://b.example.com/2"] - begin < 0.02
+
+    asyncio.run(run())
+
+def test_crawl_budget_counts_only_analysed_pages():
+    async def run():
+        frontier = main.CrawlFrontier(allowed_host="example.com")
+        for i in range(30):
+            frontier.add(f"https://example.com/{'files' if i % 2 else 'p'}/{i}")
+
+        async def fetch_page(url):
+            await asyncio.sleep(0.01)
+            return {"url": url, "skipped": "/files/" in url}
+
+        results = [r async for r, _ in main.crawl_pages(frontier, fetch_page, max_pages=10, concurrency=4,
+                                                         counts=lambda r: not r["skipped"])]
+        # Downloads are fetched but leave room for ten real pages
+        assert sum(1 for r in results if not r["skipped"]) == 10
+
+    asyncio.run(run())
+
+def test_crawl_time_budget_keeps_partial_results():
+    async def run():
+        frontier = main.CrawlFrontier(allowed_host="example.com")
+        for i in range(20):
+            frontier.add(f"https://example.com/p/{i}")
+
+        async def fetch_page(url):
+            # Half the pages hang well past the budget
+            await asyncio.sleep(10 if int(url.rsplit("/", 1)[1]) % 2 else 0.01)
+            return {"url": url, "status": 200}
+
+        started = time.monotonic()
+        pages = [r async for r, _ in main.crawl_pages(frontier, fetch_page, max_pages=20, concurrency=20, per_host=20, time_budget=0.3)]
+        elapsed = time.monotonic() - started
+        assert len(pages) == 10
+        assert elapsed < 1
+        assert frontier.stats["cancelled"] == 10
+        assert frontier.stats["budget_exhausted"] == 1
+
+    asyncio.run(run())
+
+def test_page_signals_single_pass():
+    html = b"""<html><head><title>Home</title><meta name="description" content="Desc">
+    <meta name="robots" content="NOINDEX"><meta name="viewport">
+    <link rel="canonical" href="https://example.com/"><link rel="canonical" href="https://example.com/second">
+    <script type="application/ld+json">{"@type": "WebSite"}</script><script>var cookie = "accept";</script>
+    <style>.x{}</style></head><body><!-- hidden comment -->
+    <header style="position: FIXED"><a href="/about">About <b>Us</b></a></header>
+    <h1>A</h1><h1>B</h1><h3>C</h3><img src="http://cdn/x.png" loading="LAZY"><img alt="ok">
+    <div class="popup big"></div><div class="modal"></div><div class="overlay"></div>
+    <form></form><a href="#top"></a></body></html>"""
+    signals = main.extract_page_signals(html, "utf-8")
+    assert signals.title == "Home"
+    assert signals.meta == {"description": "Desc", "robots": "NOINDEX", "viewport": None}
+    assert signals.canonical == "https://example.com/"
+    assert signals.headings == {"h1": 2, "h2": 0, "h3": 1, "h4": 0, "h5": 0, "h6": 0}
+    assert (signals.image_count, signals.lazy_images, signals.images_missing_alt) == (2, 1, 1)
+    assert signals.json_ld == ['{"@type": "WebSite"}']
+    assert signals.links == [("/about", "aboutus"), ("#top", "")]
+    # Script text counts for the cookie banner check (as find_all(string=True) did) but not for page text
+    assert signals.cookie_consent
+    assert signals.text == "Home About Us A B C"
+    assert signals.word_count == 6
+    assert signals.popup_count == 3 and signals.sticky_nav and signals.has_form and signals.insecure_resources
+
+def test_page_record_is_compact():
+    html = b"<html><body><p>Mail us at team@example.com or call +1 555 123 4567</p><a href='/a'>a</a><a href='/a'>again</a></body></html>"
+    fields = main.parse_crawl_page("https://example.com/contact", html, "utf-8")
+    table = main.UrlTable()
+    outlinks = tuple(table.intern(link) for link in fields.pop("links"))
+    record = main.PageRecord(table.intern("https://example.com/contact"), 200, outlinks=outlinks, **fields)
+
+    assert record.has_email and record.has_phone and not record.has_title
+    assert record.word_count == 12 and len(record.content_hash) == 16
+    assert record.outlinks == (0, 0) and table.url(0) == "https://example.com/a" and len(table) == 2
+    assert not hasattr(record, "__dict__")
+    try:
+        record.status = 404
+        assert False, "PageRecord should be immutable"
+    except AttributeError:
+        pass
+
+def test_fetch_document_caps_and_aborts():
+    def handler(request):
+        if request.url.path == "/huge":
+            async def body():
+                for _ in range(50):
+                    yield b"x" * 10000
+            return httpx.Response(200, content=body(), headers={"content-type": "text/html", "content-length": "500000"})
+        if request.url.path == "/download":
+            return httpx.Response(200, content=b"%PDF" + b"0" * 300000, headers={"content-type": "application/pdf"})
+        return httpx.Response(200, content=b"<p>ok</p>", headers={"content-type": "text/html; charset=utf-8"})
+
+    async def run():
+        stats = main.Counter()
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            huge = await main.fetch_document(client, "https://example.com/huge", 5.0, max_bytes=100000, html_only=True, stats=stats)
+            pdf = await main.fetch_document(client, "https://example.com/download", 5.0, html_only=True, stats=stats)
+            ok = await main.fetch_document(client, "https://example.com/", 5.0, html_only=True, stats=stats)
+        assert huge.truncated and len(huge.content) == 100000
+        assert pdf.skipped and pdf.content == b""
+        assert ok.text == "<p>ok</p>" and not ok.truncated and not ok.skipped
+        assert stats["aborted_non_html"] == 1 and stats["truncated"] == 1
+        assert stats["bytes_avoided"] >= 300000 + 400000
+        assert stats["bytes_downloaded"] < 101000
+
+    asyncio.run(run())
+    frontier = main.CrawlFrontier(allowed_host="example.com")
+    assert not frontier.add("https://example.com/files/report.PDF")
+    assert not frontier.add("https://example.com/img/logo.png?v=2")
+    assert frontier.add("https://example.com/blog/pdf-tips")
+    assert frontier.stats["skipped_assets"] == 2
+
+def test_parse_pool_matches_inline():
+    html = (b"<html><head><title>T</title><meta name='description' content='d'></head><body>"
+            b"<p>" + b"word " * 50000 + b"</p><a href='/a'>a</a><a href='mailto:x@y.z'>m</a>"
+            b"<img src='http://insecure/x.png'></body></html>")
+    inline = main.parse_crawl_page("https://example.com/", html, "utf-8")
+    assert inline["links"] == ["https://example.com/a"]
+    assert inline["has_title"] and inline["has_description"] and inline["has_mixed"]
+
+    async def run():
+        saved = main.PARSE_WORKERS, main.PARSE_INLINE_MAX_BYTES
+        main.shutdown_parse_pool()  # the pool is sized on first use
+        main.PARSE_WORKERS = 1
+        main.PARSE_INLINE_MAX_BYTES = 1024
+        try:
+            # Small payloads stay on the loop, large ones go to the pool
+            small = await main.run_parser(main.parse_candidate_page, b"<form></form>", "utf-8", size=13)
+            offloaded = await main.run_parser(main.parse_crawl_page, "https://example.com/", html, "utf-8", size=len(html))
+        finally:
+            main.shutdown_parse_pool()
+            main.PARSE_WORKERS, main.PARSE_INLINE_MAX_BYTES = saved
+        assert small == {"text": "", "has_form": True}
+        assert offloaded == inline
+        assert main.METRICS["parse.offloaded"] >= 1
+
+    asyncio.run(run())
+
+def test_sitemap_reader_streams_indexes_and_gzip():
+    ns = "http://www.sitemaps.org/schemas/sitemap/0.9"
+    def urlset(paths, prefix=""):
+        tag = f"{prefix}:" if prefix else ""
+        xmlns = f"xmlns:{prefix}" if prefix else "xmlns"
+        body = "".join(f"<{tag}url><{tag}loc>https://example.com{p}</{tag}loc><{tag}priority>0.8</{tag}priority></{tag}url>" for p in paths)
+        return f'<?xml version="1.0"?><{tag}urlset {xmlns}="{ns}">{body}</{tag}urlset>'.encode()
+    files = {
+        "/sitemap.xml": f'<sitemapindex xmlns="{ns}"><sitemap><loc>https://example.com/posts.xml.gz</loc></sitemap>'
+                        f'<sitemap><loc>https://example.com/nested.xml</loc></sitemap></sitemapindex>'.encode(),
+        "/posts.xml.gz": gzip.compress(urlset([f"/post-{i}" for i in range(3000)], prefix="sm")),
+        "/nested.xml": f'<sitemapindex xmlns="{ns}"><sitemap><loc>https://example.com/deep.xml</loc></sitemap></sitemapindex>'.encode(),
+        "/deep.xml": urlset(["/deep"]),
+        "/pages.xml": urlset(["/about", "/contact"]),
+    }
+    requested = []
+
+    def handler(request):
+        requested.append(request.url.path)
+        if request.url.path not in files:
+            return httpx.Response(404)
+        async def body():
+            data = files[request.url.path]
+            for i in range(0, len(data), 1000):
+                yield data[i:i + 1000]
+        return httpx.Response(200, content=body())
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            roots = ["https://example.com/sitemap.xml", "https://example.com/pages.xml", "https://example.com/sitemap.xml"]
+            full = await main.read_sitemaps(client, roots, max_depth=1, keep=10)
+            budgeted = await main.read_sitemaps(client, roots, url_budget=500)
+        return full, budgeted
+
+    full, budgeted = asyncio.run(run())
+    # Depth 1 follows the index into posts.xml.gz and nested.xml but not nested.xml's own children
+    assert full.url_count == 3002 and full.is_index and full.truncated
+    assert "/deep.xml" not in requested and requested.count("/sitemap.xml") == 2
+    # Breadth-first: both roots before the index children
+    assert full.entries[0] == ("https://example.com/about", None, 0.8) and full.entries[2][0] == "https://example.com/post-0"
+    assert len(full.entries) == 10
+    gz = next(f for f in full.files if f.url.endswith(".gz"))
+    assert gz.gzipped and gz.is_valid and gz.url_count == 3000
+    # The URL budget stops reading mid-file and leaves the remaining sitemaps unread
+    assert budgeted.url_count == 500 and budgeted.truncated
+    assert not any(f.url.endswith("nested.xml") for f in budgeted.files)
+
+def test_crawl_priority_orders_sitemap_seeds():
+    now = main.datetime.datetime(2026, 10, 1, tzinfo=main.datetime.timezone.utc)
+    seeds = [
+        ("https://example.com/tag/news/", "2026-09-30", 1.0),
+        ("https://example.com/blog/page/4", None, None),
+        ("https://example.com/blog/2019/old-post", "2019-01-01", 0.3),
+        ("https://example.com/blog/fresh-post", "2026-09-28T10:00:00+00:00", 0.8),
+        ("https://example.com/pricing", None, 0.5),
+        ("https://example.com/author/jane", None, None),
+        ("https://example.com/search?q=x", None, None),
+    ]
+    frontier = main.CrawlFrontier(allowed_host="example.com")
+    for loc, lastmod, priority in seeds:
+        frontier.add(loc, depth=1, priority=main.crawl_priority(loc, 1, lastmod, priority, now))
+    order = [frontier.pop()[0].split("example.com")[1] for _ in range(len(seeds))]
+    assert order[:3] == ["/blog/fresh-post", "/pricing", "/blog/2019/old-post"]
+    assert order[3] == "/blog/page/4"
+    assert set(order[4:]) == {"/tag/news/", "/author/jane", "/search?q=x"}
+    # A malformed lastmod is ignored rather than failing the crawl
+    assert main.crawl_priority("https://example.com/a", lastmod="yesterday") == main.crawl_priority("https://example.com/a")
+
+def test_link_checker_caches_across_scans():
+    with fresh_link_cache():
+        probes = []
+        active = {}
+        peak = {}
+
+        async def handler(request):
+            host = request.url.host
+            probes.append((request.method, str(request.url)))
+            active[host] = active.get(host, 0) + 1
+            peak[host] = max(peak.get(host, 0), active[host])
+            await asyncio.sleep(0.01)
+            active[host] -= 1
+            if request.url.path.startswith("/gone"):
+                return httpx.Response(404)
+            return httpx.Response(200)
+
+        links = [f"https://cdn.example.net/a/{i}" for i in range(30)] + ["https://example.com/gone", "https://example.com/gone/?utm_source=x"]
+
+        async def run():
+            async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+                first = await main.check_links(client, links, max_fetches=20, per_host=3)
+                second = await main.check_links(client, links, max_fetches=20, per_host=3)
+            return first, second
+
+        first, second = asyncio.run(run())
+        # The utm variant collapses into /gone; a 404 HEAD is retried with GET
+        assert len(first) == 20 and not any(s["cached"] for s in first.values())
+        assert max(peak.values()) <= 3
+        # Second scan: the 20 known links are cache hits, the budget goes to the 11 still unchecked
+        assert len(second) == 31 and sum(s["cached"] for s in second.values()) == 20
+        assert second["https://example.com/gone"]["broken"] and second["https://example.com/gone"]["status"] == 404
+        assert ("GET", "https://example.com/gone") in probes
+        # Broken links expire sooner than working ones
+        ok_entry = main.link_cache._memory[main.link_cache._cache_key("https://cdn.example.net/a/0")]
+        gone_entry = main.link_cache._memory[main.link_cache._cache_key("https://example.com/gone")]
+        assert gone_entry[1] < ok_entry[1]
+
+def test_link_checker_fills_global_slots_and_skips_caching_network_errors():
+    with fresh_link_cache():
+        active = [0, 0]  # current, peak
+
+        async def handler(request):
+            if request.url.host == "down.example.org":
+                raise httpx.ConnectError("connection refused")
+            active[0] += 1
+            active[1] = max(active[1], active[0])
+            await asyncio.sleep(0.02)
+            active[0] -= 1
+            return httpx.Response(200)
+
+        # Same-site links sort first; they must not park in the global slots while their host is busy
+        links = [f"https://example.com/p/{i}" for i in range(10)] + [f"https://other-{i}.example.net/" for i in range(10)]
+
+        async def run():
+            async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+                statuses = await main.check_links(client, links, concurrency=4, per_host=2)
+                down = await main.check_links(client, ["https://down.example.org/x"])
+            return statuses, down
+
+        statuses, down = asyncio.run(run())
+        assert len(statuses) == 20 and active[1] == 4
+        # A failure on our side is reported, but not cached for every other scan
+        assert down["https://down.example.org/x"] == {"status": 0, "broken": True, "cached": False}
+        assert main.link_cache._cache_key("https://down.example.org/x") not in main.link_cache._memory
+
+def test_link_checker_reports_unparsable_links_as_broken():
+    with fresh_link_cache():
+        transport = httpx.MockTransport(lambda request: httpx.Response(200))
+        links = ["https://example.com/ok", "https://example.com:8o8o/", "https://example.com:99999/", "http://[::1/"]
+
+        async def run():
+            async with httpx.AsyncClient(transport=transport) as client:
+                return await main.check_links(client, links)
+
+        statuses = asyncio.run(run())
+        assert statuses["https://example.com/ok"]["broken"] is False
+        for url in links[1:]:
+            assert statuses[url] == {"status": 0, "broken": True, "cached": False}
+
+if __name__ == "__main__":
+    test_crawl_url_key_collapses_duplicates()
+    test_frontier_dedups_and_orders()
+    test_frontier_skips_unparsable_urls()
+    test_frontier_scales_linearly()
+    test_bloom_frontier()
+    test_sliding_window_crawl_uneven_latency()
+    test_crawl_respects_per_host_limit()
+    test_crawl_per_host_waiters_do_not_hold_window_slots()
+    test_crawl_budget_counts_only_analysed_pages()
+    test_crawl_time_budget_keeps_partial_results()
+    test_page_signals_single_pass()
+    test_page_record_is_compact()
+    test_fetch_document_caps_and_aborts()
+    test_parse_pool_matches_inline()
+    test_sitemap_reader_streams_indexes_and_gzip()
+    test_crawl_priority_orders_sitemap_seeds()
+    test_link_checker_caches_across_scans()
+    test_link_checker_fills_global_slots_and_skips_caching_network_errors()
+    test_link_checker_reports_unparsable_links_as_broken()
@@ -0,0 +1,178 @@
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import tempfile
+
+# Mock env vars before importing main
+os.environ["SUPABASE_URL"] = "http://mock.url"
+os.environ["SUPABASE_SERVICE_ROLE_KEY"] = "mock_key"
+
+import httpx
+import main
+
+FIXTURE = os.path.join(os.path.dirname(__file__), "fixtures", "safe_browsing_lists.json")
+
+def load_fixture():
+    with open(FIXTURE) as f:
+        return json.load(f)
+
+def fixture_transport(fixture, calls):
+    def handler(request):
+        calls.append(request.url.path)
+        if request.url.path.endswith("threatListUpdates:fetch"):
+            return httpx.Response(200, json=fixture["threatListUpdates"])
+        if request.url.path.endswith("fullHashes:find"):
+            # Like the real API, only answer for the prefixes that were asked about
+            asked = [base64.b64decode(e["hash"]) for e in json.loads(request.content)["threatInfo"]["threatEntries"]]
+            matches = [m for m in fixture["fullHashes"]["matches"]
+                       if any(base64.b64decode(m["threat"]["hash"]).startswith(p) for p in asked)]
+            return httpx.Response(200, json=dict(fixture["fullHashes"], matches=matches))
+        return httpx.Response(404)
+    return httpx.MockTransport(handler)
+
+def test_canonicalization_matches_spec_examples():
+    cases = {
+        "http://host/%25%32%35": "host/%25",
+        "http://host/%25%32%35%25%32%35": "host/%25%25",
+        "http://host/%2525252525252525": "host/%25",
+        "http://host/asdf%25%32%35asd": "host/asdf%25asd",
+        "http://www.google.com/": "www.google.com/",
+        "http://%31%36%38%2e%31%38%38%2e%39%39%2e%32%36/%2E%73%65%63%75%72%65/%77%77%77%2E%65%62%61%79%2E%63%6F%6D/": "168.188.99.26/.secure/www.ebay.com/",
+        "http://3279880203/blah": "195.127.0.11/blah",
+        "http://www.google.com/blah/..": "www.google.com/",
+        "www.google.com/": "www.google.com/",
+        "www.google.com": "www.google.com/",
+        "http://www.evil.com/blah#frag": "www.evil.com/blah",
+        "http://www.GOOgle.com/": "www.google.com/",
+        "http://www.google.com.../": "www.google.com/",
+        "http://www.google.com/foo\tbar\rbaz\n2": "www.google.com/foobarbaz2",
+        "http://www.google.com/q?": "www.google.com/q?",
+        "http://www.google.com/q?r?": "www.google.com/q?r?",
+        "http://www.google.com/q?r?s": "www.google.com/q?r?s",
+        "http://evil.com/foo#bar#baz": "evil.com/foo",
+        "http://evil.com/foo;": "evil.com/foo;",
+        "http://evil.com/foo?bar;": "evil.com/foo?bar;",
+        "http://notrailingslash.com": "notrailingslash.com/",
+        "http://www.gotaport.com:1234/": "www.gotaport.com/",
+        "  http://www.google.com/  ": "www.google.com/",
+        "http://..host.com/": "host.com/",
+        "http://host.com//twoslashes?more//slashes": "host.com/twoslashes?more//slashes",
+        "http://\x01\x7f.com/": "%01%7F.com/",
+        "http://www.google.com/././p": "www.google.com/p",
+        "http://www.google.com/a/../b/./c/": "www.google.com/b/c/",
+    }
+    for url, expected in cases.items():
+        host, path, query = main.sb_canonicalize(url)
+        got = host + path + (f"?{query}" if query is not None else "")
+        assert got == expected, f"{url!r}: {got!r} != {expected!r}"
+
+def test_expressions_cover_host_suffixes_and_path_prefixes():
+    assert main.sb_expressions("http://a.b.c/1/2.html?param=1") == [
+        "a.b.c/1/2.html?param=1", "a.b.c/1/2.html", "a.b.c/", "a.b.c/1/",
+        "b.c/1/2.html?param=1", "b.c/1/2.html", "b.c/", "b.c/1/",
+    ]
+    expressions = main.sb_expressions("http://a.b.c.d.e.f.g/1.html")
+    assert [e.split("/")[0] for e in expressions[::2]] == ["a.b.c.d.e.f.g", "c.d.e.f.g", "d.e.f.g", "e.f.g", "f.g"]
+    assert main.sb_expressions("http://1.2.3.4/1/") == ["1.2.3.4/1/", "1.2.3.4/"]
+    assert len(main.sb_expressions("http://a.b.c/1/2/3/4/5/6?x")) == 2 * 6
+
+def test_local_database_checks_urls_without_network():
+    fixture = load_fixture()
+    main.SAFE_BROWSING_API_KEY = "test-sb-key"
+    calls = []
+
+    async def run():
+        db = main.SafeBrowsingDB(path=tempfile.mkdtemp())
+        async with httpx.AsyncClient(transport=fixture_transport(fixture, calls)) as client:
+            wait = await db.update(client)
+            assert db.ready and wait == 1800 and all(lst.state for key, lst in db.lists.items() if key[0] in ("MALWARE", "SOCIAL_ENGINEERING"))
+            listed = len(base64.b64decode(fixture["threatListUpdates"]["listUpdateResponses"][0]["additions"][0]["rawHashes"]["rawHashes"])) // 4
+            assert len(db.lists[("MALWARE", "ANY_PLATFORM", "URL")]) == listed > 100
+
+            clean = await db.check([f"https://site-{i}.example.org/page/{i}" for i in range(500)], client)
+            assert all(v["status"] == "safe" for v in clean.values())
+            assert calls.count("/v4/fullHashes:find") == 0  # no prefix hits, no network
+
+            urls = [
+                "http://testsafebrowsing.appspot.com/s/malware.html",
+                "https://TestSafeBrowsing.appspot.com/s/phishing.html#frag",
+                "http://www.evil.example/any/page.html",  # whole host listed
+                "http://example.com/",                    # prefix collision, full hash not listed
+                "http://long-prefix.example/x",           # 8-byte prefix list entry
+            ]
+            verdicts = await db.check(urls, client)
+            assert calls.count("/v4/fullHashes:find") == 1  # all hits confirmed in one call
+            assert verdicts[urls[0]]["threats"] == ["MALWARE"]
+            assert verdicts[urls[1]]["threats"] == ["SOCIAL_ENGINEERING"]
+            assert verdicts[urls[2]]["status"] == "unsafe"
+            assert verdicts[urls[3]] == {"status": "safe", "threats": [], "local": True}
+            assert verdicts[urls[4]]["status"] == "unsafe"
+
+            # Positive and negative full-hash caches: the repeat costs no call
+            again = await db.check(urls, client)
+            assert again == verdicts and calls.count("/v4/fullHashes:find") == 1
+
+            # check_safe_browsing answers from the local lists once they are synced
+            main.safe_browsing_db = db
+            try:
+                routed = await main.check_safe_browsing(urls[:1] + ["https://fine.example.net/"], client)
+            finally:
+                main.safe_browsing_db = None
+            assert routed[urls[0]]["status"] == "unsafe" and routed["https://fine.example.net/"]["local"]
+
+        # Lists survive a restart
+        db.save()
+        reloaded = main.SafeBrowsingDB(path=db.path)
+        reloaded.load()
+        for key, lst in db.lists.items():
+            assert reloaded.lists[key].state == lst.state
+            assert reloaded.lists[key].sorted_prefixes() == lst.sorted_prefixes()
+
+    asyncio.run(run())
+
+def test_full_hash_caches_drop_expired_entries():
+    main.SAFE_BROWSING_API_KEY = "test-sb-key"
+    db = main.SafeBrowsingDB(path=tempfile.mkdtemp())
+    now = main.time.time()
+    db.positive = {b"old-hash": (["MALWARE"], now - 1), b"live-hash": (["MALWARE"], now + 600)}
+    db.negative = {b"old": now - 1, b"live": now + 600}
+    transport = httpx.MockTransport(lambda request: httpx.Response(200, json={"negativeCacheDuration": "300s"}))
+
+    async def run():
+        async with httpx.AsyncClient(transport=transport) as client:
+            assert await db._find_full_hashes(client, {b"new!"})
+
+    asyncio.run(run())
+    assert set(db.positive) == {b"live-hash"}
+    assert set(db.negative) == {b"live", b"new!"}
+
+def test_partial_update_removals_and_checksum():
+    prefixes = sorted(hashlib.sha256(str(i).encode()).digest()[:4] for i in range(10))
+    lst = main.ThreatList(("MALWARE", "ANY_PLATFORM", "URL"))
+    assert lst.apply({"responseType": "FULL_UPDATE", "newClientState": "s1",
+                      "additions": [{"rawHashes": {"prefixSize": 4, "rawHashes": base64.b64encode(b"".join(prefixes)).decode()}}]})
+
+    added = hashlib.sha256(b"new").digest()[:4]
+    expected = sorted([p for i, p in enumerate(prefixes) if i not in (0, 5)] + [added])
+    update = {
+        "responseType": "PARTIAL_UPDATE", "newClientState": "s2",
+        "removals": [{"rawIndices": {"indices": [0, 5]}}],
+        "additions": [{"rawHashes": {"prefixSize": 4, "rawHashes": base64.b64encode(added).decode()}}],
+        "checksum": {"sha256": base64.b64encode(hashlib.sha256(b"".join(expected)).digest()).decode()},
+    }
+    assert lst.apply(update) and lst.state == "s2"
+    assert lst.sorted_prefixes() == expected
+
+    # A checksum that disagrees resets the list so the next sync asks for a full update
+    bad = dict(update, removals=[], additions=[], checksum={"sha256": base64.b64encode(b"\0" * 32).decode()})
+    assert not lst.apply(bad)
+    assert lst.state == "" and len(lst) == 0
+
+if __name__ == "__main__":
+    test_canonicalization_matches_spec_examples()
+    test_expressions_cover_host_suffixes_and_path_prefixes()
+    test_local_database_checks_urls_without_network()
+    test_full_hash_caches_drop_expired_entries()
+    test_partial_update_removals_and_checksum()
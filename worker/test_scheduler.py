@@ -0,0 +1,102 @@
+import asyncio
+import os
+import time
+
+# Mock env vars before importing main
+os.environ["SUPABASE_URL"] = "http://mock.url"
+os.environ["SUPABASE_SERVICE_ROLE_KEY"] = "mock_key"
+
+import main
+
+def test_scheduler_overlaps_scans():
+    async def run():
+        pending = [{"id": f"scan_{i}", "site_id": "site"} for i in range(12)]
+        finished = []
+
+        async def mock_claim_pending_scans(limit=5):
+            # Claiming takes rows out of the pending pool, like the RPC does
+            batch = pending[:limit]
+            del pending[:limit]
+            return batch
+
+        async def mock_process_scan(scan_record):
+            await asyncio.sleep(0.2)
+            finished.append(scan_record["id"])
+
+        async def mock_renew_scan_leases(scan_ids):
+            pass
+
+        main.claim_pending_scans = mock_claim_pending_scans
+        main.renew_scan_leases = mock_renew_scan_leases
+        main.process_scan = mock_process_scan
+
+        scheduler = main.ScanScheduler(concurrency=4, queue_size=4, poll_interval=0.05)
+        started = time.monotonic()
+        await scheduler.start()
+        while len(finished) < 12 and time.monotonic() - started < 5:
+            await asyncio.sleep(0.02)
+        elapsed = time.monotonic() - started
+        await scheduler.stop()
+
+        print(f"Finished {len(finished)} scans in {elapsed:.2f}s with 4 slots")
+        assert len(finished) == 12
+        assert len(set(finished)) == 12, "a scan was processed twice"
+        # 12 scans x 0.2s serially would take 2.4s
+        assert elapsed < 1.5
+
+    asyncio.run(run())
+
+def test_notifier_wakes_idle_scheduler():
+    async def run():
+        pending = []
+        picked_up = {}
+
+        async def mock_claim_pending_scans(limit=5):
+            batch = pending[:limit]
+            del pending[:limit]
+            return batch
+
+        async def mock_process_scan(scan_record):
+            picked_up[scan_record["id"]] = time.monotonic()
+
+        main.claim_pending_scans = mock_claim_pending_scans
+        main.process_scan = mock_process_scan
+
+        # Fallback polling is 30s here, so only the notification can explain a fast pickup
+        notifier = main.LocalScanNotifier()
+        scheduler = main.ScanScheduler(concurrency=2, queue_size=2, poll_interval=30, notifier=notifier, safety_poll_interval=30)
+        await scheduler.start()
+        await asyncio.sleep(0.1)  # let the refill loop go idle
+
+        inserted_at = time.monotonic()
+        pending.append({"id": "scan_new", "site_id": "site"})
+        notifier.notify("scan_new")
+        while "scan_new" not in picked_up and time.monotonic() - inserted_at < 2:
+            await asyncio.sleep(0.01)
+        await scheduler.stop()
+
+        assert "scan_new" in picked_up, "notification did not wake the scheduler"
+        latency = picked_up["scan_new"] - inserted_at
+        print(f"Insert -> process_scan latency: {latency * 1000:.1f} ms")
+        assert latency < 0.5
+
+    asyncio.run(run())
+
+def test_psi_budget_pause_does_not_drain_tokens():
+    budget = main.TokenBucket(per_day=400)
+    budget.pause(0.05)
+    # Spending resumes when the pause ends, not after a 1/rate (216s) refill deficit
+    assert 0 < budget.wait_time() <= 0.05
+
+    async def run():
+        started = time.monotonic()
+        assert await budget.acquire(max_wait=1.0)
+        assert time.monotonic() - started < 0.5
+
+    asyncio.run(run())
+    assert budget.remaining == 399
+
+if __name__ == "__main__":
+    test_scheduler_overlaps_scans()
+    test_notifier_wakes_idle_scheduler()
+    test_psi_budget_pause_does_not_drain_tokens()
@@ -16,9 +16,9 @@ async def test_ssl():
 
 async def test_safe_browsing():
     print("\n--- Safe Browsing Check Test ---")
-    res = await check_safe_browsing("http://malware.testing.google.test/testing/malware/")
+    res = await check_safe_browsing(["http://malware.testing.google.test/testing/malware/"])
     print("Malware URL:", res)
-    res2 = await check_safe_browsing("https://google.com")
+    res2 = await check_safe_browsing(["https://google.com"])
     print("Clean URL:", res2)
 
 async def run_all():
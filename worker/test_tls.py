@@ -0,0 +1,147 @@
+import asyncio
+import os
+import socket
+import ssl
+
+# Mock env vars before importing main
+os.environ["SUPABASE_URL"] = "http://mock.url"
+os.environ["SUPABASE_SERVICE_ROLE_KEY"] = "mock_key"
+
+import main
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+
+async def tls_server(name):
+    """Local TLS server using fixtures/<name>.pem; returns (server, port, client context, handshakes)."""
+    server_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    server_context.load_cert_chain(os.path.join(FIXTURES, f"{name}.pem"), os.path.join(FIXTURES, f"{name}.key"))
+    handshakes = []
+
+    async def handle(reader, writer):
+        handshakes.append(1)
+        writer.close()
+
+    server = await asyncio.start_server(handle, "127.0.0.1", 0, ssl=server_context)
+    port = server.sockets[0].getsockname()[1]
+    client_context = ssl.create_default_context(cafile=os.path.join(FIXTURES, f"{name}.pem"))
+    return server, port, client_context, handshakes
+
+def test_tls_probe_reports_certificate_details():
+    async def run():
+        server, port, context, _ = await tls_server("tls_rsa")
+        async with server:
+            meta = await main.tls_probe("localhost", port, context=context)
+        assert meta["subject"] == {"O": "Test Org", "CN": "localhost"} and meta["issuer"]["O"] == "Test Org"
+        assert meta["san"] == ["localhost", "127.0.0.1"]
+        assert meta["key"] == {"type": "RSA", "bits": 2048}
+        assert meta["signature_algorithm"] == "sha256WithRSAEncryption"
+        assert meta["protocol"].startswith("TLS") and meta["cipher"]
+        assert meta["chain"] == []  # self-signed: the verified chain is just the leaf
+
+        server, port, context, _ = await tls_server("tls_ec")
+        async with server:
+            meta = await main.tls_probe("localhost", port, context=context)
+        assert meta["key"] == {"type": "EC", "curve": "P-256", "bits": 256}
+        assert meta["signature_algorithm"] == "ecdsa-with-SHA256"
+        assert meta["san"] == ["localhost", "www.localhost"]
+
+    asyncio.run(run())
+
+def test_verify_ssl_caches_by_host_and_serial():
+    main.tls_cert_cache = main.ResultCache("tls_certs", main.TLS_CERT_CACHE_TTL, persistent=False)
+
+    async def run():
+        server, port, context, handshakes = await tls_server("tls_rsa")
+        async with server:
+            first = await main.verify_ssl(f"https://localhost:{port}/", context=context)
+            second = await main.verify_ssl(f"https://localhost:{port}/page", context=context)
+            fresh = await main.verify_ssl(f"https://localhost:{port}/", use_cache=False, context=context)
+            # An untrusted certificate fails the handshake, as before
+            untrusted = await main.verify_ssl(f"https://localhost:{port}/", use_cache=False)
+            await asyncio.sleep(0.05)
+        assert first["status"] == "passed" and first["valid"] and first["days_remaining"] > 3650
+        assert first["issuer"] == "Test Org" and first["key"]["bits"] == 2048 and not first["cached"]
+        # The repeat scan is answered from the cache without another handshake
+        assert second["cached"] and second["serial"] == first["serial"]
+        assert len(handshakes) == 2 and not fresh["cached"]  # the untrusted attempt never completes one
+        # Results are copies: a stage downgrading its result must not touch the cached entry
+        second["status"] = "failed"
+        assert (await main.verify_ssl(f"https://localhost:{port}/", context=context))["status"] == "passed"
+        assert untrusted["status"] == "failed" and untrusted["protocol"] == "HTTP"
+        assert "CERTIFICATE_VERIFY_FAILED" in untrusted["error"]
+
+    asyncio.run(run())
+
+def test_ssl_sweep_records_results_and_alerts_once():
+    main.tls_cert_cache = main.ResultCache("tls_certs", main.TLS_CERT_CACHE_TTL, persistent=False)
+    main.SSL_ALERT_DAYS = [50000, 30]  # the fixture certificates are valid for 100 years
+    recorded, notifications, webhook_payloads = [], [], []
+
+    async def fake_record(checks):
+        recorded.extend(checks)
+        return True
+
+    async def fake_notification(user_id, title, message, notif_type="success", action_url=None):
+        notifications.append((user_id, title, notif_type))
+
+    async def fake_webhooks(user_id, event_type="scan.completed"):
+        return [{"url": "https://hooks.example/ssl"}] if event_type == "ssl.expiring" else []
+
+    async def fake_dispatch(webhooks, payload):
+        webhook_payloads.append(payload)
+
+    main.record_ssl_checks = fake_record
+    main.create_notification = fake_notification
+    main.fetch_user_webhooks = fake_webhooks
+    main.dispatch_webhooks = fake_dispatch
+
+    async def run():
+        server, port, context, handshakes = await tls_server("tls_rsa")
+        closed = socket.socket()
+        closed.bind(("127.0.0.1", 0))
+        closed_port = closed.getsockname()[1]
+        closed.close()
+        sites = [
+            {"id": "s1", "user_id": "u1", "domain": "localhost", "url": f"https://localhost:{port}/"},
+            {"id": "s2", "user_id": "u2", "domain": "localhost", "url": f"https://localhost:{port}/blog"},
+            {"id": "s3", "user_id": "u3", "domain": "down.test", "url": f"https://127.0.0.1:{closed_port}/", "ssl_alerted_days": 7},
+        ]
+        batches = [sites]
+
+        async def fake_claim(limit=main.SSL_MONITOR_BATCH):
+            return batches.pop() if batches else []
+
+        main.claim_ssl_checks = fake_claim
+        async with server:
+            summary = await main.run_ssl_sweep(context=context)
+            await asyncio.sleep(0.05)
+            assert len(handshakes) == 1  # both sites on the host share one handshake
+
+            # Next sweep: the rows now carry the threshold already alerted, so nothing is re-sent
+            batches.append([dict(site, ssl_alerted_days=row["ssl_alerted_days"]) for site, row in zip(sites, recorded)])
+            await main.run_ssl_sweep(context=context)
+        return summary
+
+    summary = asyncio.run(run())
+    assert summary["sites"] == 3 and summary["hosts"] == 2 and summary["failed"] == 1 and summary["alerts"] == 2
+    rows = {row["id"]: row for row in recorded[:3]}
+    assert rows["s1"]["ssl_data"]["status"] == "passed" and rows["s1"]["ssl_alerted_days"] == 50000
+    assert rows["s1"]["ssl_expires_at"] == rows["s1"]["ssl_data"]["expires_at"]
+    # An unreachable host is recorded as failed but keeps its alert state and sends nothing
+    assert rows["s3"]["ssl_data"]["status"] == "failed" and rows["s3"]["ssl_alerted_days"] == 7 and rows["s3"]["ssl_expires_at"] is None
+    assert sorted(n[0] for n in notifications) == ["u1", "u2"] and notifications[0][2] == "warning"
+    assert {p["site_id"] for p in webhook_payloads} == {"s1", "s2"} and not webhook_payloads[0]["expired"]
+    assert len(recorded) == 6 and len(notifications) == 2
+
+    # A certificate that has already expired fails verification; it alerts as expired
+    error = ssl.SSLCertVerificationError("certificate verify failed: certificate has expired")
+    error.verify_code = main.X509_V_ERR_CERT_HAS_EXPIRED
+    row, notify = main.site_ssl_check({"id": "s4", "ssl_alerted_days": 7, "ssl_expires_at": "2026-01-01T00:00:00+00:00"}, error)
+    assert notify == 0 and row["ssl_alerted_days"] == 0 and row["ssl_data"]["expires_at"].startswith("2026-01-01")
+    assert main.site_ssl_check({"id": "s4", "ssl_alerted_days": 0}, error)[1] is None
+    main.SSL_ALERT_DAYS = [30, 14, 7, 1]
+
+if __name__ == "__main__":
+    test_tls_probe_reports_certificate_details()
+    test_verify_ssl_caches_by_host_and_serial()
+    test_ssl_sweep_records_results_and_alerts_once()